@@ -0,0 +1,291 @@
+"""
+批量生成命令行工具：从CSV或JSONL读取主题与参数，批量生成视频脚本或小红书文案，
+在并发数与速率限制内调用模型，每完成一条立即追加写入JSONL结果文件；
+中断后重新运行同一命令会跳过已成功的行，只处理剩余与失败的行（同一行换用其他任务类型或模型时会重新生成）。
+
+示例：
+    python batch_cli.py themes.csv --task video --concurrency 4 --rate 2
+    python batch_cli.py posts.jsonl --task xhs --output posts.results.jsonl
+
+输入的每一行至少包含 theme；可选列与界面上的选项一致：
+    视频脚本：length, creativity, style, audience, hooks, cta, sectioned
+    小红书：content_type, tone, num_variations, audience, hashtags, emoji, parallel
+可用 id 列指定行标识（用于断点续跑），否则按行内容生成；task 列可以逐行覆盖 --task
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+import utils
+from parallel import run_concurrent
+from ratelimit import TokenBucket
+
+TASKS = ("video", "xhs")
+
+_TRUE = {"1", "true", "yes", "y", "是", "需要"}
+_FALSE = {"0", "false", "no", "n", "否", "不需要", ""}
+
+
+def _to_bool(value):
+    if isinstance(value, bool):
+        return value
+    text = str(value).strip().lower()
+    if text in _TRUE:
+        return True
+    if text in _FALSE:
+        return False
+    raise ValueError(f"无法识别的布尔值：{value}")
+
+
+def _number(value):
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+def _convert(value, kind):
+    if kind is bool:
+        return _to_bool(value)
+    if kind is int:
+        return int(float(value))
+    return kind(value)
+
+
+# 各任务可从输入行读取的参数及其类型
+VIDEO_OPTIONS = {
+    'length': _number, 'creativity': float, 'style': str, 'audience': str,
+    'hooks': bool, 'cta': bool, 'sectioned': bool,
+}
+XHS_OPTIONS = {
+    'content_type': str, 'tone': str, 'num_variations': int, 'audience': str,
+    'hashtags': bool, 'emoji': bool, 'parallel': bool,
+}
+
+
+def read_rows(path):
+    """
+    按行读取CSV或JSONL输入（按扩展名判断），产出字典
+    """
+    if path.lower().endswith((".jsonl", ".ndjson")):
+        with open(path, encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"第{line_no}行不是有效的JSON：{e}")
+                if not isinstance(row, dict):
+                    raise ValueError(f"第{line_no}行不是JSON对象")
+                yield row
+    else:
+        # utf-8-sig 兼容 Excel 导出的带BOM文件
+        with open(path, encoding="utf-8-sig", newline="") as f:
+            for row in csv.DictReader(f):
+                yield {k.strip(): v for k, v in row.items() if k is not None}
+
+
+def row_id(row):
+    """
+    行标识：优先使用 id 列，否则为行内容的哈希（行顺序变化不影响续跑）
+    """
+    if row.get('id') not in (None, ""):
+        return str(row['id'])
+    canonical = json.dumps(row, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha1(canonical.encode("utf-8")).hexdigest()[:16]
+
+
+def load_done(output_path):
+    """
+    读取已有结果文件中成功完成的 (行标识, 任务类型, 模型)；崩溃时写了一半的最后一行会被忽略
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(record, dict) and record.get('status') == "ok":
+                done.add((record.get('id'), record.get('task'), record.get('model')))
+    return done
+
+
+def build_call(row, task, args):
+    """
+    把输入行转换为对应生成函数的调用，返回无参可调用对象
+    """
+    theme = str(row.get('theme') or "").strip()
+    if not theme:
+        raise ValueError("缺少 theme")
+    options = VIDEO_OPTIONS if task == "video" else XHS_OPTIONS
+    kwargs = {}
+    for name, kind in options.items():
+        value = row.get(name)
+        if value is None or (isinstance(value, str) and not value.strip() and kind is not str):
+            continue
+        try:
+            kwargs[name] = _convert(value, kind)
+        except (TypeError, ValueError):
+            raise ValueError(f"参数 {name} 的值无效：{value}")
+    common = dict(base_url=args.base_url, model=args.model, temperature=args.temperature)
+
+    if task == "video":
+        length = kwargs.pop('length', args.length)
+        creativity = kwargs.pop('creativity', args.creativity)
+        return lambda: utils.generate_video_script_enhanced(theme, length, creativity, args.api_key,
+                                                            **common, **kwargs)
+    return lambda: utils.generate_xiaohongshu_content_enhanced(theme, args.api_key, **common, **kwargs)
+
+
+class ResultWriter:
+    """
+    结果追加写入：每条结果写完即刷新到磁盘，进程崩溃最多丢失正在写的一行
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # 上次崩溃可能留下没有换行的半行，先补上换行，避免与新记录粘在一起
+        needs_newline = False
+        if os.path.exists(path) and os.path.getsize(path):
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b"\n"
+        self._file = open(path, "a", encoding="utf-8")
+        if needs_newline:
+            self._file.write("\n")
+
+    def write(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+def _record(rid, row, task, model, **fields):
+    record = {'id': rid, 'task': task, 'model': model, 'input': row,
+              'finished_at': datetime.now().isoformat(timespec="seconds")}
+    record.update(fields)
+    return record
+
+
+def run_batch(args):
+    """
+    执行批量任务，返回 (成功数, 失败数, 跳过数)
+    """
+    output = args.output or os.path.splitext(args.input)[0] + ".results.jsonl"
+    done = set() if args.no_resume else load_done(output)
+    bucket = TokenBucket(args.rate, args.burst) if args.rate else None
+
+    jobs = []
+    skipped = 0
+    seen = set()
+    for row in read_rows(args.input):
+        rid = row_id(row)
+        task = str(row.get('task') or args.task).strip()
+        # 续跑按 (行标识, 任务类型, 模型) 判断，同一输入换用其他任务或模型时不会被跳过
+        key = (rid, task, args.model)
+        if key in done or key in seen:
+            skipped += 1
+            continue
+        seen.add(key)
+        jobs.append((rid, row, task))
+        if args.limit and len(jobs) >= args.limit:
+            break
+
+    total = len(jobs)
+    print(f"共 {total} 条待处理，跳过已完成 {skipped} 条，结果写入 {output}", file=sys.stderr)
+    if not total:
+        return 0, 0, skipped
+
+    def make_task(call):
+        def run():
+            waited = bucket.acquire() if bucket is not None else 0.0
+            start = time.perf_counter()
+            text = call()
+            return text, time.perf_counter() - start, waited
+
+        return run
+
+    writer = ResultWriter(output)
+    ok = failed = 0
+
+    def report(record, row):
+        writer.write(record)
+        print(f"[{ok + failed}/{total}] {record['status']:<5} {record['id']} {row.get('theme', '')}",
+              file=sys.stderr)
+
+    try:
+        runnable = []
+        tasks = []
+        for rid, row, task in jobs:
+            try:
+                if task not in TASKS:
+                    raise ValueError(f"未知的任务类型：{task}")
+                call = build_call(row, task, args)
+            except ValueError as e:
+                # 参数错误的行不调用模型，直接记为失败
+                failed += 1
+                report(_record(rid, row, task, args.model, status="error", error=str(e)), row)
+                continue
+            runnable.append((rid, row, task))
+            tasks.append(make_task(call))
+
+        for index, result, error in run_concurrent(tasks, max_workers=args.concurrency, max_retries=args.retries):
+            rid, row, task = runnable[index]
+            if error is None:
+                text, seconds, waited = result
+                ok += 1
+                record = _record(rid, row, task, args.model, status="ok", output=text,
+                                 seconds=round(seconds, 3), rate_wait_seconds=round(waited, 3))
+            else:
+                failed += 1
+                record = _record(rid, row, task, args.model, status="error", error=str(error))
+            report(record, row)
+    finally:
+        writer.close()
+    return ok, failed, skipped
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量生成视频脚本或小红书文案")
+    parser.add_argument("input", help="输入文件（.csv 或 .jsonl）")
+    parser.add_argument("--output", default=None, help="结果JSONL路径，默认与输入同名的 .results.jsonl")
+    parser.add_argument("--task", choices=TASKS, default="video", help="默认任务类型（可被输入中的 task 列覆盖）")
+    parser.add_argument("--api-key", default=os.environ.get("OPENAI_API_KEY"), help="默认读取 OPENAI_API_KEY")
+    parser.add_argument("--base-url", default="https://api.openai-hk.com/v1")
+    parser.add_argument("--model", default="gpt-4o-mini")
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--length", type=float, default=3, help="输入未指定时的视频时长（分钟）")
+    parser.add_argument("--creativity", type=float, default=0.5, help="输入未指定时的创造力")
+    parser.add_argument("--concurrency", type=int, default=4, help="同时进行的生成数")
+    parser.add_argument("--rate", type=float, default=2.0, help="每秒最多发起的生成数，0表示不限速")
+    parser.add_argument("--burst", type=float, default=None, help="允许的突发请求数，默认与 --rate 相同")
+    parser.add_argument("--retries", type=int, default=1, help="失败行的重试次数")
+    parser.add_argument("--limit", type=int, default=0, help="本次最多处理的行数，0表示全部")
+    parser.add_argument("--no-resume", action="store_true", help="忽略已有结果，全部重新生成")
+    args = parser.parse_args(argv)
+
+    if not args.api_key:
+        parser.error("请通过 --api-key 或环境变量 OPENAI_API_KEY 提供API密钥")
+
+    try:
+        ok, failed, skipped = run_batch(args)
+    except (OSError, ValueError) as e:
+        print(f"批量生成失败：{str(e)}", file=sys.stderr)
+        return 2
+    print(f"完成：成功 {ok} 条，失败 {failed} 条，跳过 {skipped} 条", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,301 @@
+"""
+本地的 OpenAI 兼容替身服务，用于离线基准测试：
+支持 /v1/chat/completions（流式SSE与非流式）、/v1/embeddings 与 /v1/models，
+可配置首字延迟、每秒token数与错误注入；相同的提示词总是得到相同的输出。
+与OpenAI一样模拟提示词前缀缓存：与近期请求相同的前缀达到1024个token后，按128个token为单位计入 cached_tokens。
+
+单独启动：python -m benchmarks.fake_openai --port 8765 --latency 0.3 --tps 80
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+EMBEDDING_DIM = 256
+
+# 提示词前缀缓存的最短长度与粒度（token，替身服务中每个字符记为一个token）
+PROMPT_CACHE_MIN_TOKENS = 1024
+PROMPT_CACHE_BLOCK = 128
+# 用于匹配前缀的近期提示词数量
+PROMPT_CACHE_ENTRIES = 256
+
+_CSV_RESPONSE = """[CODE]
+import plotly.express as px
+numeric = df.select_dtypes('number').columns.tolist()
+if len(numeric) >= 2:
+    fig = px.scatter(df, x=numeric[0], y=numeric[1])
+else:
+    fig = px.histogram(df, x=df.columns[0])
+st.plotly_chart(fig)
+[ENDCODE]
+[ANALYSIS]
+数据整体分布较为均匀，数值列之间存在一定的相关性，未发现明显的异常值。建议进一步按类别拆分观察。
+[ENDANALYSIS]
+[CHART_TYPE]
+散点图
+[ENDCHART_TYPE]"""
+
+_OUTLINE_RESPONSE = {
+    "title": "基准测试视频",
+    "hook": "你知道吗？",
+    "sections": [
+        {"heading": "背景", "minutes": 2, "points": ["要点一", "要点二"]},
+        {"heading": "核心内容", "minutes": 4, "points": ["要点一", "要点二", "要点三"]},
+        {"heading": "案例", "minutes": 3, "points": ["要点一"]},
+        {"heading": "总结", "minutes": 1, "points": ["回顾"]},
+    ],
+    "summary": "今天的内容就到这里。",
+    "shooting_notes": "近景与空镜穿插。",
+}
+
+_FILLER = ("这是一段用于基准测试的确定性输出，内容本身没有意义，只用来模拟模型逐字返回的节奏。"
+           "我们在这里继续补充一些文字，使输出长度接近真实回复。")
+
+
+def _prompt_text(messages):
+    parts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, list):
+            content = " ".join(item.get("text", "") for item in content if isinstance(item, dict))
+        parts.append(content or "")
+    return "\n".join(parts)
+
+
+def canned_response(prompt, max_chars=400):
+    """
+    根据提示词返回确定性的回复：CSV分析返回带 [CODE] 的格式，视频大纲返回JSON，其余返回填充文本
+    """
+    if "[CODE]" in prompt and "[ENDCODE]" in prompt:
+        return _CSV_RESPONSE
+    if '"sections"' in prompt:
+        return json.dumps(_OUTLINE_RESPONSE, ensure_ascii=False)
+    seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8], 16)
+    start = seed % len(_FILLER)
+    text = (_FILLER[start:] + _FILLER) * (max_chars // len(_FILLER) + 2)
+    if "小红书" in prompt:
+        return "**标题：** 基准测试好物分享\n**正文：** " + text[:max_chars] + "\n**标签：** #测试 #基准"
+    return text[:max_chars]
+
+
+def _tokens(text, size=2):
+    # 每个token按2个字符切分，模拟中文输出的粒度
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def fake_embedding(item):
+    if isinstance(item, list):
+        item = ",".join(str(x) for x in item)
+    seed = int(hashlib.sha256(str(item).encode("utf-8")).hexdigest()[:16], 16)
+    rng = random.Random(seed)
+    vector = [rng.gauss(0, 1) for _ in range(EMBEDDING_DIM)]
+    norm = sum(v * v for v in vector) ** 0.5
+    return [v / norm for v in vector]
+
+
+class FakeOpenAIConfig:
+    """
+    替身服务的行为配置，运行期间可修改
+    """
+
+    def __init__(self, latency=0.2, tokens_per_second=100.0, error_rate=0.0, retry_after=1.0, max_chars=400,
+                 seed=0):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.max_chars = max_chars
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.recent_prompts = []
+
+    def cached_tokens(self, prompt):
+        """
+        与近期提示词的最长公共前缀中可命中缓存的token数，并记录本次提示词
+        """
+        with self.lock:
+            longest = max((len(os.path.commonprefix([prompt, seen])) for seen in self.recent_prompts), default=0)
+            self.recent_prompts.append(prompt)
+            del self.recent_prompts[:-PROMPT_CACHE_ENTRIES]
+        if longest < PROMPT_CACHE_MIN_TOKENS:
+            return 0
+        return longest // PROMPT_CACHE_BLOCK * PROMPT_CACHE_BLOCK
+
+    def should_fail(self):
+        with self.lock:
+            self.requests += 1
+            if self.error_rate and self.rng.random() < self.error_rate:
+                self.errors += 1
+                return True
+            return False
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "gpt-4o-mini", "object": "model"}]})
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        body = self._read_body()
+        config = self.config
+        if config.should_fail():
+            self._send_json(429, {"error": {"message": "Rate limit reached (injected)", "type": "rate_limit"}},
+                            headers={"Retry-After": f"{config.retry_after:g}"})
+            return
+        path = self.path.rstrip("/")
+        if path.endswith("/chat/completions"):
+            self._chat(body)
+        elif path.endswith("/embeddings"):
+            self._embeddings(body)
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def _embeddings(self, body):
+        inputs = body.get("input")
+        if isinstance(inputs, str) or (isinstance(inputs, list) and inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        time.sleep(self.config.latency / 4)
+        self._send_json(200, {
+            "object": "list",
+            "data": [{"object": "embedding", "index": i, "embedding": fake_embedding(item)}
+                     for i, item in enumerate(inputs or [])],
+            "model": body.get("model", "text-embedding-ada-002"),
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        })
+
+    def _chat(self, body):
+        config = self.config
+        prompt = _prompt_text(body.get("messages", []))
+        text = canned_response(prompt, config.max_chars)
+        tokens = _tokens(text)
+        model = body.get("model", "gpt-4o-mini")
+        usage = {"prompt_tokens": len(prompt), "completion_tokens": len(tokens),
+                 "total_tokens": len(prompt) + len(tokens),
+                 "prompt_tokens_details": {"cached_tokens": config.cached_tokens(prompt)}}
+        completion_id = "chatcmpl-" + hashlib.sha1(prompt.encode("utf-8")).hexdigest()[:12]
+        time.sleep(config.latency)
+
+        if not body.get("stream"):
+            if config.tokens_per_second:
+                time.sleep(len(tokens) / config.tokens_per_second)
+            self._send_json(200, {
+                "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": text},
+                             "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        interval = 1.0 / config.tokens_per_second if config.tokens_per_second else 0
+
+        def event(delta, finish_reason=None, extra=None):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            if extra:
+                chunk.update(extra)
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        try:
+            event({"role": "assistant", "content": ""})
+            for token in tokens:
+                event({"content": token})
+                if interval:
+                    time.sleep(interval)
+            include_usage = (body.get("stream_options") or {}).get("include_usage")
+            event({}, "stop", {"usage": usage} if include_usage else None)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.close_connection = True
+
+
+class FakeOpenAIServer:
+    """
+    在后台线程中运行的替身服务，base_url 可直接传给 utils 的各个函数
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, config=None):
+        self.config = config or FakeOpenAIConfig()
+        handler = type("Handler", (_Handler,), {"config": self.config})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 OpenAI 兼容替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2, help="首字延迟（秒）")
+    parser.add_argument("--tps", type=float, default=100.0, help="每秒输出的token数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回429的请求比例")
+    parser.add_argument("--max-chars", type=int, default=400, help="填充回复的长度")
+    args = parser.parse_args()
+    config = FakeOpenAIConfig(latency=args.latency, tokens_per_second=args.tps, error_rate=args.error_rate,
+                              max_chars=args.max_chars)
+    server = FakeOpenAIServer(args.host, args.port, config)
+    print(f"fake OpenAI server listening on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
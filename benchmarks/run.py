@@ -0,0 +1,330 @@
+"""
+离线基准测试：启动本地 OpenAI 兼容替身服务，驱动 utils 中的五个 *_enhanced 功能，
+统计单请求延迟（p50/p95）、并发吞吐量、冷启动导入耗时，以及不同规模的合成CSV/PDF的解析耗时，结果写入JSON，
+可在两次提交之间对比。
+
+运行：python -m benchmarks.run --out benchmarks/results.json
+对比：python -m benchmarks.run --compare old.json new.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from benchmarks.fake_openai import FakeOpenAIConfig, FakeOpenAIServer  # noqa: E402
+from benchmarks.startup import bench_startup  # noqa: E402
+
+API_KEY = "sk-benchmark"
+
+# 对比时数值越大越好的指标，其余（耗时、内存）越小越好
+_HIGHER_IS_BETTER = ("throughput_rps",)
+
+
+class _Upload:
+    """
+    模拟 Streamlit 上传文件对象
+    """
+
+    def __init__(self, data, name="benchmark.pdf"):
+        self._data = data
+        self.name = name
+
+    def getvalue(self):
+        return self._data
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def make_pdf(pages, lines_per_page=40):
+    """
+    生成指定页数的纯文本PDF（不依赖第三方库）
+    """
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for page in range(pages):
+        lines = [f"Page {page + 1} line {line + 1}: benchmark text about revenue, growth, risk and outlook "
+                 f"for segment {(page * lines_per_page + line) % 97}." for line in range(lines_per_page)]
+        text = " T* ".join(f"({line}) Tj" for line in lines)
+        stream = f"BT /F1 9 Tf 11 TL 40 800 Td {text} ET".encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_id = len(objects)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id)
+        page_ids.append(len(objects))
+    kids = b" ".join(b"%d 0 R" % i for i in page_ids)
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, pages)
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def make_csv(rows, seed=0):
+    """
+    生成指定行数的合成CSV字节串（数值、类别、日期与文本列）
+    """
+    import numpy as np
+    import pandas as pd
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'date': pd.date_range("2020-01-01", periods=rows, freq="min").astype(str),
+        'region': rng.choice(["华东", "华南", "华北", "西南", "西北"], rows),
+        'product': rng.choice([f"SKU-{i:04d}" for i in range(500)], rows),
+        'units': rng.integers(0, 1000, rows),
+        'price': np.round(rng.uniform(1, 500, rows), 2),
+        'score': rng.normal(0, 1, rows),
+    })
+    return df.to_csv(index=False).encode("utf-8")
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def bench_function(name, fn, iterations, concurrency):
+    """
+    先串行执行 iterations 次统计延迟，再以 concurrency 个线程并发执行统计吞吐量
+    """
+    errors = 0
+    cold = None
+    latencies = []
+    for i in range(iterations):
+        try:
+            elapsed = _timed(fn)
+        except Exception as e:
+            errors += 1
+            print(f"  {name} 第{i + 1}次失败：{e}", file=sys.stderr)
+            continue
+        if cold is None:
+            cold = elapsed
+        latencies.append(elapsed)
+
+    total = iterations * concurrency
+
+    def call(_):
+        try:
+            fn()
+            return True
+        except Exception:
+            return False
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        ok = sum(executor.map(call, range(total)))
+    wall = time.perf_counter() - start
+    errors += total - ok
+
+    result = {
+        'iterations': iterations,
+        'cold_seconds': cold,
+        'p50_seconds': percentile(latencies, 50),
+        'p95_seconds': percentile(latencies, 95),
+        'mean_seconds': statistics.mean(latencies) if latencies else None,
+        'concurrency': concurrency,
+        'throughput_rps': ok / wall if wall else None,
+        'errors': errors,
+    }
+    print(f"  {name}: p50={result['p50_seconds'] or 0:.3f}s p95={result['p95_seconds'] or 0:.3f}s "
+          f"吞吐={result['throughput_rps'] or 0:.2f}/s 失败={errors}")
+    return result
+
+
+def bench_functions(base_url, iterations, concurrency):
+    import pandas as pd
+    import utils
+
+    pdf = _Upload(make_pdf(20))
+    df = pd.read_csv(io.BytesIO(make_csv(2000)))
+    cases = {
+        'generate_video_script_enhanced': lambda: utils.generate_video_script_enhanced(
+            "城市夜跑", 3, 0.7, API_KEY, base_url=base_url, use_cache=False),
+        'generate_video_script_enhanced_sectioned': lambda: utils.generate_video_script_enhanced(
+            "城市夜跑", 10, 0.7, API_KEY, base_url=base_url, use_cache=False, sectioned=True),
+        'generate_xiaohongshu_content_enhanced': lambda: utils.generate_xiaohongshu_content_enhanced(
+            "秋季护肤", API_KEY, base_url=base_url, num_variations=3, use_cache=False),
+        'chat_with_pdf_enhanced': lambda: utils.chat_with_pdf_enhanced(
+            pdf, "第3页提到了哪些风险？", API_KEY, base_url=base_url, use_cache=False),
+        'analyze_csv_with_plot_enhanced': lambda: utils.analyze_csv_with_plot_enhanced(
+            df, "请分析数据的整体分布情况", API_KEY, base_url=base_url, use_cache=False),
+        'chat_with_ai_enhanced': lambda: utils.chat_with_ai_enhanced(
+            "介绍一下你自己", API_KEY, base_url=base_url, use_cache=False,
+            chat_history=[{'role': '用户', 'content': '你好'}, {'role': 'AI助手', 'content': '你好！'}]),
+    }
+    results = {}
+    for name, fn in cases.items():
+        results[name] = bench_function(name, fn, iterations, concurrency)
+    return results
+
+
+def bench_csv_ingest(row_counts):
+    import csv_ingest
+    results = {}
+    for rows in row_counts:
+        data = make_csv(rows)
+        ingest = csv_ingest.read_csv_optimized(data, size_bytes=len(data))
+        results[str(rows)] = {
+            'bytes': len(data),
+            'parse_seconds': ingest.parse_seconds,
+            'peak_rss_mb': ingest.peak_rss_mb,
+            'memory_mb': ingest.memory_mb,
+            'mode': ingest.mode,
+        }
+        print(f"  CSV {rows}行：{ingest.parse_seconds:.3f}s 占用{ingest.memory_mb:.1f}MB")
+    return results
+
+
+def bench_pdf_parse(page_counts):
+    import pdf_cache
+    results = {}
+    for pages in page_counts:
+        data = make_pdf(pages)
+        start = time.perf_counter()
+        parsed = pdf_cache.parse_pdf_bytes(data)
+        elapsed = time.perf_counter() - start
+        results[str(pages)] = {
+            'bytes': len(data),
+            'parse_seconds': elapsed,
+            'chunks': len(parsed.chunks),
+        }
+        print(f"  PDF {pages}页：{elapsed:.3f}s {len(parsed.chunks)}个分块")
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(args):
+    # 缓存目录与嵌入方式需在导入项目模块之前设置
+    os.environ.setdefault("AGENT_CACHE_DIR", tempfile.mkdtemp(prefix="agent-bench-"))
+    os.environ.setdefault("PDF_EMBEDDINGS", args.embeddings)
+
+    config = FakeOpenAIConfig(latency=args.latency, tokens_per_second=args.tps, error_rate=args.error_rate,
+                              max_chars=args.max_chars)
+    report = {
+        'meta': {
+            'commit': _git_commit(),
+            'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'config': vars(args),
+        },
+    }
+    if args.startup_repeats:
+        print("启动耗时：")
+        report['startup'] = bench_startup(args.startup_repeats)
+    with FakeOpenAIServer(config=config) as server:
+        print(f"替身服务：{server.base_url}")
+        if not args.skip_functions:
+            print("功能延迟与吞吐：")
+            report['functions'] = bench_functions(server.base_url, args.iterations, args.concurrency)
+        report['server'] = {'requests': config.requests, 'injected_errors': config.errors}
+    print("CSV解析：")
+    report['csv_ingest'] = bench_csv_ingest(args.csv_rows)
+    print("PDF解析：")
+    report['pdf_parse'] = bench_pdf_parse(args.pdf_pages)
+
+    if args.out:
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.out}")
+    return report
+
+
+def _flatten(data, prefix=""):
+    flat = {}
+    for key, value in data.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(old_path, new_path, threshold):
+    """
+    对比两份结果，打印各指标的变化，变差超过 threshold 的标记为回退；有回退时返回1
+    """
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    old_flat = _flatten({k: v for k, v in old.items() if k != 'meta'})
+    new_flat = _flatten({k: v for k, v in new.items() if k != 'meta'})
+    print(f"{old.get('meta', {}).get('commit')} -> {new.get('meta', {}).get('commit')}")
+    regressions = 0
+    for name in sorted(set(old_flat) & set(new_flat)):
+        before, after = old_flat[name], new_flat[name]
+        if name.endswith(('iterations', 'concurrency', 'bytes', 'errors', 'chunks')):
+            continue
+        change = (after - before) / before if before else 0.0
+        worse = -change if name.endswith(_HIGHER_IS_BETTER) else change
+        flag = ""
+        if worse > threshold:
+            flag = "  ← 回退"
+            regressions += 1
+        elif worse < -threshold:
+            flag = "  ← 提升"
+        print(f"{name:<70} {before:>10.4f} {after:>10.4f} {change:>+8.1%}{flag}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线基准测试")
+    parser.add_argument("--out", default=None, help="结果JSON的输出路径")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="对比两份结果JSON")
+    parser.add_argument("--threshold", type=float, default=0.1, help="对比时判定回退的相对变化")
+    parser.add_argument("--iterations", type=int, default=5, help="每个功能串行执行的次数")
+    parser.add_argument("--concurrency", type=int, default=8, help="吞吐测试的并发线程数")
+    parser.add_argument("--latency", type=float, default=0.2, help="替身服务的首字延迟（秒）")
+    parser.add_argument("--tps", type=float, default=200.0, help="替身服务每秒输出的token数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="替身服务返回429的比例")
+    parser.add_argument("--max-chars", type=int, default=400, help="替身服务填充回复的长度")
+    parser.add_argument("--embeddings", choices=["local", "remote"], default="local",
+                        help="PDF问答使用本地哈希嵌入或替身服务的嵌入接口")
+    parser.add_argument("--csv-rows", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--pdf-pages", type=int, nargs="+", default=[10, 50, 200])
+    parser.add_argument("--skip-functions", action="store_true", help="只测解析耗时")
+    parser.add_argument("--startup-repeats", type=int, default=3, help="每个模块冷启动导入的次数，0表示不测")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(compare(args.compare[0], args.compare[1], args.threshold))
+    run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+启动耗时基准：在全新的子进程中分别导入各模块并执行一次完整的页面脚本，
+记录导入耗时、首屏耗时以及被提前加载的重型依赖，用于发现冷启动回退。
+
+单独运行：python -m benchmarks.startup
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 冷启动时不应被加载的重型依赖
+HEAVY_MODULES = ("pandas", "numpy", "pyarrow", "langchain", "openai", "httpx", "faiss", "matplotlib",
+                 "seaborn", "plotly.express", "pypdf")
+
+# 单独测导入耗时的项目模块
+MODULES = ("utils", "chat_store", "chat_memory", "llm_client", "pdf_index", "csv_ingest", "sandbox")
+
+_IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+# 用 Streamlit 的 AppTest 执行一次 main.py，近似新会话首屏渲染的耗时
+_APP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+at = AppTest.from_file("main.py", default_timeout=120)
+at.run()
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'errors': len(at.exception),
+                  'loaded': [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def _run_child(script, env):
+    result = subprocess.run([sys.executable, "-c", script], cwd=ROOT, env=env, capture_output=True,
+                            text=True, timeout=300)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "子进程失败")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def _measure(script, repeats, env):
+    runs = [_run_child(script, env) for _ in range(repeats)]
+    seconds = [run['seconds'] for run in runs]
+    report = {
+        'median_seconds': statistics.median(seconds),
+        'min_seconds': min(seconds),
+        'heavy_loaded': len(runs[-1]['loaded']),
+        'loaded': runs[-1]['loaded'],
+    }
+    if 'errors' in runs[-1]:
+        report['errors'] = runs[-1]['errors']
+    return report
+
+
+def bench_startup(repeats=3, modules=MODULES):
+    """
+    每个模块在新进程中导入 repeats 次，取中位数；再测一次完整页面脚本的首屏耗时
+    """
+    env = dict(os.environ)
+    env.setdefault("AGENT_CACHE_DIR", tempfile.mkdtemp(prefix="agent-bench-"))
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    env["PYTHONWARNINGS"] = "ignore"
+    results = {'imports': {}}
+    for module in modules:
+        report = _measure(_IMPORT_SCRIPT.format(module=module, heavy=HEAVY_MODULES), repeats, env)
+        results['imports'][module] = report
+        print(f"  import {module}: {report['median_seconds']:.3f}s 重型依赖 {report['loaded'] or '无'}")
+    report = _measure(_APP_SCRIPT.format(heavy=HEAVY_MODULES), repeats, env)
+    results['first_paint'] = report
+    print(f"  首屏（main.py）：{report['median_seconds']:.3f}s 重型依赖 {report['loaded'] or '无'}")
+    return results
+
+
+if __name__ == "__main__":
+    print("启动耗时：")
+    bench_startup()
@@ -0,0 +1,219 @@
+"""
+PDF关键词检索索引（BM25）：中文按相邻两字切分、英文与数字按单词切分，建立倒排索引。
+倒排表以 numpy 数组按词紧凑存放（CSR 格式），按PDF内容哈希持久化，加载时内存映射；
+检索完全在本地完成，不需要嵌入模型。也可以与向量检索结果做倒数排名融合（RRF）
+"""
+import json
+import math
+import os
+import re
+import shutil
+import threading
+from collections import Counter, OrderedDict
+
+import numpy as np
+from langchain_core.documents import Document
+
+from config import cache_dir
+
+# 分词规则或存储格式变化时递增，旧索引自动失效
+INDEX_VERSION = 1
+
+# BM25 参数
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# 倒数排名融合的平滑常数
+RRF_K = 60
+
+# 内存中最多保留的已加载索引数量
+MAX_LOADED_INDEXES = 16
+
+_TOKEN_PATTERN = re.compile(r"[一-鿿]+|[a-z0-9_]+")
+
+_loaded_indexes = OrderedDict()
+_loaded_lock = threading.Lock()
+# 正在构建的文档：doc_hash -> [构建锁, 引用数]，最后一个使用者结束后移除
+_build_locks = {}
+
+
+def tokenize(text):
+    """
+    分词：连续汉字切成相邻两字（单个汉字保留本身），英文与数字按单词
+    """
+    tokens = []
+    for run in _TOKEN_PATTERN.findall(text.lower()):
+        if run[0].isascii():
+            tokens.append(run)
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class BM25Index:
+    """
+    一份文档的BM25索引：词表、CSR 倒排表（indptr / doc_ids / tfs）、各文本块长度与原文
+    """
+
+    def __init__(self, terms, indptr, doc_ids, tfs, doc_len, docs):
+        self.terms = {term: i for i, term in enumerate(terms)}
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_len = doc_len
+        self.docs = docs
+        self.avgdl = float(doc_len.mean()) if len(doc_len) else 0.0
+
+    @classmethod
+    def build(cls, chunks):
+        """
+        从文本块迭代器构建索引，边读取文本块边分词
+        """
+        docs = []
+        postings = {}
+        lengths = []
+        for chunk in chunks:
+            doc_id = len(docs)
+            docs.append(chunk)
+            counts = Counter(tokenize(chunk.page_content))
+            lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((doc_id, tf))
+
+        terms = sorted(postings)
+        indptr = np.zeros(len(terms) + 1, dtype=np.int64)
+        for i, term in enumerate(terms):
+            indptr[i + 1] = indptr[i] + len(postings[term])
+        doc_ids = np.empty(indptr[-1], dtype=np.int32)
+        tfs = np.empty(indptr[-1], dtype=np.float32)
+        for i, term in enumerate(terms):
+            entries = np.asarray(postings[term])
+            doc_ids[indptr[i]:indptr[i + 1]] = entries[:, 0]
+            tfs[indptr[i]:indptr[i + 1]] = entries[:, 1]
+        return cls(terms, indptr, doc_ids, tfs, np.asarray(lengths, dtype=np.float32), docs)
+
+    def save(self, path):
+        """
+        先写临时目录再原子替换，避免并发读取到半成品
+        """
+        tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        os.makedirs(tmp_path, exist_ok=True)
+        for name in ("indptr", "doc_ids", "tfs", "doc_len"):
+            np.save(os.path.join(tmp_path, f"{name}.npy"), getattr(self, name))
+        meta = {
+            'terms': sorted(self.terms, key=self.terms.get),
+            'docs': [[d.page_content, d.metadata] for d in self.docs],
+        }
+        with open(os.path.join(tmp_path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False, separators=(',', ':'), default=str)
+        if os.path.exists(path):
+            shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        # 倒排表内存映射，多个会话共享操作系统的页缓存
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+                  for name in ("indptr", "doc_ids", "tfs", "doc_len")}
+        docs = [Document(page_content=c, metadata=m) for c, m in meta['docs']]
+        return cls(meta['terms'], arrays['indptr'], arrays['doc_ids'], arrays['tfs'], arrays['doc_len'], docs)
+
+    def scores(self, query):
+        """
+        计算查询与每个文本块的BM25得分
+        """
+        scores = np.zeros(len(self.docs), dtype=np.float32)
+        if not self.docs:
+            return scores
+        n = len(self.docs)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * np.asarray(self.doc_len) / (self.avgdl or 1.0))
+        for term in set(tokenize(query)):
+            term_id = self.terms.get(term)
+            if term_id is None:
+                continue
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            doc_ids = self.doc_ids[start:end]
+            tfs = self.tfs[start:end]
+            df = end - start
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            scores[doc_ids] += idf * tfs * (BM25_K1 + 1) / (tfs + norm[doc_ids])
+        return scores
+
+    def search(self, query, top_k=4):
+        """
+        返回得分最高的 top_k 个 (文本块, 得分)，不含得分为0的文本块
+        """
+        scores = self.scores(query)
+        k = min(top_k, int(np.count_nonzero(scores)))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.docs[i], float(scores[i])) for i in top]
+
+
+def _index_path(doc_hash):
+    return os.path.join(cache_dir("bm25_index"), f"{doc_hash}-v{INDEX_VERSION}")
+
+
+def get_or_build_index(doc_hash, load_chunks):
+    """
+    获取文档的BM25索引：优先内存，其次磁盘，都没有时迭代 load_chunks() 产出的文本块构建一次后落盘
+    """
+    with _loaded_lock:
+        if doc_hash in _loaded_indexes:
+            _loaded_indexes.move_to_end(doc_hash)
+            return _loaded_indexes[doc_hash]
+        entry = _build_locks.setdefault(doc_hash, [threading.Lock(), 0])
+        entry[1] += 1
+
+    try:
+        # 同一文档只允许一个线程构建，其余线程等待后直接复用
+        with entry[0]:
+            return _load_or_build(doc_hash, load_chunks)
+    finally:
+        with _loaded_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _build_locks[doc_hash]
+
+
+def _load_or_build(doc_hash, load_chunks):
+    with _loaded_lock:
+        if doc_hash in _loaded_indexes:
+            return _loaded_indexes[doc_hash]
+
+    path = _index_path(doc_hash)
+    if os.path.exists(os.path.join(path, "meta.json")):
+        index = BM25Index.load(path)
+    else:
+        index = BM25Index.build(load_chunks())
+        if not index.docs:
+            raise ValueError("PDF中没有可检索的文本内容")
+        index.save(path)
+
+    with _loaded_lock:
+        _loaded_indexes[doc_hash] = index
+        _loaded_indexes.move_to_end(doc_hash)
+        while len(_loaded_indexes) > MAX_LOADED_INDEXES:
+            _loaded_indexes.popitem(last=False)
+    return index
+
+
+def rrf_fuse(rankings, top_k=4, k=RRF_K):
+    """
+    倒数排名融合：rankings 为多个按相关度排好序的 Document 列表，同一文本块（页码与内容相同）的得分相加
+    """
+    scores = {}
+    docs = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            key = (doc.metadata.get("page"), doc.page_content)
+            docs.setdefault(key, doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank + 1)
+    ordered = sorted(scores, key=scores.get, reverse=True)
+    return [docs[key] for key in ordered[:top_k]]
@@ -0,0 +1,265 @@
+"""
+图表精简：在序列化 Plotly 图表之前，按点数预算对大数据量的轨迹做服务端精简，避免把几十MB的数据发给浏览器。
+折线用LTTB降采样，散点按二维网格分箱聚合，柱状图先按类别预聚合，直方图预先分箱为柱状图。
+所有计算都是NumPy向量化实现
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+# 每条轨迹最多保留的点数
+CHART_POINT_BUDGET = int(os.environ.get("CHART_POINT_BUDGET", "5000"))
+
+# 与数据点一一对应、精简时需要同步处理的轨迹属性
+_PER_POINT_ATTRS = ("customdata", "text", "hovertext", "ids")
+_PER_POINT_MARKER_ATTRS = ("color", "size", "symbol", "opacity")
+
+
+def _numeric_axis(values):
+    """
+    把坐标转换为浮点数组（日期转为纳秒），返回 (数组, 是否日期)；无法转换时（类别轴）数组为 None
+    """
+    arr = np.asarray(values)
+    if np.issubdtype(arr.dtype, np.number) or arr.dtype == bool:
+        return arr.astype(np.float64), False
+    if np.issubdtype(arr.dtype, np.datetime64):
+        return _datetime_ns(arr), True
+    try:
+        return arr.astype(np.float64), False
+    except (ValueError, TypeError):
+        pass
+    try:
+        parsed = pd.to_datetime(arr, errors="raise", format="mixed")
+    except (ValueError, TypeError, OverflowError):
+        return None, False
+    return _datetime_ns(parsed.to_numpy()), True
+
+
+def _datetime_ns(arr):
+    arr = arr.astype("datetime64[ns]")
+    values = arr.astype(np.int64).astype(np.float64)
+    values[np.isnat(arr)] = np.nan
+    return values
+
+
+def _from_ns(values):
+    return pd.to_datetime(values.astype(np.int64)).to_numpy()
+
+
+def lttb_indices(x, y, threshold):
+    """
+    向量化的LTTB（Largest-Triangle-Three-Buckets）：x 需已排序，返回保留点的下标。
+    经典算法以上一个桶中被选中的点为顶点，逐桶串行；这里改用上一个桶的均值点为顶点，
+    各桶相互独立，可以一次性向量化计算，形状保持效果与经典算法接近
+    """
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    starts, ends = edges[:-1], edges[1:]
+    counts = ends - starts
+    # 每个桶的均值点
+    mean_x = np.add.reduceat(x[1:n - 1], starts - 1) / counts
+    mean_y = np.add.reduceat(y[1:n - 1], starts - 1) / counts
+    # 顶点A：上一个桶的均值（第一个桶用首点）；顶点C：下一个桶的均值（最后一个桶用尾点）
+    ax = np.concatenate(([x[0]], mean_x[:-1]))
+    ay = np.concatenate(([y[0]], mean_y[:-1]))
+    cx = np.concatenate((mean_x[1:], [x[n - 1]]))
+    cy = np.concatenate((mean_y[1:], [y[n - 1]]))
+
+    bucket = np.repeat(np.arange(len(counts)), counts)
+    px_, py_ = x[1:n - 1], y[1:n - 1]
+    area = np.abs((ax[bucket] - cx[bucket]) * (py_ - ay[bucket]) - (ax[bucket] - px_) * (cy[bucket] - ay[bucket]))
+    # 桶内按面积升序排列后，每个桶的最后一个即面积最大的点
+    order = np.lexsort((area, bucket))
+    chosen = order[np.cumsum(counts) - 1] + 1
+    return np.concatenate(([0], chosen, [n - 1]))
+
+
+def _subset_point_attrs(trace, index, n):
+    for attr in _PER_POINT_ATTRS:
+        value = trace[attr]
+        if value is not None and not isinstance(value, str) and np.ndim(value) and len(value) == n:
+            trace[attr] = np.asarray(value)[index]
+    for attr in _PER_POINT_MARKER_ATTRS:
+        value = trace.marker[attr] if "marker" in trace and attr in trace.marker else None
+        if value is not None and not isinstance(value, str) and np.ndim(value) and len(value) == n:
+            trace.marker[attr] = np.asarray(value)[index]
+
+
+def _drop_point_attrs(trace, n):
+    for attr in _PER_POINT_ATTRS:
+        value = trace[attr]
+        if value is not None and not isinstance(value, str) and np.ndim(value) and len(value) == n:
+            trace[attr] = None
+    for attr in _PER_POINT_MARKER_ATTRS:
+        value = trace.marker[attr] if "marker" in trace and attr in trace.marker else None
+        if value is not None and not isinstance(value, str) and np.ndim(value) and len(value) == n:
+            trace.marker[attr] = None
+
+
+def _reduce_line(trace, budget):
+    n = len(trace.y)
+    y, _ = _numeric_axis(trace.y)
+    if y is None:
+        return None
+    x_raw = np.asarray(trace.x) if trace.x is not None else np.arange(n)
+    x, _ = _numeric_axis(x_raw)
+    if x is None:
+        # 类别轴按位置降采样
+        x = np.arange(n, dtype=np.float64)
+    valid = ~(np.isnan(x) | np.isnan(y))
+    order = np.flatnonzero(valid)
+    order = order[np.argsort(x[order], kind="stable")]
+    keep = order[lttb_indices(x[order], y[order], budget)]
+    trace.x = x_raw[keep]
+    trace.y = np.asarray(trace.y)[keep]
+    _subset_point_attrs(trace, keep, n)
+    return f"折线「{trace.name or '数据'}」{n}→{len(keep)}点（LTTB降采样）"
+
+
+def _reduce_scatter(trace, budget):
+    n = len(trace.x)
+    x, x_is_datetime = _numeric_axis(trace.x)
+    y, _ = _numeric_axis(trace.y)
+    if x is None or y is None:
+        return None
+    valid = ~(np.isnan(x) | np.isnan(y))
+    x, y = x[valid], y[valid]
+    if not len(x):
+        return None
+    bins = max(2, int(np.sqrt(budget)))
+
+    def bin_index(values):
+        low, high = values.min(), values.max()
+        if high == low:
+            return np.zeros(len(values), dtype=np.int64)
+        return np.clip(((values - low) / (high - low) * bins).astype(np.int64), 0, bins - 1)
+
+    cells, inverse, counts = np.unique(bin_index(x) * bins + bin_index(y), return_inverse=True, return_counts=True)
+    mean_x = np.bincount(inverse, weights=x) / counts
+    mean_y = np.bincount(inverse, weights=y) / counts
+
+    color = trace.marker.color
+    if color is not None and not isinstance(color, str) and np.ndim(color) and len(color) == n:
+        color, _ = _numeric_axis(color)
+        color = None if color is None else np.bincount(inverse, weights=np.nan_to_num(color[valid])) / counts
+    else:
+        color = None
+    _drop_point_attrs(trace, n)
+
+    trace.x = _from_ns(mean_x) if x_is_datetime else mean_x
+    trace.y = mean_y
+    # 每个网格用其中点的均值表示，点的大小表示聚合的点数
+    trace.marker.size = 4 + 12 * np.sqrt(counts / counts.max())
+    if color is not None:
+        trace.marker.color = color
+    trace.customdata = counts
+    trace.hovertemplate = "x=%{x}<br>y=%{y}<br>点数=%{customdata}<extra></extra>"
+    return f"散点「{trace.name or '数据'}」{n}点→{len(cells)}个网格（二维分箱）"
+
+
+def _reduce_bar(trace, budget):
+    horizontal = trace.orientation == "h"
+    categories = np.asarray(trace.y if horizontal else trace.x)
+    values, _ = _numeric_axis(trace.x if horizontal else trace.y)
+    if values is None:
+        return None
+    n = len(categories)
+    values = np.nan_to_num(values)
+    numeric_axis, axis_is_datetime = _numeric_axis(categories)
+
+    if numeric_axis is not None and not np.isnan(numeric_axis).any():
+        # 数值/日期类别轴：重复的类别先合并（与Plotly堆叠显示一致），仍超出预算时按等宽区间求和
+        keys, inverse = np.unique(numeric_axis, return_inverse=True)
+        sums = np.bincount(inverse, weights=values)
+        if len(keys) > budget:
+            edges = np.linspace(keys[0], keys[-1], budget + 1)
+            index = np.clip(np.searchsorted(edges, keys, side="right") - 1, 0, budget - 1)
+            sums = np.bincount(index, weights=sums, minlength=budget)
+            keys = (edges[:-1] + edges[1:]) / 2
+            nonzero = sums != 0
+            keys, sums = keys[nonzero], sums[nonzero]
+        new_categories = _from_ns(keys) if axis_is_datetime else keys
+    else:
+        keys, inverse = np.unique(categories.astype(str), return_inverse=True)
+        sums = np.bincount(inverse, weights=values)
+        if len(keys) > budget:
+            # 只保留合计最大的类别，其余合并为「其他」
+            top = np.argsort(sums)[::-1][:budget - 1]
+            rest = np.ones(len(keys), dtype=bool)
+            rest[top] = False
+            keys = np.append(keys[top], "其他")
+            sums = np.append(sums[top], sums[rest].sum())
+        new_categories = keys
+
+    _drop_point_attrs(trace, n)
+    if horizontal:
+        trace.y, trace.x = new_categories, sums
+    else:
+        trace.x, trace.y = new_categories, sums
+    return f"柱状图「{trace.name or '数据'}」{n}条→{len(sums)}个类别（预聚合）"
+
+
+def _reduce_histogram(trace, budget):
+    if trace.y is not None or trace.histfunc not in (None, "count") or trace.histnorm:
+        return None, None
+    horizontal = trace.x is None
+    raw = trace.y if horizontal else trace.x
+    values, is_datetime = _numeric_axis(raw)
+    if values is None:
+        return None, None
+    values = values[~np.isnan(values)]
+    n = len(raw)
+    bins = min(trace.nbinsx or trace.nbinsy or 100, budget)
+    counts, edges = np.histogram(values, bins=bins)
+    centers = (edges[:-1] + edges[1:]) / 2
+    if is_datetime:
+        centers = _from_ns(centers)
+    bar = go.Bar(
+        x=counts if horizontal else centers, y=centers if horizontal else counts,
+        orientation="h" if horizontal else "v", width=None if is_datetime else np.diff(edges),
+        name=trace.name, legendgroup=trace.legendgroup, showlegend=trace.showlegend,
+        offsetgroup=trace.offsetgroup, marker=dict(color=trace.marker.color, opacity=trace.opacity),
+        xaxis=trace.xaxis, yaxis=trace.yaxis,
+    )
+    return bar, f"直方图「{trace.name or '数据'}」{n}个值→{len(counts)}个区间（预分箱）"
+
+
+def reduce_figure(fig, budget=CHART_POINT_BUDGET):
+    """
+    精简图表中超出点数预算的轨迹，返回 (fig, 说明列表)；没有精简时说明列表为空
+    """
+    notes = []
+    traces = list(fig.data)
+    changed = False
+    for i, trace in enumerate(traces):
+        note = None
+        if trace.type in ("scatter", "scattergl") and trace.y is not None and len(trace.y) > budget:
+            # 未指定 mode 时，Plotly 对超过20个点的轨迹只画线
+            mode = trace.mode or "lines"
+            if "lines" in mode:
+                note = _reduce_line(trace, budget)
+            elif trace.x is not None:
+                note = _reduce_scatter(trace, budget)
+        elif trace.type == "bar":
+            size = len(trace.y if trace.orientation == "h" else trace.x) if trace.x is not None and trace.y is not None else 0
+            if size > budget:
+                note = _reduce_bar(trace, budget)
+        elif trace.type == "histogram":
+            raw = trace.x if trace.x is not None else trace.y
+            if raw is not None and len(raw) > budget:
+                bar, note = _reduce_histogram(trace, budget)
+                if bar is not None:
+                    traces[i] = bar
+                    changed = True
+        if note:
+            notes.append(note)
+    if changed:
+        fig.data = ()
+        for trace in traces:
+            fig.add_trace(trace)
+        fig.update_layout(bargap=0)
+    return fig, notes
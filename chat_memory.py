@@ -0,0 +1,126 @@
+"""
+对话记忆：用本地估算器计算token数，在预算内原样保留最近的消息，
+更早的消息增量合并进滚动摘要（每条消息只被摘要一次），使提示词长度不随对话轮数增长
+"""
+import os
+import re
+
+# 最近消息原样保留的token预算
+HISTORY_TOKEN_BUDGET = int(os.environ.get("CHAT_HISTORY_TOKEN_BUDGET", "2000"))
+# 滚动摘要的token上限
+SUMMARY_TOKEN_BUDGET = int(os.environ.get("CHAT_SUMMARY_TOKEN_BUDGET", "500"))
+
+_CJK = re.compile(r"[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]")
+_WORD = re.compile(r"[A-Za-z0-9_]+|[^\sA-Za-z0-9_]")
+
+
+def estimate_tokens(text):
+    """
+    本地估算token数：中日韩字符约每字1个token，其余按英文单词（约4个字符1个token）与标点计
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    rest = _CJK.sub(" ", text)
+    tokens = 0
+    for piece in _WORD.findall(rest):
+        tokens += (len(piece) + 3) // 4 if piece[0].isalnum() or piece[0] == "_" else 1
+    return cjk + tokens
+
+
+def truncate_to_tokens(text, budget):
+    """
+    把超出预算的单条文本截为首尾两段，中间注明省略
+    """
+    total = estimate_tokens(text)
+    if total <= budget:
+        return text
+    # 按字符比例近似截取，首部保留2/3、尾部1/3
+    keep_chars = max(1, int(len(text) * budget / total))
+    head, tail = keep_chars * 2 // 3, keep_chars // 3
+    return text[:head] + f"\n……（中间省略约{total - budget}个token）……\n" + (text[-tail:] if tail else "")
+
+
+def message_tokens(msg):
+    return estimate_tokens(msg['content']) + 4
+
+
+class ChatMemory:
+    """
+    一个会话的对话记忆：summary 为更早消息的滚动摘要，summarized_count 为已并入摘要的消息条数
+    """
+
+    def __init__(self, budget=HISTORY_TOKEN_BUDGET, summary_budget=SUMMARY_TOKEN_BUDGET,
+                 summary="", summarized_count=0):
+        self.budget = budget
+        self.summary_budget = summary_budget
+        self.summary = summary
+        self.summarized_count = summarized_count
+
+    def window_start(self, history, offset=0):
+        """
+        在预算内能原样保留的最早一条消息的下标（至少保留最新一条）。
+        history 可以只是完整历史从第 offset 条开始的尾部，下标相对于 history
+        """
+        used = 0
+        start = len(history)
+        for index in range(len(history) - 1, -1, -1):
+            cost = message_tokens(history[index])
+            if used + cost > self.budget and start < len(history):
+                break
+            used += cost
+            start = index
+        # 已并入摘要的消息不再原样重复
+        summarized = max(0, self.summarized_count - offset)
+        return max(start, min(summarized, len(history) - 1 if history else 0))
+
+    def context(self, history, offset=0):
+        """
+        返回 (摘要, 最近消息列表)；单条超出预算的消息会被截断
+        """
+        recent = []
+        for msg in history[self.window_start(history, offset):]:
+            recent.append({'role': msg['role'], 'content': truncate_to_tokens(msg['content'], self.budget)})
+        return self.summary, recent
+
+    def pending(self, history, offset=0):
+        """
+        已移出窗口但尚未并入摘要的消息
+        """
+        return history[max(0, self.summarized_count - offset):self.window_start(history, offset)]
+
+    def update(self, history, summarize, offset=0):
+        """
+        把移出窗口的消息并入摘要：summarize(旧摘要, 新消息列表, token上限) 返回新摘要。
+        每轮对话后调用一次；没有新移出窗口的消息时不调用 summarize
+        """
+        pending = self.pending(history, offset)
+        if not pending:
+            return False
+        messages = [{'role': m['role'], 'content': truncate_to_tokens(m['content'], self.budget)} for m in pending]
+        self.summary = summarize(self.summary, messages, self.summary_budget)
+        self.summarized_count += len(pending)
+        return True
+
+    def prompt_tokens(self, history, offset=0):
+        """
+        按当前记忆构建的上下文的估算token数
+        """
+        summary, recent = self.context(history, offset)
+        return estimate_tokens(summary) + sum(message_tokens(m) for m in recent)
+
+    def reset(self):
+        self.summary = ""
+        self.summarized_count = 0
+
+    def to_dict(self):
+        return {
+            'budget': self.budget,
+            'summary_budget': self.summary_budget,
+            'summary': self.summary,
+            'summarized_count': self.summarized_count,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
@@ -0,0 +1,166 @@
+"""
+对话持久化：基于SQLite的只追加对话存储。每个会话有独立的对话ID，消息按序号追加写入，
+界面按页读取最新的消息；条数、字符数等统计在写入时增量维护，读取开销与对话长度无关。
+对话记忆（滚动摘要）也随对话保存，刷新页面后可以继续
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from config import cache_dir
+
+# 每页消息条数
+PAGE_SIZE = int(os.environ.get("CHAT_PAGE_SIZE", "20"))
+
+
+def new_conversation_id():
+    return uuid.uuid4().hex
+
+
+class ChatStore:
+    """
+    对话存储
+    """
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(cache_dir(), "chat_history.sqlite3")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS conversations (
+                id TEXT PRIMARY KEY,
+                created REAL NOT NULL,
+                updated REAL NOT NULL,
+                message_count INTEGER NOT NULL DEFAULT 0,
+                total_chars INTEGER NOT NULL DEFAULT 0,
+                memory TEXT
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS messages (
+                conversation_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                role TEXT NOT NULL,
+                content TEXT NOT NULL,
+                created REAL NOT NULL,
+                PRIMARY KEY (conversation_id, seq)
+            )
+        """)
+
+    def append(self, conversation_id, role, content):
+        """
+        追加一条消息，返回其序号（从0开始）
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO conversations (id, created, updated) VALUES (?, ?, ?)",
+                    (conversation_id, now, now)
+                )
+                seq = self._conn.execute(
+                    "SELECT message_count FROM conversations WHERE id = ?", (conversation_id,)
+                ).fetchone()[0]
+                self._conn.execute(
+                    "INSERT INTO messages (conversation_id, seq, role, content, created) VALUES (?, ?, ?, ?, ?)",
+                    (conversation_id, seq, role, content, now)
+                )
+                self._conn.execute(
+                    "UPDATE conversations SET message_count = message_count + 1, "
+                    "total_chars = total_chars + ?, updated = ? WHERE id = ?",
+                    (len(content), now, conversation_id)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return seq
+
+    def _rows(self, sql, params):
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [{'seq': seq, 'role': role, 'content': content} for seq, role, content in rows]
+
+    def page(self, conversation_id, before_seq=None, limit=PAGE_SIZE):
+        """
+        按时间顺序返回序号小于 before_seq 的最新 limit 条消息；before_seq 为 None 时从最新一条开始
+        """
+        if before_seq is None:
+            before_seq = 1 << 62
+        rows = self._rows(
+            "SELECT seq, role, content FROM messages WHERE conversation_id = ? AND seq < ? "
+            "ORDER BY seq DESC LIMIT ?", (conversation_id, before_seq, limit)
+        )
+        return rows[::-1]
+
+    def messages_from(self, conversation_id, start_seq=0):
+        """
+        返回序号不小于 start_seq 的全部消息
+        """
+        return self._rows(
+            "SELECT seq, role, content FROM messages WHERE conversation_id = ? AND seq >= ? ORDER BY seq",
+            (conversation_id, start_seq)
+        )
+
+    def iter_messages(self, conversation_id, batch_size=500):
+        """
+        按批次遍历整个对话（用于导出），不一次性读入内存
+        """
+        start = 0
+        while True:
+            rows = self._rows(
+                "SELECT seq, role, content FROM messages WHERE conversation_id = ? AND seq >= ? "
+                "ORDER BY seq LIMIT ?", (conversation_id, start, batch_size)
+            )
+            if not rows:
+                return
+            yield from rows
+            start = rows[-1]['seq'] + 1
+
+    def stats(self, conversation_id):
+        """
+        增量维护的对话统计：消息条数与总字符数
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT message_count, total_chars FROM conversations WHERE id = ?", (conversation_id,)
+            ).fetchone()
+        message_count, total_chars = row if row else (0, 0)
+        return {'message_count': message_count, 'total_chars': total_chars}
+
+    def save_memory(self, conversation_id, memory_state):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO conversations (id, created, updated, memory) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET memory = excluded.memory, updated = excluded.updated",
+                (conversation_id, now, now, json.dumps(memory_state, ensure_ascii=False))
+            )
+
+    def load_memory(self, conversation_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT memory FROM conversations WHERE id = ?", (conversation_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row and row[0] else None
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """
+    返回进程级共享的对话存储
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ChatStore()
+        return _store
@@ -0,0 +1,163 @@
+"""
+分析代码缓存：以数据表结构指纹（列名 + 粗粒度类型）和规范化后的分析请求为键，
+保存模型生成的画图代码、图表类型与分析文本。结构相同的新文件（如每日导出）再次做同样的分析时
+直接复用代码在本地执行，不再请求模型；代码执行失败时条目失效
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+import instrumentation
+from config import cache_dir
+from llm_cache import normalize_prompt
+
+# 条目有效期（秒），默认30天
+CODE_CACHE_TTL = float(os.environ.get("CODE_CACHE_TTL", str(30 * 24 * 3600)))
+
+
+def _dtype_kind(series):
+    # 降精度、缺失值和基数变化会改变具体dtype（如 uint8/uint16、object/category），只取粗粒度类型
+    if pd.api.types.is_bool_dtype(series):
+        return "bool"
+    if pd.api.types.is_numeric_dtype(series):
+        return "number"
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return "datetime"
+    return "text"
+
+
+def schema_fingerprint(df):
+    """
+    数据表结构指纹：按列顺序的 (列名, 类型) 的哈希
+    """
+    schema = [(str(name), _dtype_kind(df[name])) for name in df.columns]
+    raw = json.dumps(schema, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _key(fingerprint, query):
+    raw = json.dumps([fingerprint, normalize_prompt(query)], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class CodeEntry:
+    """
+    一条缓存的分析结果
+    """
+
+    def __init__(self, code, chart_type, analysis, created, uses):
+        self.code = code
+        self.chart_type = chart_type
+        self.analysis = analysis
+        self.created = created
+        self.uses = uses
+
+
+class CodeCache:
+    """
+    基于SQLite的分析代码缓存
+    """
+
+    def __init__(self, path=None, ttl=CODE_CACHE_TTL):
+        self.path = path or os.path.join(cache_dir(), "analysis_code.sqlite3")
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS analysis_code (
+                key TEXT PRIMARY KEY,
+                fingerprint TEXT NOT NULL,
+                query TEXT NOT NULL,
+                code TEXT NOT NULL,
+                chart_type TEXT NOT NULL,
+                analysis TEXT NOT NULL,
+                created REAL NOT NULL,
+                uses INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, fingerprint, query):
+        """
+        查找缓存的分析结果，未命中或已过期返回 None
+        """
+        key = _key(fingerprint, query)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT code, chart_type, analysis, created, uses FROM analysis_code WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and time.time() - row[3] > self.ttl:
+                self._conn.execute("DELETE FROM analysis_code WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE analysis_code SET uses = uses + 1 WHERE key = ?", (key,))
+            self.hits += 1
+            return CodeEntry(row[0], row[1], row[2], row[3], row[4] + 1)
+
+    def put(self, fingerprint, query, code, chart_type, analysis):
+        """
+        保存一条分析结果；没有代码的结果不缓存
+        """
+        if not code:
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO analysis_code "
+                "(key, fingerprint, query, code, chart_type, analysis, created, uses) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+                (_key(fingerprint, query), fingerprint, query, code, chart_type or "", analysis or "", time.time())
+            )
+
+    def invalidate(self, fingerprint, query):
+        """
+        代码执行失败时删除对应条目
+        """
+        with self._lock:
+            deleted = self._conn.execute(
+                "DELETE FROM analysis_code WHERE key = ?", (_key(fingerprint, query),)
+            ).rowcount
+            self.invalidations += deleted
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM analysis_code").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': entries,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM analysis_code")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    返回进程级共享的分析代码缓存
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = CodeCache()
+        return _cache
+
+
+instrumentation.register_collector("code_cache", lambda: _cache.stats() if _cache is not None else {})
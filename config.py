@@ -0,0 +1,23 @@
+"""
+全局配置：本地缓存目录、上传文件限制等
+"""
+import os
+
+# 本地缓存根目录，可通过环境变量 AGENT_CACHE_DIR 覆盖
+CACHE_ROOT = os.environ.get(
+    "AGENT_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+)
+
+# PDF上传文件大小上限（MB）与页数上限，界面说明与解析前的校验共用
+PDF_MAX_MB = float(os.environ.get("PDF_MAX_MB", "10"))
+PDF_MAX_PAGES = int(os.environ.get("PDF_MAX_PAGES", "500"))
+
+
+def cache_dir(*parts):
+    """
+    返回缓存根目录下的子目录路径（不存在时自动创建）
+    """
+    path = os.path.join(CACHE_ROOT, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
@@ -0,0 +1,256 @@
+"""
+CSV读取层：使用pyarrow引擎解析，数值列降精度、低基数字符串列转为category（字典编码）；
+超大文件走分块流式读取，用蓄水池抽样把内存中的行数限制在上限以内。
+每次读取都会记录解析耗时与峰值内存（RSS）
+"""
+import io
+import os
+import re
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+
+import instrumentation
+
+# 超过该大小（字节）的文件默认走分块流式读取
+CHUNKED_THRESHOLD_BYTES = int(os.environ.get("CSV_CHUNKED_THRESHOLD_BYTES", str(256 * 1024 * 1024)))
+# 分块模式下内存中最多保留的行数（超出后蓄水池抽样）
+CHUNKED_MAX_ROWS = int(os.environ.get("CSV_CHUNKED_MAX_ROWS", "1000000"))
+# 分块模式每块读取的字节数
+CHUNK_BLOCK_BYTES = 16 * 1024 * 1024
+# 唯一值占比低于该比例的字符串列转为category
+LOW_CARDINALITY_RATIO = 0.5
+
+# 分块读取时的类型转换错误，例如 "In CSV column #0: Row #5: CSV conversion error to int64: invalid value 'x'"
+_CONVERSION_ERROR = re.compile(r"CSV column #(\d+):.*invalid value '(.*)'", re.DOTALL)
+
+
+class IngestResult:
+    """
+    一次CSV读取的结果与统计信息
+    """
+
+    def __init__(self, df, mode, parse_seconds, peak_rss_mb, rss_delta_mb, total_rows, sampled,
+                 dataset_hash=None, mapped_path=None):
+        self.df = df
+        self.mode = mode
+        self.parse_seconds = parse_seconds
+        self.peak_rss_mb = peak_rss_mb
+        self.rss_delta_mb = rss_delta_mb
+        self.total_rows = total_rows
+        self.sampled = sampled
+        # 来自共享数据集存储时记录内容哈希与映射文件路径
+        self.dataset_hash = dataset_hash
+        self.mapped_path = mapped_path
+
+    @property
+    def memory_mb(self):
+        return self.df.memory_usage(deep=True).sum() / (1024 * 1024)
+
+
+def _current_rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        try:
+            import resource
+            # 非Linux平台退化为进程生命周期内的峰值（macOS单位为字节，Linux为KB）
+            usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return usage if usage > 1 << 32 else usage * 1024
+        except ImportError:
+            return 0
+
+
+class RSSMonitor:
+    """
+    在后台线程中定期采样进程RSS，记录代码块执行期间的峰值
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.start_rss = 0
+        self.peak_rss = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, _current_rss_bytes())
+
+    def __enter__(self):
+        self.start_rss = self.peak_rss = _current_rss_bytes()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_rss = max(self.peak_rss, _current_rss_bytes())
+        return False
+
+
+def optimize_dtypes(df, low_cardinality_ratio=LOW_CARDINALITY_RATIO):
+    """
+    原地压缩DataFrame内存：整数列降为最小可用精度、可无损表示的浮点列降为float32，
+    低基数字符串列转为category
+    """
+    for col in df.columns:
+        series = df[col]
+        if pd.api.types.is_bool_dtype(series):
+            continue
+        if pd.api.types.is_integer_dtype(series):
+            downcast = "unsigned" if len(series) and series.min() >= 0 else "integer"
+            df[col] = pd.to_numeric(series, downcast=downcast)
+        elif pd.api.types.is_float_dtype(series) and series.dtype != np.float32:
+            # 只有能无损表示时才降为float32
+            values = series.to_numpy()
+            narrowed = values.astype(np.float32)
+            if np.array_equal(narrowed.astype(values.dtype), values, equal_nan=True):
+                df[col] = narrowed
+        elif pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series):
+            non_null = series.count()
+            if non_null and series.nunique(dropna=True) <= non_null * low_cardinality_ratio:
+                df[col] = series.astype("category")
+    return df
+
+
+class ReservoirSampler:
+    """
+    Arrow表的蓄水池抽样（Algorithm R），按批次向量化处理：
+    任意长度的数据流都只保留 k 行的等概率样本
+    """
+
+    def __init__(self, k, seed=0):
+        self.k = k
+        self.seen = 0
+        self.table = None
+        self._rng = np.random.default_rng(seed)
+
+    def add(self, table):
+        n = table.num_rows
+        if self.table is None:
+            self.table = table.slice(0, 0)
+        fill = min(self.k - self.table.num_rows, n)
+        if fill > 0:
+            self.table = pa.concat_tables([self.table, table.slice(0, fill)])
+        if fill < n:
+            rows = np.arange(fill, n)
+            # 第 i 行（全局序号，从0计）以 k/(i+1) 的概率替换样本中的随机位置
+            positions = self.seen + rows
+            slots = self._rng.integers(0, positions + 1)
+            mask = slots < self.k
+            slots, rows = slots[mask], rows[mask]
+            if slots.size:
+                # 同一位置被多次替换时以最后一次为准，与逐行处理的结果一致
+                unique_slots, last = np.unique(slots[::-1], return_index=True)
+                take = np.arange(self.k)
+                take[unique_slots] = self.k + rows[::-1][last]
+                self.table = pa.concat_tables([self.table, table]).take(pa.array(take))
+        self.seen += n
+
+    @property
+    def sampled(self):
+        return self.seen > self.k
+
+
+def iter_csv_batches(source, block_size=CHUNK_BLOCK_BYTES, column_types=None):
+    """
+    流式读取CSV，逐批产出 pyarrow.Table，不需要一次性把整个文件读入内存。
+    列类型由第一块推断，column_types 可以为指定列覆盖推断结果
+    """
+    reader = pacsv.open_csv(source, read_options=pacsv.ReadOptions(block_size=block_size),
+                            convert_options=pacsv.ConvertOptions(column_types=column_types or {}))
+    for batch in reader:
+        yield pa.Table.from_batches([batch])
+
+
+def _widen_column_types(error, schema, column_types):
+    """
+    根据类型转换错误放宽出错列的类型：整数列遇到小数改为float64，其他情况改为字符串；
+    无法定位出错列时所有列都按字符串读取
+    """
+    if schema is None:
+        raise error
+    match = _CONVERSION_ERROR.search(str(error))
+    if match is None or int(match.group(1)) >= len(schema):
+        all_strings = {name: pa.string() for name in schema.names}
+        if column_types == all_strings:
+            raise error
+        return all_strings
+    field = schema.field(int(match.group(1)))
+    current = column_types.get(field.name, field.type)
+    if pa.types.is_string(current):
+        raise error
+    widened = pa.string()
+    if pa.types.is_integer(current):
+        try:
+            float(match.group(2))
+            widened = pa.float64()
+        except ValueError:
+            pass
+    return {**column_types, field.name: widened}
+
+
+def _read_chunked(source, max_rows):
+    """
+    分块读取并蓄水池抽样。后续块中出现与第一块推断类型不符的值时，放宽该列类型后从头重新读取
+    """
+    column_types = {}
+    while True:
+        sampler = ReservoirSampler(max_rows)
+        try:
+            for table in iter_csv_batches(_as_source(source), CHUNK_BLOCK_BYTES, column_types):
+                sampler.add(table)
+            return sampler
+        except pa.ArrowInvalid as e:
+            schema = sampler.table.schema if sampler.table is not None else None
+            column_types = _widen_column_types(e, schema, column_types)
+
+
+def _as_source(source):
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return source
+
+
+def read_csv_optimized(source, size_bytes=None, chunked=None, max_rows=CHUNKED_MAX_ROWS):
+    """
+    读取CSV并压缩内存，返回 IngestResult。
+    source 可以是文件路径、字节串或类文件对象；chunked=None 时根据文件大小自动选择分块模式
+    """
+    if size_bytes is None and isinstance(source, str):
+        size_bytes = os.path.getsize(source)
+    if chunked is None:
+        chunked = bool(size_bytes and size_bytes > CHUNKED_THRESHOLD_BYTES)
+
+    start = time.perf_counter()
+    with RSSMonitor() as monitor:
+        if chunked:
+            sampler = _read_chunked(source, max_rows)
+            if sampler.table is None:
+                raise ValueError("CSV文件为空")
+            df = optimize_dtypes(sampler.table.to_pandas())
+            total_rows, sampled = sampler.seen, sampler.sampled
+            mode = "chunked"
+        else:
+            df = optimize_dtypes(pd.read_csv(_as_source(source), engine="pyarrow"))
+            total_rows, sampled = len(df), False
+            mode = "pyarrow"
+    parse_seconds = time.perf_counter() - start
+    instrumentation.observe("csv_read", parse_seconds, "CSV分析")
+
+    return IngestResult(
+        df, mode, parse_seconds,
+        peak_rss_mb=monitor.peak_rss / (1024 * 1024),
+        rss_delta_mb=max(0, monitor.peak_rss - monitor.start_rss) / (1024 * 1024),
+        total_rows=total_rows,
+        sampled=sampled,
+    )
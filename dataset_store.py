@@ -0,0 +1,224 @@
+"""
+数据集共享存储：按文件内容哈希把解析后的表只写一次到本地 Arrow IPC（Feather v2，未压缩）文件，
+各会话通过内存映射读取，数值列与字符串列直接引用映射缓冲区（零拷贝），不再各自持有完整副本。
+已映射的数据集受全局内存预算约束，超出时按LRU释放；磁盘文件同样有容量上限
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+import pyarrow as pa
+
+import instrumentation
+from config import cache_dir
+from csv_ingest import IngestResult
+
+# 同时保持映射的数据集总大小上限（字节）
+MEMORY_BUDGET_BYTES = int(os.environ.get("DATASET_MEMORY_BUDGET_BYTES", str(4 * 1024 * 1024 * 1024)))
+# 磁盘上数据集文件总大小上限（字节）
+DISK_BUDGET_BYTES = int(os.environ.get("DATASET_DISK_BUDGET_BYTES", str(20 * 1024 * 1024 * 1024)))
+
+
+def arrow_to_dataframe_view(table):
+    """
+    把（内存映射的）Arrow表转换为DataFrame：单块且无缺失值的数值列、字符串列零拷贝引用原缓冲区，
+    其他列（含缺失值的数值列、字典编码列等）按常规方式转换
+    """
+    columns = {}
+    for name, column in zip(table.column_names, table.columns):
+        col_type = column.type
+        if ((pa.types.is_integer(col_type) or pa.types.is_floating(col_type))
+                and column.null_count == 0 and column.num_chunks == 1):
+            values = column.chunk(0).to_numpy(zero_copy_only=True)
+            columns[name] = pd.Series(values, copy=False)
+        elif pa.types.is_string(col_type) or pa.types.is_large_string(col_type):
+            columns[name] = pd.Series(pd.arrays.ArrowStringArray(column), copy=False)
+        else:
+            columns[name] = column.to_pandas()
+    return pd.DataFrame(columns, copy=False)
+
+
+class MappedDataset:
+    """
+    一个已内存映射的数据集
+    """
+
+    def __init__(self, dataset_hash, path, table, meta):
+        self.dataset_hash = dataset_hash
+        self.path = path
+        self.table = table
+        self.meta = meta
+        self.nbytes = os.path.getsize(path)
+        # 基准视图只构建一次；各会话拿到的是它的浅拷贝，零拷贝的数值列引用只读的映射缓冲区
+        self.frame = arrow_to_dataframe_view(table)
+        # 视图带上内容哈希，下游（如数据集画像）可据此缓存
+        self.frame.attrs['dataset_hash'] = dataset_hash
+
+    def view(self):
+        """
+        返回基准视图的浅拷贝，只供读取（画像、预览）；需要修改数据的调用方应先深拷贝，
+        或在开启写时复制的进程中使用（如沙箱工作进程，只有被修改的列会被复制）
+        """
+        return self.frame.copy(deep=False)
+
+
+class DatasetStore:
+    """
+    进程级数据集存储
+    """
+
+    def __init__(self, directory=None, memory_budget_bytes=MEMORY_BUDGET_BYTES,
+                 disk_budget_bytes=DISK_BUDGET_BYTES):
+        self.directory = directory or cache_dir("datasets")
+        self.memory_budget_bytes = memory_budget_bytes
+        self.disk_budget_bytes = disk_budget_bytes
+        self._mapped = OrderedDict()  # hash -> MappedDataset
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _paths(self, dataset_hash):
+        base = os.path.join(self.directory, dataset_hash)
+        return base + ".arrow", base + ".json"
+
+    def load(self, dataset_hash, ingest):
+        """
+        返回数据集的 IngestResult，其 df 为映射缓冲区上的视图。
+        存储中没有该数据集时调用 ingest() 解析（返回 IngestResult），写入磁盘后再映射
+        """
+        with self._lock:
+            dataset = self._mapped.get(dataset_hash)
+            if dataset is not None:
+                self._mapped.move_to_end(dataset_hash)
+                self.hits += 1
+                return self._result(dataset)
+            key_lock = self._key_locks.setdefault(dataset_hash, threading.Lock())
+
+        # 同一数据集并发首次加载时只解析、写入一次
+        with key_lock:
+            with self._lock:
+                dataset = self._mapped.get(dataset_hash)
+            if dataset is None:
+                data_path, meta_path = self._paths(dataset_hash)
+                if not (os.path.exists(data_path) and os.path.exists(meta_path)):
+                    with self._lock:
+                        self.misses += 1
+                    self._write(dataset_hash, ingest())
+                else:
+                    with self._lock:
+                        self.hits += 1
+                    os.utime(data_path)
+                dataset = self._map(dataset_hash)
+            with self._lock:
+                self._key_locks.pop(dataset_hash, None)
+            return self._result(dataset)
+
+    def _write(self, dataset_hash, result):
+        data_path, meta_path = self._paths(dataset_hash)
+        table = pa.Table.from_pandas(result.df, preserve_index=False)
+        suffix = f".tmp-{os.getpid()}-{threading.get_ident()}"
+        with pa.OSFile(data_path + suffix, "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        meta = {
+            'mode': result.mode,
+            'parse_seconds': result.parse_seconds,
+            'peak_rss_mb': result.peak_rss_mb,
+            'rss_delta_mb': result.rss_delta_mb,
+            'total_rows': result.total_rows,
+            'sampled': result.sampled,
+        }
+        with open(meta_path + suffix, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(data_path + suffix, data_path)
+        os.replace(meta_path + suffix, meta_path)
+        self._trim_disk(keep=dataset_hash)
+
+    def _map(self, dataset_hash):
+        data_path, meta_path = self._paths(dataset_hash)
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        source = pa.memory_map(data_path, "r")
+        table = pa.ipc.open_file(source).read_all()
+        dataset = MappedDataset(dataset_hash, data_path, table, meta)
+        with self._lock:
+            self._mapped[dataset_hash] = dataset
+            self._mapped.move_to_end(dataset_hash)
+            self._evict()
+        return dataset
+
+    def _evict(self):
+        # 调用方需持有 self._lock；仍被会话引用的视图会在引用释放后才真正解除映射
+        total = sum(d.nbytes for d in self._mapped.values())
+        while total > self.memory_budget_bytes and len(self._mapped) > 1:
+            _, dataset = self._mapped.popitem(last=False)
+            total -= dataset.nbytes
+
+    def _trim_disk(self, keep=None):
+        # 跳过仍在映射中的数据集与刚写入、尚未映射的 keep；
+        # 会话中保存的已淘汰数据集路径可能因此失效，调用方发现文件不存在时重新 load()
+        with self._lock:
+            in_use = set(self._mapped) | {keep}
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(".arrow"):
+                continue
+            dataset_hash = name[:-len(".arrow")]
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, dataset_hash))
+        total = sum(size for _, size, _ in files)
+        for _, size, dataset_hash in sorted(files):
+            if total <= self.disk_budget_bytes:
+                break
+            if dataset_hash in in_use:
+                continue
+            for path in self._paths(dataset_hash):
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            total -= size
+
+    def _result(self, dataset):
+        meta = dataset.meta
+        return IngestResult(
+            dataset.view(), meta['mode'], meta['parse_seconds'],
+            peak_rss_mb=meta['peak_rss_mb'], rss_delta_mb=meta['rss_delta_mb'],
+            total_rows=meta['total_rows'], sampled=meta['sampled'],
+            dataset_hash=dataset.dataset_hash, mapped_path=dataset.path,
+        )
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'mapped': len(self._mapped),
+                'mapped_bytes': sum(d.nbytes for d in self._mapped.values()),
+                'memory_budget_bytes': self.memory_budget_bytes,
+            }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """
+    返回进程级共享的数据集存储
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = DatasetStore()
+        return _store
+
+
+instrumentation.register_collector("dataset_store", lambda: _store.stats() if _store is not None else {})
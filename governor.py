@@ -0,0 +1,225 @@
+"""
+LLM调用调度器：同一进程内所有会话共享。按 (api_key, base_url) 限制请求速率（令牌桶）与同时进行的请求数，
+等待中的请求按会话轮转放行，避免一个会话的大批并发请求饿死其他会话；
+限流（429）、超时与服务端错误按带抖动的指数退避重试，服务端返回 Retry-After 时按其等待，
+并让同一密钥的所有请求一起退避
+"""
+import contextvars
+import hashlib
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from tenacity import Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+import instrumentation
+from lazy import lazy_import
+from ratelimit import TokenBucket
+
+openai = lazy_import("openai")
+
+# 每个密钥每秒最多发起的请求数
+GOVERNOR_RATE = float(os.environ.get("GOVERNOR_RATE", "3"))
+# 令牌桶容量（允许的突发请求数）
+GOVERNOR_BURST = float(os.environ.get("GOVERNOR_BURST", "6"))
+# 每个密钥同时进行的最大请求数
+GOVERNOR_MAX_IN_FLIGHT = int(os.environ.get("GOVERNOR_MAX_IN_FLIGHT", "8"))
+# 失败请求的最大重试次数
+GOVERNOR_MAX_RETRIES = int(os.environ.get("GOVERNOR_MAX_RETRIES", "4"))
+# 指数退避的最长等待（秒）
+GOVERNOR_MAX_BACKOFF = float(os.environ.get("GOVERNOR_MAX_BACKOFF", "30"))
+
+# 当前请求所属的会话，由页面脚本在每次运行开始时设置；未设置时所有调用视为同一会话
+current_session = contextvars.ContextVar("governor_session", default="default")
+
+
+def set_session(session_id):
+    current_session.set(session_id)
+
+
+def _retry_after(error):
+    """
+    从异常携带的响应头中读取 Retry-After（秒），没有时返回 None
+    """
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    for name in ("retry-after-ms", "retry-after"):
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            seconds = float(value)
+        except ValueError:
+            continue
+        return seconds / 1000 if name == "retry-after-ms" else seconds
+    return None
+
+
+def is_retryable(error):
+    """
+    限流、连接错误、超时与5xx可以重试；鉴权、参数等错误直接失败
+    """
+    return isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError))
+
+
+class Governor:
+    """
+    一个 (api_key, base_url) 的调度器
+    """
+
+    def __init__(self, rate=GOVERNOR_RATE, burst=GOVERNOR_BURST, max_in_flight=GOVERNOR_MAX_IN_FLIGHT,
+                 max_retries=GOVERNOR_MAX_RETRIES, max_backoff=GOVERNOR_MAX_BACKOFF):
+        self.bucket = TokenBucket(rate, burst)
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self._cond = threading.Condition()
+        # 会话 -> 等待中的请求队列；按插入顺序轮转，放行一个请求后该会话移到队尾
+        self._queues = OrderedDict()
+        self.in_flight = 0
+        self.served = 0
+        self.retries = 0
+        self.throttled = 0
+        self.wait_seconds = 0.0
+
+    def _head(self):
+        for queue in self._queues.values():
+            return queue[0]
+        return None
+
+    @contextmanager
+    def slot(self, session=None):
+        """
+        排队取得一个请求名额（并发数与速率都满足后才返回），产出排队等待的秒数
+        """
+        session = session if session is not None else current_session.get()
+        ticket = object()
+        start = time.perf_counter()
+        with self._cond:
+            self._queues.setdefault(session, deque()).append(ticket)
+            try:
+                while self.in_flight >= self.max_in_flight or self._head() is not ticket:
+                    self._cond.wait()
+            except BaseException:
+                self._remove(session, ticket)
+                self._cond.notify_all()
+                raise
+            self._remove(session, ticket, rotate=True)
+            self.in_flight += 1
+            self._cond.notify_all()
+        try:
+            self.bucket.acquire()
+            waited = time.perf_counter() - start
+            with self._cond:
+                self.served += 1
+                self.wait_seconds += waited
+            yield waited
+        finally:
+            with self._cond:
+                self.in_flight -= 1
+                self._cond.notify_all()
+
+    def _remove(self, session, ticket, rotate=False):
+        queue = self._queues.get(session)
+        if queue is None:
+            return
+        queue.remove(ticket)
+        if not queue:
+            del self._queues[session]
+        elif rotate:
+            self._queues.move_to_end(session)
+
+    def _wait(self, retry_state):
+        error = retry_state.outcome.exception()
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            # 按服务端要求等待，加少量抖动避免所有请求同时醒来
+            return min(self.max_backoff, retry_after) + random.uniform(0, 0.5)
+        return wait_random_exponential(multiplier=0.5, max=self.max_backoff)(retry_state)
+
+    def _before_sleep(self, retry_state):
+        error = retry_state.outcome.exception()
+        with self._cond:
+            self.retries += 1
+            if isinstance(error, openai.RateLimitError):
+                self.throttled += 1
+        if isinstance(error, openai.RateLimitError):
+            # 同一密钥的其他请求也一起退避，不再继续撞限流
+            self.bucket.penalize(retry_state.next_action.sleep)
+
+    def open_stream(self, start_stream):
+        """
+        调用 start_stream() 发起流式请求并读取第一个分片，失败时按退避策略重试；
+        返回 (第一个分片, 剩余分片迭代器)。已开始产出内容后出错不再重试，避免重复输出。
+        首次请求的令牌由 slot() 取得，每次重试都要重新取令牌（限流退避后令牌桶为负，会一直等到退避结束）
+        """
+        attempts = [0]
+
+        def attempt():
+            if attempts[0]:
+                self.bucket.acquire()
+            attempts[0] += 1
+            iterator = iter(start_stream())
+            return next(iterator, None), iterator
+
+        retrying = Retrying(
+            stop=stop_after_attempt(self.max_retries + 1),
+            wait=self._wait,
+            retry=retry_if_exception(is_retryable),
+            before_sleep=self._before_sleep,
+            reraise=True,
+        )
+        return retrying(attempt)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'in_flight': self.in_flight,
+                'queued': sum(len(queue) for queue in self._queues.values()),
+                'waiting_sessions': len(self._queues),
+                'served': self.served,
+                'retries': self.retries,
+                'throttled': self.throttled,
+                'avg_wait_seconds': self.wait_seconds / self.served if self.served else 0.0,
+            }
+
+
+_governors = {}
+_governors_lock = threading.Lock()
+
+
+def get_governor(api_key, base_url):
+    """
+    返回该 (api_key, base_url) 共享的调度器
+    """
+    key = (hashlib.sha256((api_key or "").encode("utf-8")).hexdigest(), base_url)
+    with _governors_lock:
+        governor = _governors.get(key)
+        if governor is None:
+            governor = _governors[key] = Governor()
+        return governor
+
+
+def stats():
+    """
+    所有密钥的调度统计汇总
+    """
+    with _governors_lock:
+        governors = list(_governors.values())
+    total = {'keys': len(governors), 'in_flight': 0, 'queued': 0, 'served': 0, 'retries': 0, 'throttled': 0}
+    wait_seconds = 0.0
+    for governor in governors:
+        item = governor.stats()
+        for name in ('in_flight', 'queued', 'served', 'retries', 'throttled'):
+            total[name] += item[name]
+        wait_seconds += item['avg_wait_seconds'] * item['served']
+    total['avg_wait_seconds'] = wait_seconds / total['served'] if total['served'] else 0.0
+    return total
+
+
+instrumentation.register_collector("governor", stats)
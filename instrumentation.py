@@ -0,0 +1,326 @@
+"""
+运行指标：记录各阶段耗时（提示词构建、网络等待、首字延迟、解析、PDF加载、CSV读取、图表执行）、
+token用量与缓存命中，在进程内跨会话汇总；可通过 Prometheus 文本格式导出，也供侧边栏管理面板展示
+"""
+import math
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Prometheus 指标端口，为0时不启动导出服务
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+# 指标导出服务监听的地址
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+
+# 耗时直方图的分桶上界（秒）
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, math.inf)
+
+# 阶段名称与说明（用于管理面板显示）
+SPAN_NAMES = {
+    'prompt_build': "提示词构建",
+    'queue_wait': "排队等待",
+    'network_wait': "网络等待",
+    'ttft': "首字延迟",
+    'llm_total': "模型调用总耗时",
+    'parse': "回复解析",
+    'pdf_load': "PDF加载",
+    'pdf_retrieve': "PDF检索",
+    'csv_read': "CSV读取",
+    'chart_exec': "图表执行",
+    'chart_queue': "图表排队",
+}
+
+_METRIC_NAME = re.compile(r"[^a-zA-Z0-9_]")
+
+
+class _Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.total = 0.0
+        self.count = 0
+        self.min = math.inf
+        self.max = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.total += value
+        self.count += 1
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """
+        按分桶线性插值估算分位数（限制在观测到的最小值与最大值之间）
+        """
+        if not self.count:
+            return 0.0
+        return min(self.max, max(self.min, self._interpolate(q)))
+
+    def _interpolate(self, q):
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip(BUCKETS, self.counts):
+            if count and seen + count >= rank:
+                # 最后一个桶没有上界，以观测到的最大值作为上界
+                upper = max(self.max, lower) if math.isinf(bound) else bound
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            if not math.isinf(bound):
+                lower = bound
+        return lower
+
+
+class MetricsRegistry:
+    """
+    进程级指标注册表：计数器与耗时直方图按 (名称, 标签) 汇总；
+    各缓存、进程池的 stats() 通过 register_collector 注册，导出时读取
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._collectors = {}
+        self.started = time.time()
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, span_name, seconds, feature=""):
+        if seconds is None:
+            return
+        key = (span_name, feature)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = _Histogram()
+            hist.observe(max(0.0, seconds))
+
+    @contextmanager
+    def span(self, span_name, feature=""):
+        """
+        记录代码块耗时；代码块抛出异常时同样记录
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(span_name, time.perf_counter() - start, feature)
+
+    def register_collector(self, component, collect):
+        """
+        注册组件统计：collect() 返回 {指标名: 数值} 字典，导出时作为 gauge 输出
+        """
+        with self._lock:
+            self._collectors[component] = collect
+
+    def _collect_components(self):
+        with self._lock:
+            collectors = list(self._collectors.items())
+        components = {}
+        for component, collect in collectors:
+            try:
+                values = collect() or {}
+            except Exception:
+                # 统计读取失败不影响其他指标
+                continue
+            components[component] = {
+                k: v for k, v in values.items()
+                if isinstance(v, (int, float)) and not isinstance(v, bool)
+            }
+        return components
+
+    def snapshot(self):
+        """
+        返回当前指标的汇总，用于管理面板：阶段耗时、按功能的模型调用统计与各组件统计
+        """
+        with self._lock:
+            spans = [
+                {
+                    'span': span_name, 'feature': feature, 'count': hist.count,
+                    'avg': hist.total / hist.count if hist.count else 0.0,
+                    'p50': hist.quantile(0.5), 'p95': hist.quantile(0.95),
+                }
+                for (span_name, feature), hist in sorted(self._histograms.items())
+            ]
+            counters = dict(self._counters)
+        llm = {}
+        for (name, labels), value in counters.items():
+            labels = dict(labels)
+            if not name.startswith("agent_llm_"):
+                continue
+            row = llm.setdefault(labels.get('feature', ""), {
+                'calls': 0, 'cache_hits': 0, 'coalesced': 0, 'errors': 0, 'prompt_tokens': 0,
+                'cached_prompt_tokens': 0, 'completion_tokens': 0
+            })
+            if name == "agent_llm_calls_total":
+                row['calls'] += value
+                if labels.get('source') == "cache":
+                    row['cache_hits'] += value
+                elif labels.get('source') == "coalesced":
+                    row['coalesced'] += value
+            elif name == "agent_llm_errors_total":
+                row['errors'] += value
+            elif name == "agent_llm_tokens_total":
+                row[f"{labels.get('kind')}_tokens"] += value
+        return {
+            'uptime_seconds': time.time() - self.started,
+            'spans': spans,
+            'llm': llm,
+            'components': self._collect_components(),
+        }
+
+    def render_prometheus(self):
+        """
+        以 Prometheus 文本格式导出全部指标
+        """
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted(self._histograms.items())
+
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        if histograms:
+            lines.append("# HELP agent_span_seconds 各阶段耗时（秒）")
+            lines.append("# TYPE agent_span_seconds histogram")
+        for (span_name, feature), hist in histograms:
+            base = (('feature', feature), ('span', span_name))
+            cumulative = 0
+            for bound, count in zip(BUCKETS, hist.counts):
+                cumulative += count
+                le = "+Inf" if math.isinf(bound) else f"{bound:g}"
+                lines.append(f"agent_span_seconds_bucket{_format_labels(base + (('le', le),))} {cumulative}")
+            lines.append(f"agent_span_seconds_sum{_format_labels(base)} {_format_value(hist.total)}")
+            lines.append(f"agent_span_seconds_count{_format_labels(base)} {hist.count}")
+
+        for component, values in sorted(self._collect_components().items()):
+            for key, value in sorted(values.items()):
+                name = _METRIC_NAME.sub("_", f"agent_{component}_{key}")
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {_format_value(value)}")
+
+        lines.append("# TYPE agent_uptime_seconds gauge")
+        lines.append(f"agent_uptime_seconds {_format_value(time.time() - self.started)}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self.started = time.time()
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value) if math.isfinite(value) else ("+Inf" if value > 0 else "NaN")
+    return str(value)
+
+
+# 进程级共享注册表
+registry = MetricsRegistry()
+
+
+def inc(name, amount=1, **labels):
+    registry.inc(name, amount, **labels)
+
+
+def observe(span_name, seconds, feature=""):
+    registry.observe(span_name, seconds, feature)
+
+
+def span(span_name, feature=""):
+    return registry.span(span_name, feature)
+
+
+def register_collector(component, collect):
+    registry.register_collector(component, collect)
+
+
+def record_llm_call(feature, model, cached, error=False, prompt_tokens=0, completion_tokens=0,
+                    ttft=None, network_wait=None, elapsed=None, coalesced=False, cached_prompt_tokens=0):
+    """
+    记录一次模型调用：调用次数（按来源：模型/缓存/合并到进行中的相同请求）、错误、token用量与首字延迟等耗时。
+    cached_prompt_tokens 为服务端命中提示词前缀缓存的token数（计入 prompt 之内）。
+    合并的请求不产生上游用量，只记录调用方感受到的首字延迟与总耗时
+    """
+    source = "cache" if cached else ("coalesced" if coalesced else "model")
+    registry.inc("agent_llm_calls_total", feature=feature, model=model, source=source)
+    if error:
+        registry.inc("agent_llm_errors_total", feature=feature, model=model)
+    if prompt_tokens:
+        registry.inc("agent_llm_tokens_total", prompt_tokens, feature=feature, model=model, kind="prompt")
+    if cached_prompt_tokens:
+        registry.inc("agent_llm_tokens_total", cached_prompt_tokens, feature=feature, model=model,
+                     kind="cached_prompt")
+    if completion_tokens:
+        registry.inc("agent_llm_tokens_total", completion_tokens, feature=feature, model=model, kind="completion")
+    if not cached:
+        registry.observe("network_wait", network_wait, feature)
+        registry.observe("ttft", ttft, feature)
+        registry.observe("llm_total", elapsed, feature)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0].rstrip("/") not in ("", "/metrics"):
+            self.send_response(404)
+            self.end_headers()
+            return
+        data = registry.render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=None, host=None):
+    """
+    在后台线程启动 Prometheus 指标导出服务（/metrics）；重复调用只启动一次，端口为0时不启动
+    """
+    global _server
+    port = METRICS_PORT if port is None else port
+    if not port:
+        return None
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((host or METRICS_HOST, port), _MetricsHandler)
+            except OSError:
+                # 端口已被占用（如同机的其他进程已在导出）时不重复启动
+                return None
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, daemon=True, name="metrics-server").start()
+        return _server
@@ -0,0 +1,51 @@
+"""
+延迟导入：重型依赖（pandas、langchain、openai、plotly等）在第一次访问其属性时才真正导入，
+使只打开聊天页的会话或热重载不必为用不到的功能付出导入开销
+"""
+import importlib
+import sys
+import threading
+
+
+class LazyModule:
+    """
+    模块占位对象：首次访问属性时导入目标模块，之后直接转发属性访问；多线程同时首次访问是安全的
+    """
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+        self.__dict__['_lock'] = threading.Lock()
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            with self.__dict__['_lock']:
+                module = self.__dict__['_module']
+                if module is None:
+                    module = importlib.import_module(self.__dict__['_name'])
+                    self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = "loaded" if self.__dict__['_module'] is not None else "not loaded"
+        return f"<lazy module '{self.__dict__['_name']}' ({state})>"
+
+
+def lazy_import(name):
+    """
+    返回延迟导入的模块；模块已导入时直接返回模块本身
+    """
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return LazyModule(name)
@@ -0,0 +1,183 @@
+"""
+LLM响应缓存：以 (model, temperature, 完整渲染后的提示词) 为键，把模型回复存入本地SQLite。
+先按精确键查找，未命中再按规范化键（统一空白、大小写与全半角）查找；
+条目带TTL，总大小超限时按最近访问时间（LRU）淘汰
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+import instrumentation
+from config import cache_dir
+
+# 默认只缓存温度不高于该值的（确定性）调用
+MAX_CACHEABLE_TEMPERATURE = float(os.environ.get("LLM_CACHE_MAX_TEMPERATURE", "0"))
+# 条目有效期（秒），默认7天
+CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+# 缓存总大小上限（字节）
+CACHE_MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(text):
+    """
+    规范化提示词：全半角统一、合并连续空白、去首尾空白并转小写
+    """
+    text = unicodedata.normalize("NFKC", text)
+    return _WHITESPACE.sub(" ", text).strip().lower()
+
+
+def _digest(model, temperature, text):
+    raw = json.dumps([model, round(float(temperature), 4), text], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    基于SQLite的LLM响应缓存
+    """
+
+    def __init__(self, path=None, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES,
+                 max_temperature=MAX_CACHEABLE_TEMPERATURE):
+        self.path = path or os.path.join(cache_dir(), "llm_responses.sqlite3")
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_temperature = max_temperature
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                norm_key TEXT NOT NULL,
+                model TEXT NOT NULL,
+                temperature REAL NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                accessed REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_norm ON responses(norm_key)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses(accessed)")
+        self.hits = 0
+        self.normalized_hits = 0
+        self.misses = 0
+
+    def should_cache(self, temperature, use_cache=None):
+        """
+        判断本次调用是否走缓存：use_cache=False 显式关闭，True 强制开启，
+        None 时只缓存温度不高于 max_temperature 的确定性调用
+        """
+        if use_cache is not None:
+            return bool(use_cache)
+        return float(temperature) <= self.max_temperature
+
+    def get(self, model, temperature, prompt_text):
+        """
+        查找缓存的回复，未命中返回 None
+        """
+        key = _digest(model, temperature, prompt_text)
+        norm_key = _digest(model, temperature, normalize_prompt(prompt_text))
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT key, response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            exact = row is not None
+            if row is None:
+                row = self._conn.execute(
+                    "SELECT key, response, created FROM responses WHERE norm_key = ? "
+                    "ORDER BY accessed DESC LIMIT 1", (norm_key,)
+                ).fetchone()
+            if row is not None and now - row[2] > self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (row[0],))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, row[0]))
+            if exact:
+                self.hits += 1
+            else:
+                self.normalized_hits += 1
+            return row[1]
+
+    def put(self, model, temperature, prompt_text, response):
+        """
+        写入一条回复，并在超出容量时淘汰最久未访问的条目
+        """
+        key = _digest(model, temperature, prompt_text)
+        norm_key = _digest(model, temperature, normalize_prompt(prompt_text))
+        size = len(response.encode("utf-8")) + len(prompt_text.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, norm_key, model, temperature, response, size, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, norm_key, model, float(temperature), response, size, now, now)
+            )
+            self._evict(now)
+
+    def _evict(self, now):
+        # 调用方需持有 self._lock
+        self._conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._conn.execute("SELECT key, size FROM responses ORDER BY accessed ASC").fetchall()
+        stale = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            stale.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+
+    def stats(self):
+        """
+        缓存统计：精确命中、规范化命中、未命中、命中率与条目数
+        """
+        with self._lock:
+            entries, total = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+            lookups = self.hits + self.normalized_hits + self.misses
+            return {
+                'hits': self.hits,
+                'normalized_hits': self.normalized_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.normalized_hits) / lookups if lookups else 0.0,
+                'entries': entries,
+                'bytes': total,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    返回进程级共享的响应缓存（首次使用时创建）
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LLMResponseCache()
+        return _cache
+
+
+instrumentation.register_collector("llm_cache", lambda: _cache.stats() if _cache is not None else {})
@@ -0,0 +1,247 @@
+"""
+LLM客户端注册表：进程内按 (api_key, base_url, model, temperature) 复用 ChatOpenAI 实例，
+所有实例共享同一组带连接池的 httpx 客户端（同步与异步各一个，keep-alive，避免每次请求重新握手），
+长时间未使用的实例会被淘汰。
+流式请求附带 include_usage，服务端返回的token用量（含命中提示词缓存的token数）写入调用方的 usage_sink
+"""
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import httpx
+import openai
+from langchain.chat_models import ChatOpenAI
+from langchain.embeddings.openai import OpenAIEmbeddings
+
+import instrumentation
+
+# 连接池参数，可通过环境变量调整
+POOL_MAX_CONNECTIONS = int(os.environ.get("LLM_POOL_MAX_CONNECTIONS", "100"))
+POOL_MAX_KEEPALIVE = int(os.environ.get("LLM_POOL_MAX_KEEPALIVE", "20"))
+POOL_KEEPALIVE_EXPIRY = float(os.environ.get("LLM_POOL_KEEPALIVE_EXPIRY", "60"))
+REQUEST_TIMEOUT = float(os.environ.get("LLM_REQUEST_TIMEOUT", "120"))
+# 客户端空闲多少秒后被淘汰
+CLIENT_IDLE_TTL = float(os.environ.get("LLM_CLIENT_IDLE_TTL", "900"))
+# 流式请求是否要求服务端在末尾返回token用量（不支持 stream_options 的兼容服务可设为0）
+STREAM_USAGE = os.environ.get("LLM_STREAM_USAGE", "1") != "0"
+
+# 当前调用接收token用量的字典，由 record_usage() 设置
+usage_sink = contextvars.ContextVar("llm_usage_sink", default=None)
+
+
+@contextmanager
+def record_usage():
+    """
+    在此范围内发起的流式请求结束后，产出的字典中会有 prompt_tokens、completion_tokens 与 cached_prompt_tokens
+    """
+    usage = {}
+    token = usage_sink.set(usage)
+    try:
+        yield usage
+    finally:
+        usage_sink.reset(token)
+
+
+class _UsageRecordingCompletions:
+    """
+    包装 chat.completions：ChatOpenAI 的流式实现会丢弃用量分片，这里在分片交给它之前读取用量
+    """
+
+    def __init__(self, completions):
+        self._completions = completions
+
+    def create(self, **kwargs):
+        if not kwargs.get("stream"):
+            return self._completions.create(**kwargs)
+        if STREAM_USAGE:
+            kwargs.setdefault("stream_options", {"include_usage": True})
+        return self._iter_chunks(self._completions.create(**kwargs), usage_sink.get())
+
+    @staticmethod
+    def _iter_chunks(chunks, sink):
+        try:
+            for chunk in chunks:
+                usage = getattr(chunk, "usage", None)
+                if usage is not None and sink is not None:
+                    details = getattr(usage, "prompt_tokens_details", None)
+                    sink['prompt_tokens'] = usage.prompt_tokens or 0
+                    sink['completion_tokens'] = usage.completion_tokens or 0
+                    sink['cached_prompt_tokens'] = getattr(details, "cached_tokens", None) or 0
+                yield chunk
+        finally:
+            # 调用方提前停止读取时关闭响应，连接归还连接池
+            chunks.close()
+
+    def __getattr__(self, name):
+        return getattr(self._completions, name)
+
+
+def _openai_clients(api_key, base_url, http_clients, max_retries=2):
+    """
+    构建同步与异步的 openai 客户端，分别使用共享的同步与异步连接池
+    """
+    http_client, async_http_client = http_clients
+    sync_client = openai.OpenAI(api_key=api_key, base_url=base_url, http_client=http_client,
+                                max_retries=max_retries)
+    async_client = openai.AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=async_http_client,
+                                      max_retries=max_retries)
+    return sync_client, async_client
+
+
+def _close_async_client(client):
+    # 当前线程有运行中的事件循环时交给它关闭，否则新建事件循环关闭
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        asyncio.run(client.aclose())
+    else:
+        loop.create_task(client.aclose())
+
+
+class LLMClientRegistry:
+    """
+    进程级LLM客户端注册表
+    """
+
+    # configure() 可修改的连接池参数
+    POOL_PARAMS = ("max_connections", "max_keepalive_connections", "keepalive_expiry", "timeout", "idle_ttl")
+
+    def __init__(self, max_connections=POOL_MAX_CONNECTIONS, max_keepalive_connections=POOL_MAX_KEEPALIVE,
+                 keepalive_expiry=POOL_KEEPALIVE_EXPIRY, timeout=REQUEST_TIMEOUT, idle_ttl=CLIENT_IDLE_TTL):
+        self.max_connections = max_connections
+        self.max_keepalive_connections = max_keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.timeout = timeout
+        self.idle_ttl = idle_ttl
+        self._http_client = None
+        self._async_http_client = None
+        self._clients = {}  # key -> [client, 最近使用时间]
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+        self.evicted = 0
+
+    def configure(self, **limits):
+        """
+        修改连接池参数，已有的连接池会被关闭并在下次使用时按新参数重建
+        """
+        with self._lock:
+            unknown = sorted(set(limits) - set(self.POOL_PARAMS))
+            if unknown:
+                raise ValueError(f"未知的连接池参数：{'、'.join(unknown)}")
+            for name, value in limits.items():
+                setattr(self, name, value)
+            self._clients.clear()
+            old_clients = self._take_http_clients()
+        self._close_http_clients(old_clients)
+
+    def _take_http_clients(self):
+        # 调用方需持有 self._lock；取出当前的连接池，由调用方在锁外关闭
+        old_clients = (self._http_client, self._async_http_client)
+        self._http_client = self._async_http_client = None
+        return old_clients
+
+    @staticmethod
+    def _close_http_clients(clients):
+        http_client, async_http_client = clients
+        if http_client is not None:
+            http_client.close()
+        if async_http_client is not None:
+            _close_async_client(async_http_client)
+
+    def _get_http_clients(self):
+        # 调用方需持有 self._lock；返回共享的 (同步, 异步) httpx 客户端
+        if self._http_client is None:
+            limits = httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive_connections,
+                keepalive_expiry=self.keepalive_expiry,
+            )
+            timeout = httpx.Timeout(self.timeout, connect=10.0)
+            self._http_client = httpx.Client(limits=limits, timeout=timeout)
+            self._async_http_client = httpx.AsyncClient(limits=limits, timeout=timeout)
+        return self._http_client, self._async_http_client
+
+    def _get(self, key, factory):
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._clients.get(key)
+            if entry is None:
+                entry = [factory(self._get_http_clients()), now]
+                self._clients[key] = entry
+                self.created += 1
+            else:
+                self.reused += 1
+            entry[1] = now
+            return entry[0]
+
+    def _evict_idle(self, now):
+        # 各实例只引用共享的连接池，淘汰时不需要单独关闭
+        expired = [key for key, (_, last_used) in self._clients.items() if now - last_used > self.idle_ttl]
+        for key in expired:
+            del self._clients[key]
+        self.evicted += len(expired)
+
+    def get_chat_model(self, api_key, base_url, model, temperature):
+        """
+        获取（或创建）共享连接池的聊天模型实例
+        """
+        key = ('chat', api_key, base_url, model, float(temperature))
+
+        def factory(http_clients):
+            # 聊天请求的重试由 governor 统一负责（按 Retry-After 退避），客户端自身不再重试
+            sync_client, async_client = _openai_clients(api_key, base_url, http_clients, max_retries=0)
+            return ChatOpenAI(
+                temperature=temperature, openai_api_key=api_key, model_name=model, base_url=base_url,
+                streaming=True, client=_UsageRecordingCompletions(sync_client.chat.completions),
+                async_client=async_client.chat.completions
+            )
+        return self._get(key, factory)
+
+    def get_embeddings(self, api_key, base_url):
+        """
+        获取（或创建）共享连接池的嵌入模型实例
+        """
+        key = ('embeddings', api_key, base_url)
+
+        def factory(http_clients):
+            sync_client, async_client = _openai_clients(api_key, base_url, http_clients)
+            return OpenAIEmbeddings(
+                openai_api_key=api_key, openai_api_base=base_url,
+                client=sync_client.embeddings, async_client=async_client.embeddings
+            )
+        return self._get(key, factory)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'clients': len(self._clients),
+                'created': self.created,
+                'reused': self.reused,
+                'evicted': self.evicted,
+                'max_connections': self.max_connections,
+                'max_keepalive_connections': self.max_keepalive_connections,
+            }
+
+    def close(self):
+        with self._lock:
+            self._clients.clear()
+            old_clients = self._take_http_clients()
+        self._close_http_clients(old_clients)
+
+
+# 进程级共享注册表
+registry = LLMClientRegistry()
+instrumentation.register_collector("llm_client", registry.stats)
+
+
+def get_chat_model(api_key, base_url, model, temperature):
+    return registry.get_chat_model(api_key, base_url, model, temperature)
+
+
+def get_embeddings(api_key, base_url):
+    return registry.get_embeddings(api_key, base_url)
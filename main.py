@@ -1,12 +1,31 @@
 import streamlit as st
 import utils
-import pandas as pd
-import re
-import matplotlib.pyplot as plt
-import plotly.express as px
-import plotly.graph_objects as go
+import chat_memory
+import chat_store
+import governor
+import instrumentation
+import llm_cache
+from config import PDF_MAX_MB, PDF_MAX_PAGES
+from lazy import lazy_import
+from streaming import stream_section
+import hashlib
+import io
+import os
+import uuid
 from datetime import datetime
-import json
+
+# 只在CSV分析等功能首次使用时才导入的重型依赖，其余标签页的首屏不为它们付出导入开销
+pd = lazy_import("pandas")
+pio = lazy_import("plotly.io")
+csv_ingest = lazy_import("csv_ingest")
+dataset_store = lazy_import("dataset_store")
+pdf_cache = lazy_import("pdf_cache")
+pdf_extract = lazy_import("pdf_extract")
+profiler = lazy_import("profiler")
+sandbox = lazy_import("sandbox")
+
+# 设置了 METRICS_PORT 时在后台线程导出 Prometheus 指标（进程内只启动一次）
+instrumentation.start_metrics_server()
 
 # 页面配置
 st.set_page_config(
@@ -16,6 +35,9 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# 本次运行中的模型调用都归属当前会话，由 governor 在各会话之间轮转放行
+governor.set_session(st.session_state.setdefault('governor_session', uuid.uuid4().hex))
+
 # 自定义CSS样式
 st.markdown("""
 <style>
@@ -83,6 +105,56 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
+
+def render_metrics_panel():
+    """
+    显示各阶段耗时分位数、按功能的模型调用与token统计以及各缓存组件的状态
+    """
+    snapshot = instrumentation.registry.snapshot()
+    st.caption(f"自进程启动 {snapshot['uptime_seconds'] / 60:.0f} 分钟内的累计数据")
+
+    if snapshot['spans']:
+        st.markdown("**⏱️ 阶段耗时**")
+        st.dataframe(pd.DataFrame([
+            {
+                '阶段': instrumentation.SPAN_NAMES.get(row['span'], row['span']),
+                '功能': row['feature'],
+                '次数': row['count'],
+                '平均(秒)': round(row['avg'], 3),
+                'P50(秒)': round(row['p50'], 3),
+                'P95(秒)': round(row['p95'], 3),
+            }
+            for row in snapshot['spans']
+        ]), hide_index=True, use_container_width=True)
+
+    if snapshot['llm']:
+        st.markdown("**🤖 模型调用**")
+        st.dataframe(pd.DataFrame([
+            {
+                '功能': feature,
+                '调用': row['calls'],
+                '缓存命中': row['cache_hits'],
+                '合并请求': row['coalesced'],
+                '失败': row['errors'],
+                '提示词tokens': row['prompt_tokens'],
+                '前缀缓存tokens': row['cached_prompt_tokens'],
+                '生成tokens': row['completion_tokens'],
+            }
+            for feature, row in sorted(snapshot['llm'].items())
+        ]), hide_index=True, use_container_width=True)
+
+    for component, values in sorted(snapshot['components'].items()):
+        if values:
+            st.markdown(f"**{component}**")
+            st.caption(" · ".join(
+                f"{key} {value:.2f}" if isinstance(value, float) else f"{key} {value}"
+                for key, value in values.items()
+            ))
+
+    st.download_button("⬇️ 导出 Prometheus 指标", instrumentation.registry.render_prometheus(),
+                       file_name="metrics.txt", mime="text/plain", key="metrics_export")
+
+
 # 侧边栏配置
 with st.sidebar:
     st.markdown("### 🔑 API 配置")
@@ -131,9 +203,23 @@ with st.sidebar:
     # 温度设置
     temperature = st.slider("AI创造力", 0.0, 1.0, 0.7, 0.1)
 
+    # 响应缓存：默认只缓存确定性（温度为0）的调用，关闭后每次都请求模型
+    response_cache = st.checkbox("🗄️ 启用响应缓存", value=True, help="相同请求直接返回缓存结果，仅对温度为0的调用生效")
+    use_cache = None if response_cache else False
+    llm_cache_stats = llm_cache.get_cache().stats()
+    st.caption(
+        f"缓存命中率 {llm_cache_stats['hit_rate']:.0%}（命中 "
+        f"{llm_cache_stats['hits'] + llm_cache_stats['normalized_hits']} / 未命中 {llm_cache_stats['misses']}）"
+    )
+
+    # 管理面板：进程内所有会话汇总的运行指标
+    with st.expander("📈 运行指标（全部会话）"):
+        render_metrics_panel()
+
     # 清除历史记录
     if st.button("🗑️ 清除所有历史记录"):
-        st.session_state.chat_history = []
+        # 对话记录只追加保存：清除即开始一个新对话
+        st.query_params['conversation'] = chat_store.new_conversation_id()
         st.session_state.usage_stats = {
             'video_scripts': 0,
             'xhs_content': 0,
@@ -183,6 +269,8 @@ def video_tab():
         target_audience = st.text_input('👥 目标受众', placeholder="例如：18-35岁科技爱好者", key='target_audience')
         include_hooks = st.checkbox('🎣 包含开场钩子', value=True, key='include_hooks')
         call_to_action = st.checkbox('📢 包含行动号召', value=True, key='call_to_action')
+        sectioned_mode = st.checkbox('📑 先出大纲再分段并行生成', value=False, key='video_sectioned',
+                                     help="适合10分钟以上的长视频：各段落并发生成，逐段显示，避免输出被截断")
 
     if st.button('🚀 生成脚本', key='video_btn', use_container_width=True):
         if not openai_api_key:
@@ -192,41 +280,49 @@ def video_tab():
             st.markdown('<div class="error-box">请输入视频主题</div>', unsafe_allow_html=True)
             return
 
-        with st.spinner('🤖 AI正在创作专业脚本...'):
-            try:
-                result = utils.generate_video_script_enhanced(
-                    subject, video_length, creativity, openai_api_key,
-                    base_url=base_url, style=video_style,
-                    audience=target_audience, hooks=include_hooks,
-                    cta=call_to_action, model=model_choice, temperature=temperature
-                )
-                st.session_state.usage_stats['video_scripts'] += 1
-
-                st.markdown('<div class="success-box">🎉 脚本生成成功！</div>', unsafe_allow_html=True)
+        status = st.empty()
+        try:
+            stream_fn = (utils.generate_video_script_sectioned_stream if sectioned_mode
+                         else utils.generate_video_script_stream)
+            stream = stream_fn(
+                subject, video_length, creativity, openai_api_key,
+                base_url=base_url, style=video_style,
+                audience=target_audience, hooks=include_hooks,
+                cta=call_to_action, model=model_choice, temperature=temperature,
+                use_cache=use_cache
+            )
+
+            # 边生成边显示结果
+            col1, col2 = st.columns([2, 1])
+            with col1:
+                st.markdown("**📄 脚本内容：**")
+                result = st.write_stream(stream)
+            st.session_state.usage_stats['video_scripts'] += 1
 
-                # 显示结果
-                col1, col2 = st.columns([2, 1])
-                with col1:
-                    st.markdown("**📄 脚本内容：**")
-                    st.markdown(result)
+            status.markdown('<div class="success-box">🎉 脚本生成成功！</div>', unsafe_allow_html=True)
 
-                with col2:
-                    st.markdown("**📊 生成统计：**")
-                    st.metric("脚本字数", len(result))
-                    st.metric("预计时长", f"{video_length}分钟")
-                    st.metric("使用次数", st.session_state.usage_stats['video_scripts'])
+            with col2:
+                st.markdown("**📊 生成统计：**")
+                st.metric("脚本字数", len(result))
+                st.metric("预计时长", f"{video_length}分钟")
+                st.metric("首字延迟", f"{stream.ttft or 0:.2f}秒")
+                st.metric("使用次数", st.session_state.usage_stats['video_scripts'])
+                if stream.queue_seconds >= 0.1:
+                    st.caption(f"⏳ 共享限流排队 {stream.queue_seconds:.1f}秒")
+                if stream.coalesced:
+                    st.caption("🔗 与其他会话进行中的相同请求合并，共享同一次生成")
 
-                    # 下载按钮
-                    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                    st.download_button(
-                        label="📥 下载脚本",
-                        data=result,
-                        file_name=f"视频脚本_{subject}_{timestamp}.md",
-                        mime="text/markdown"
-                    )
+                # 下载按钮
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                st.download_button(
+                    label="📥 下载脚本",
+                    data=result,
+                    file_name=f"视频脚本_{subject}_{timestamp}.md",
+                    mime="text/markdown"
+                )
 
-            except Exception as e:
-                st.markdown(f'<div class="error-box">❌ 生成失败：{str(e)}</div>', unsafe_allow_html=True)
+        except Exception as e:
+            st.markdown(f'<div class="error-box">❌ 生成失败：{str(e)}</div>', unsafe_allow_html=True)
 
     st.markdown('</div>', unsafe_allow_html=True)
 
@@ -260,6 +356,8 @@ def xhs_tab():
         target_audience = st.text_input('👥 目标用户', placeholder="例如：25-35岁女性", key='xhs_audience')
         include_hashtags = st.checkbox('🏷️ 包含话题标签', value=True, key='include_hashtags')
         include_emoji = st.checkbox('😊 包含表情符号', value=True, key='include_emoji')
+        parallel_mode = st.checkbox('⚡ 并行生成', value=True, key='xhs_parallel',
+                                    help="每个版本单独并发请求，总耗时约等于生成一篇文案的时间")
 
     if st.button('🚀 生成文案', key='xhs_btn', use_container_width=True):
         if not openai_api_key:
@@ -269,43 +367,73 @@ def xhs_tab():
             st.markdown('<div class="error-box">请输入文案主题</div>', unsafe_allow_html=True)
             return
 
-        with st.spinner('🤖 AI正在创作爆款文案...'):
-            try:
-                result = utils.generate_xiaohongshu_content_enhanced(
+        status = st.empty()
+        try:
+            st.markdown("**📄 文案内容：**")
+            if parallel_mode:
+                # 每个版本一个占位区，哪个先完成先显示哪个
+                slots = [st.empty() for _ in range(num_variations)]
+                for i, slot in enumerate(slots, 1):
+                    slot.info(f"⏳ 文案{i} 生成中...")
+                results = [""] * num_variations
+                start_time = datetime.now()
+                first_done = None
+                failures = 0
+                for index, text, error in utils.generate_xiaohongshu_variations(
+                        theme, openai_api_key, base_url=base_url,
+                        content_type=content_type, tone=tone,
+                        num_variations=num_variations, audience=target_audience,
+                        hashtags=include_hashtags, emoji=include_emoji,
+                        model=model_choice, temperature=temperature, use_cache=use_cache):
+                    if first_done is None:
+                        first_done = (datetime.now() - start_time).total_seconds()
+                    if error is not None:
+                        failures += 1
+                        slots[index].error(f"文案{index + 1} 生成失败：{error}")
+                        continue
+                    results[index] = f"## 文案{index + 1}\n{text}"
+                    slots[index].markdown(results[index])
+                if failures == num_variations:
+                    raise Exception("所有版本均生成失败")
+                result = "\n\n".join(part for part in results if part)
+                ttft = first_done
+            else:
+                stream = utils.generate_xiaohongshu_content_stream(
                     theme, openai_api_key, base_url=base_url,
                     content_type=content_type, tone=tone,
                     num_variations=num_variations, audience=target_audience,
                     hashtags=include_hashtags, emoji=include_emoji,
-                    model=model_choice, temperature=temperature
+                    model=model_choice, temperature=temperature, use_cache=use_cache
                 )
-                st.session_state.usage_stats['xhs_content'] += 1
-
-                st.markdown('<div class="success-box">🎉 文案生成成功！</div>', unsafe_allow_html=True)
+                # 边生成边显示结果
+                result = st.write_stream(stream)
+                ttft = stream.ttft
+            st.session_state.usage_stats['xhs_content'] += 1
 
-                # 显示结果
-                st.markdown("**📄 文案内容：**")
-                st.markdown(result)
+            status.markdown('<div class="success-box">🎉 文案生成成功！</div>', unsafe_allow_html=True)
 
-                # 统计信息
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.metric("生成数量", num_variations)
-                with col2:
-                    st.metric("文案字数", len(result))
-                with col3:
-                    st.metric("使用次数", st.session_state.usage_stats['xhs_content'])
+            # 统计信息
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.metric("生成数量", num_variations)
+            with col2:
+                st.metric("文案字数", len(result))
+            with col3:
+                st.metric("首篇/首字延迟" if parallel_mode else "首字延迟", f"{ttft or 0:.2f}秒")
+            with col4:
+                st.metric("使用次数", st.session_state.usage_stats['xhs_content'])
 
-                # 下载按钮
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                st.download_button(
-                    label="📥 下载文案",
-                    data=result,
-                    file_name=f"小红书文案_{theme}_{timestamp}.md",
-                    mime="text/markdown"
-                )
+            # 下载按钮
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            st.download_button(
+                label="📥 下载文案",
+                data=result,
+                file_name=f"小红书文案_{theme}_{timestamp}.md",
+                mime="text/markdown"
+            )
 
-            except Exception as e:
-                st.markdown(f'<div class="error-box">❌ 生成失败：{str(e)}</div>', unsafe_allow_html=True)
+        except Exception as e:
+            st.markdown(f'<div class="error-box">❌ 生成失败：{str(e)}</div>', unsafe_allow_html=True)
 
     st.markdown('</div>', unsafe_allow_html=True)
 
@@ -320,19 +448,56 @@ def pdf_tab():
         '📁 上传PDF文件',
         type=['pdf'],
         key='pdf_file',
-        help="支持中文PDF文档，最大文件大小10MB"
+        help=f"支持中文PDF文档，最大文件大小{PDF_MAX_MB:g}MB、最多{PDF_MAX_PAGES}页"
     )
 
+    pdf_error = None
     if uploaded_file:
-        file_size = len(uploaded_file.getvalue()) / (1024 * 1024)  # MB
+        pdf_bytes = uploaded_file.getvalue()
+        file_size = len(pdf_bytes) / (1024 * 1024)  # MB
         st.info(f"📄 文件大小: {file_size:.2f} MB")
 
+        # 上传后立即校验大小与页数（只读取页面目录），超限的文件不进入解析；结果按文件缓存，页面重跑不重复读取
+        cached_check = st.session_state.get('pdf_check')
+        if not cached_check or cached_check[0] != uploaded_file.file_id:
+            try:
+                cached_check = (uploaded_file.file_id, pdf_extract.inspect(pdf_bytes), None)
+            except ValueError as e:
+                cached_check = (uploaded_file.file_id, None, str(e))
+            st.session_state.pdf_check = cached_check
+        _, page_count, pdf_error = cached_check
+
         # 显示文件信息
-        col1, col2 = st.columns(2)
+        col1, col2, col3 = st.columns(3)
         with col1:
             st.metric("文件名", uploaded_file.name)
         with col2:
             st.metric("文件大小", f"{file_size:.2f} MB")
+        with col3:
+            st.metric("页数", page_count if page_count is not None else "-")
+        if pdf_error:
+            st.markdown(f'<div class="error-box">❌ {pdf_error}</div>', unsafe_allow_html=True)
+
+    retrieval_labels = {
+        "vector": "向量检索（语义匹配）",
+        "bm25": "关键词检索（本地，无需嵌入）",
+        "hybrid": "混合检索（两者融合）",
+    }
+    retrieval = st.selectbox(
+        '🔎 检索方式', list(retrieval_labels), format_func=retrieval_labels.get, key='pdf_retrieval',
+        help="关键词检索在本地完成，新文档不需要等待嵌入，适合按关键词提问；混合检索在该文档已有向量索引时综合两种结果，否则只按关键词检索"
+    )
+    whole_document_labels = {
+        "auto": "自动识别（「全文总结」「这篇文章的主要观点」等问题通读全文）",
+        "always": "总是通读全文",
+        "never": "只检索相关片段",
+    }
+    whole_document_choice = st.selectbox(
+        '📚 全文问题', list(whole_document_labels), format_func=whole_document_labels.get,
+        key='pdf_whole_document',
+        help="通读全文时先并发摘要每个分块再逐层合并，分块摘要会缓存，同一文档之后的全文问题只需合并"
+    )
+    whole_document = {"auto": None, "always": True, "never": False}[whole_document_choice]
 
     # 预设问题
     preset_questions = [
@@ -367,33 +532,63 @@ def pdf_tab():
         if not uploaded_file:
             st.markdown('<div class="error-box">请上传PDF文件</div>', unsafe_allow_html=True)
             return
+        if pdf_error:
+            st.markdown(f'<div class="error-box">{pdf_error}</div>', unsafe_allow_html=True)
+            return
         if not question:
             st.markdown('<div class="error-box">请输入问题</div>', unsafe_allow_html=True)
             return
 
-        with st.spinner('🤖 AI正在分析PDF并回答问题...'):
-            try:
-                answer = utils.chat_with_pdf_enhanced(
+        status = st.empty()
+        summary_progress = st.empty()
+
+        def show_progress(done, total):
+            summary_progress.progress(done / total, text=f"📚 通读全文：已摘要 {done}/{total} 个分块")
+
+        try:
+            with st.spinner('🤖 AI正在分析PDF...'):
+                stream = utils.chat_with_pdf_stream(
                     uploaded_file, question, openai_api_key,
-                    base_url=base_url, model=model_choice, temperature=temperature
+                    base_url=base_url, model=model_choice, temperature=temperature,
+                    use_cache=use_cache, retrieval=retrieval, whole_document=whole_document,
+                    progress=show_progress
                 )
-                st.session_state.usage_stats['pdf_qa'] += 1
 
-                st.markdown('<div class="success-box">🎉 回答完成！</div>', unsafe_allow_html=True)
+            # 边生成边显示答案
+            st.markdown("**💬 AI回答：**")
+            answer = st.write_stream(stream)
+            st.session_state.usage_stats['pdf_qa'] += 1
+
+            status.markdown('<div class="success-box">🎉 回答完成！</div>', unsafe_allow_html=True)
 
-                # 显示答案
-                st.markdown("**💬 AI回答：**")
-                st.markdown(answer)
+            # 统计信息
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.metric("回答字数", len(answer))
+            with col2:
+                st.metric("首字延迟", f"{stream.ttft or 0:.2f}秒")
+            with col3:
+                st.metric("使用次数", st.session_state.usage_stats['pdf_qa'])
+            if stream.queue_seconds >= 0.1:
+                st.caption(f"⏳ 共享限流排队 {stream.queue_seconds:.1f}秒")
+            if stream.coalesced:
+                st.caption("🔗 与其他会话进行中的相同请求合并，共享同一次生成")
+            summary_stats = getattr(stream, 'summary', None)
+            if summary_stats:
+                summary_progress.empty()
+                st.caption(
+                    f"📚 通读全文：{summary_stats['chunks']} 个分块，其中 {summary_stats['cached']} 个摘要来自缓存，"
+                    f"逐层合并 {summary_stats['levels']} 次"
+                )
 
-                # 统计信息
-                col1, col2 = st.columns(2)
-                with col1:
-                    st.metric("回答字数", len(answer))
-                with col2:
-                    st.metric("使用次数", st.session_state.usage_stats['pdf_qa'])
+            cache_stats = pdf_cache.parse_cache.stats()
+            st.caption(
+                f"📦 解析缓存：命中 {cache_stats['hits'] + cache_stats['disk_hits']} 次 / "
+                f"未命中 {cache_stats['misses']} 次（命中率 {cache_stats['hit_rate']:.0%}）"
+            )
 
-            except Exception as e:
-                st.markdown(f'<div class="error-box">❌ 问答失败：{str(e)}</div>', unsafe_allow_html=True)
+        except Exception as e:
+            st.markdown(f'<div class="error-box">❌ 问答失败：{str(e)}</div>', unsafe_allow_html=True)
 
     st.markdown('</div>', unsafe_allow_html=True)
 
@@ -413,19 +608,47 @@ def csv_tab():
 
     if uploaded_csv:
         try:
-            df = pd.read_csv(uploaded_csv)
+            # 同一文件在页面重跑时不重复解析；不同会话共享同一份内存映射的数据
+            csv_bytes = uploaded_csv.getvalue()
+            csv_hash = hashlib.sha256(csv_bytes).hexdigest()
+            cached_ingest = st.session_state.get('csv_ingest')
+            # 映射文件可能在其他会话写入新数据集时被磁盘容量清理掉，此时重新加载（必要时重新解析写入）
+            if cached_ingest and cached_ingest[0] == csv_hash and os.path.exists(cached_ingest[1].mapped_path or ""):
+                ingest = cached_ingest[1]
+            else:
+                with st.spinner('📥 正在读取CSV...'):
+                    ingest = dataset_store.get_store().load(
+                        csv_hash, lambda: csv_ingest.read_csv_optimized(csv_bytes, size_bytes=len(csv_bytes))
+                    )
+                st.session_state['csv_ingest'] = (csv_hash, ingest)
+            df = ingest.df
+            # 列统计按数据集哈希缓存，页面重跑和多次分析只计算一次
+            profile = profiler.get_profile(df, dataset_hash=csv_hash)
 
             # 数据概览
             st.markdown("**📊 数据概览：**")
             col1, col2, col3, col4 = st.columns(4)
             with col1:
-                st.metric("行数", len(df))
+                st.metric("行数", ingest.total_rows)
             with col2:
                 st.metric("列数", len(df.columns))
             with col3:
-                st.metric("缺失值", df.isnull().sum().sum())
+                st.metric("缺失值", profile.total_nulls)
             with col4:
-                st.metric("数据类型", len(df.dtypes.unique()))
+                st.metric("数据类型", profile.n_dtypes)
+
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                st.metric("解析耗时", f"{ingest.parse_seconds:.2f}秒")
+            with col2:
+                st.metric("峰值内存", f"{ingest.peak_rss_mb:.0f} MB", delta=f"+{ingest.rss_delta_mb:.0f} MB",
+                          delta_color="off")
+            with col3:
+                st.metric("数据占用", f"{ingest.memory_mb:.1f} MB")
+            with col4:
+                st.metric("读取模式", "分块流式" if ingest.mode == "chunked" else "pyarrow")
+            if ingest.sampled:
+                st.warning(f"⚠️ 文件过大，已抽样 {len(df)} 行（共 {ingest.total_rows} 行）用于分析")
 
             # 数据预览
             with st.expander("👀 数据预览"):
@@ -433,13 +656,10 @@ def csv_tab():
 
             # 数据类型信息
             with st.expander("📋 数据类型信息"):
-                dtype_info = pd.DataFrame({
-                    '列名': df.columns,
-                    '数据类型': df.dtypes,
-                    '非空值数量': df.count(),
-                    '缺失值数量': df.isnull().sum()
-                })
-                st.dataframe(dtype_info, use_container_width=True)
+                dtype_info = profile.to_frame()
+                st.dataframe(dtype_info, use_container_width=True, hide_index=True)
+                if profile.sampled:
+                    st.caption(f"唯一值、高频值与分位数基于 {profile.sample_rows} 行抽样统计")
 
             # 分析请求
             st.markdown("**🔍 分析请求：**")
@@ -473,45 +693,67 @@ def csv_tab():
                     st.markdown('<div class="error-box">请输入分析需求</div>', unsafe_allow_html=True)
                     return
 
-                with st.spinner('🤖 AI正在分析数据...'):
-                    try:
-                        code, analysis, chart_type = utils.analyze_csv_with_plot_enhanced(
-                            df, query, openai_api_key, base_url=base_url,
-                            model=model_choice, temperature=temperature
-                        )
-                        st.session_state.usage_stats['csv_analysis'] += 1
-
-                        st.markdown('<div class="success-box">🎉 分析完成！</div>', unsafe_allow_html=True)
-
-                        # 显示分析结果
-                        st.markdown("**📈 分析结果：**")
-                        st.markdown(analysis)
-
-                        # 显示图表
-                        if code and chart_type:
-                            st.markdown("**📊 可视化图表：**")
-                            try:
-                                # 创建安全的执行环境
-                                safe_dict = {
-                                    'df': df, 'px': px, 'go': go, 'st': st,
-                                    'pd': pd, 'plt': plt
-                                }
-                                exec(code, {"__builtins__": {}}, safe_dict)
-                            except Exception as e:
-                                st.error(f'图表生成失败：{e}')
-                                st.code(code, language='python')
-
-                        # 统计信息
-                        col1, col2, col3 = st.columns(3)
-                        with col1:
-                            st.metric("数据行数", len(df))
-                        with col2:
-                            st.metric("分析字数", len(analysis))
-                        with col3:
-                            st.metric("使用次数", st.session_state.usage_stats['csv_analysis'])
-
-                    except Exception as e:
-                        st.markdown(f'<div class="error-box">❌ 分析失败：{str(e)}</div>', unsafe_allow_html=True)
+                status = st.empty()
+                try:
+                    st.markdown("**📈 分析结果：**")
+                    live_analysis = st.empty()
+                    run = {'result': None, 'stream': None}
+
+                    def run_chart(code):
+                        # 在独立工作进程中执行代码，超时或内存超限不会影响页面；只有执行成功的代码才会被缓存
+                        with st.spinner('📊 正在生成图表...'):
+                            run['result'] = sandbox.get_pool().run(code, ingest.mapped_path)
+                        return run['result'].ok
+
+                    def show_stream(stream):
+                        # 边生成边显示分析文本，代码和图表类型在流结束后解析
+                        run['stream'] = stream
+                        with st.spinner('🤖 AI正在分析数据...'):
+                            streamed = ""
+                            for piece in stream_section(stream, "[ANALYSIS]", "[ENDANALYSIS]"):
+                                streamed += piece
+                                live_analysis.markdown(streamed)
+
+                    code, analysis, chart_type = utils.analyze_csv_with_plot_enhanced(
+                        df, query, openai_api_key, base_url=base_url, model=model_choice, temperature=temperature,
+                        use_cache=use_cache, dataset_hash=csv_hash, validate=run_chart, on_stream=show_stream
+                    )
+                    live_analysis.markdown(analysis)
+                    if run['stream'] is None:
+                        # 结构相同的数据做过同样的分析：复用了缓存的代码，跳过代码生成
+                        st.caption("♻️ 复用相同表结构的历史分析代码，分析文本来自历史结果，仅供参考")
+                    ttft = (run['stream'].ttft if run['stream'] is not None else 0.0) or 0.0
+                    result = run['result']
+                    st.session_state.usage_stats['csv_analysis'] += 1
+
+                    status.markdown('<div class="success-box">🎉 分析完成！</div>', unsafe_allow_html=True)
+
+                    # 显示图表
+                    if result is not None:
+                        st.markdown("**📊 可视化图表：**")
+                        if result.ok:
+                            render_sandbox_outputs(result.outputs)
+                        else:
+                            st.error(f'图表生成失败：{result.error}')
+                            st.code(code, language='python')
+                        pool_stats = sandbox.get_pool().stats()
+                        st.caption(f"图表执行 {result.exec_seconds:.2f}秒 · 排队 {result.queue_seconds:.2f}秒 · "
+                                   f"沙箱队列深度 {pool_stats['queue_depth']} · "
+                                   f"忙碌进程 {pool_stats['busy']}/{pool_stats['workers']}")
+
+                    # 统计信息
+                    col1, col2, col3, col4 = st.columns(4)
+                    with col1:
+                        st.metric("数据行数", len(df))
+                    with col2:
+                        st.metric("分析字数", len(analysis))
+                    with col3:
+                        st.metric("首字延迟", f"{ttft:.2f}秒")
+                    with col4:
+                        st.metric("使用次数", st.session_state.usage_stats['csv_analysis'])
+
+                except Exception as e:
+                    st.markdown(f'<div class="error-box">❌ 分析失败：{str(e)}</div>', unsafe_allow_html=True)
 
         except Exception as e:
             st.error(f"CSV文件读取失败：{e}")
@@ -521,15 +763,44 @@ def csv_tab():
     st.markdown('</div>', unsafe_allow_html=True)
 
 
+def render_sandbox_outputs(outputs):
+    """
+    显示沙箱返回的图表、文本和表格
+    """
+    for kind, payload in outputs:
+        if kind == "plotly":
+            st.plotly_chart(pio.from_json(payload), use_container_width=True)
+        elif kind == "png":
+            st.image(payload, use_container_width=True)
+        elif kind == "table":
+            st.dataframe(pd.read_json(io.StringIO(payload), orient="split"), use_container_width=True)
+        elif kind == "notice":
+            st.caption(payload)
+        else:
+            st.markdown(payload)
+
+
 # 5. AI对话
 def chat_tab():
     st.markdown('<div class="feature-card">', unsafe_allow_html=True)
     st.subheader('🤖 通用AI对话助手')
     st.markdown("**智能对话，支持多轮对话和上下文记忆**")
 
-    # 初始化聊天历史
-    if 'chat_history' not in st.session_state:
-        st.session_state['chat_history'] = []
+    # 对话持久化在本地，对话ID放在地址参数中，刷新页面后继续同一对话
+    store = chat_store.get_store()
+    conversation_id = st.query_params.get('conversation')
+    if not conversation_id:
+        conversation_id = chat_store.new_conversation_id()
+        st.query_params['conversation'] = conversation_id
+    if st.session_state.get('chat_conversation') != conversation_id:
+        st.session_state['chat_conversation'] = conversation_id
+        # 只加载最新一页消息，更早的消息按需加载
+        st.session_state['chat_history'] = store.page(conversation_id)
+        st.session_state['chat_pages'] = 1
+        memory_state = store.load_memory(conversation_id)
+        st.session_state['chat_memory'] = (chat_memory.ChatMemory.from_dict(memory_state) if memory_state
+                                           else chat_memory.ChatMemory())
+    memory = st.session_state['chat_memory']
 
     # 对话设置
     col1, col2 = st.columns(2)
@@ -540,7 +811,8 @@ def chat_tab():
             key='chat_mode'
         )
     with col2:
-        max_history = st.slider("📚 记忆轮数", 1, 20, 10, key='max_history')
+        memory.budget = st.slider("📚 记忆预算（tokens）", 500, 8000, chat_memory.HISTORY_TOKEN_BUDGET, step=500,
+                                  key='history_budget', help="预算内的最近消息原样保留，更早的对话压缩为摘要")
 
     # 聊天输入
     with st.form(key='chat_form', clear_on_submit=True):
@@ -556,14 +828,15 @@ def chat_tab():
             submitted = st.form_submit_button('🚀 发送', use_container_width=True)
         with col2:
             if st.form_submit_button('🗑️ 清空历史', use_container_width=True):
-                st.session_state['chat_history'] = []
+                # 只追加存储：清空即开始一个新对话
+                st.query_params['conversation'] = chat_store.new_conversation_id()
                 st.rerun()
         with col3:
             if st.form_submit_button('📥 导出对话', use_container_width=True):
-                if st.session_state['chat_history']:
+                if store.stats(conversation_id)['message_count']:
                     chat_text = "\n\n".join([
                         f"{msg['role']}: {msg['content']}"
-                        for msg in st.session_state['chat_history']
+                        for msg in store.iter_messages(conversation_id)
                     ])
                     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
                     st.download_button(
@@ -579,32 +852,64 @@ def chat_tab():
             elif not user_input:
                 st.markdown('<div class="error-box">请输入问题</div>', unsafe_allow_html=True)
             else:
-                with st.spinner('🤖 AI正在思考...'):
-                    try:
-                        response = utils.chat_with_ai_enhanced(
-                            user_input, openai_api_key, base_url=base_url,
-                            chat_history=st.session_state['chat_history'][-max_history * 2:],
-                            mode=chat_mode, model=model_choice, temperature=temperature
-                        )
-                        st.session_state.usage_stats['ai_chat'] += 1
-
-                        # 添加对话记录
-                        st.session_state['chat_history'].append({'role': '用户', 'content': user_input})
-                        st.session_state['chat_history'].append({'role': 'AI助手', 'content': response})
-
-                        # 限制历史记录长度
-                        if len(st.session_state['chat_history']) > max_history * 2:
-                            st.session_state['chat_history'] = st.session_state['chat_history'][-max_history * 2:]
+                try:
+                    # 只读取尚未并入摘要的消息，读取量不随对话长度增长
+                    memory_offset = memory.summarized_count
+                    tail = store.messages_from(conversation_id, memory_offset)
+                    stream = utils.chat_with_ai_stream(
+                        user_input, openai_api_key, base_url=base_url,
+                        chat_history=tail, history_offset=memory_offset,
+                        mode=chat_mode, model=model_choice, temperature=temperature,
+                        use_cache=use_cache, memory=memory
+                    )
 
+                    # 边生成边显示回复，完成后并入下方聊天历史
+                    live_reply = st.empty()
+                    with live_reply.container():
+                        with st.chat_message("user"):
+                            st.markdown(user_input)
+                        with st.chat_message("assistant"):
+                            response = st.write_stream(stream)
+                    live_reply.empty()
+                    st.session_state.usage_stats['ai_chat'] += 1
+
+                    # 添加对话记录
+                    for role, content in (('用户', user_input), ('AI助手', response)):
+                        seq = store.append(conversation_id, role, content)
+                        message = {'seq': seq, 'role': role, 'content': content}
+                        st.session_state['chat_history'].append(message)
+                        tail.append(message)
+
+                    # 界面只保留已加载的页数，长对话的重跑开销保持不变
+                    keep = st.session_state['chat_pages'] * chat_store.PAGE_SIZE
+                    st.session_state['chat_history'] = st.session_state['chat_history'][-keep:]
+
+                    # 移出预算窗口的消息增量并入摘要，每轮只做一次
+                    try:
+                        with st.spinner('🧠 正在更新对话摘要...'):
+                            if utils.update_chat_memory(memory, tail, openai_api_key, base_url=base_url,
+                                                        model=model_choice, history_offset=memory_offset):
+                                store.save_memory(conversation_id, memory.to_dict())
                     except Exception as e:
-                        st.markdown(f'<div class="error-box">❌ 对话失败：{str(e)}</div>', unsafe_allow_html=True)
+                        st.caption(f"对话摘要更新失败，下一轮将重试：{e}")
+
+                except Exception as e:
+                    st.markdown(f'<div class="error-box">❌ 对话失败：{str(e)}</div>', unsafe_allow_html=True)
 
     # 显示聊天历史
     st.markdown("---")
     st.markdown("**💬 聊天历史：**")
 
-    if st.session_state['chat_history']:
-        for i, msg in enumerate(st.session_state['chat_history']):
+    history = st.session_state['chat_history']
+    if history and history[0]['seq'] > 0:
+        if st.button("⬆️ 加载更早消息", key='chat_load_older'):
+            history = store.page(conversation_id, before_seq=history[0]['seq']) + history
+            st.session_state['chat_history'] = history
+            st.session_state['chat_pages'] += 1
+            st.rerun()
+
+    if history:
+        for msg in history:
             if msg['role'] == '用户':
                 with st.chat_message("user"):
                     st.markdown(msg['content'])
@@ -614,16 +919,20 @@ def chat_tab():
     else:
         st.info("💬 开始你的第一次对话吧！")
 
-    # 统计信息
-    if st.session_state['chat_history']:
+    # 统计信息（写入时增量维护）
+    chat_stats = store.stats(conversation_id)
+    if chat_stats['message_count']:
         col1, col2, col3 = st.columns(3)
         with col1:
-            st.metric("对话轮数", len(st.session_state['chat_history']) // 2)
+            st.metric("对话轮数", chat_stats['message_count'] // 2)
         with col2:
-            total_chars = sum(len(msg['content']) for msg in st.session_state['chat_history'])
-            st.metric("总字符数", total_chars)
+            st.metric("总字符数", chat_stats['total_chars'])
         with col3:
             st.metric("使用次数", st.session_state.usage_stats['ai_chat'])
+        tail = store.messages_from(conversation_id, memory.summarized_count)
+        _, recent = memory.context(tail, memory.summarized_count)
+        st.caption(f"🧠 下一轮上下文约 {memory.prompt_tokens(tail, memory.summarized_count)} tokens"
+                   f"（最近 {len(recent)} 条消息原样保留，更早的 {memory.summarized_count} 条已压缩为摘要）")
 
     st.markdown('</div>', unsafe_allow_html=True)
 
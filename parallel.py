@@ -0,0 +1,41 @@
+"""
+并发执行工具：在有界线程池中并发执行一组任务，按完成顺序产出结果，失败的任务单独重试
+"""
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+def _submit(executor, task):
+    # 复制提交方的上下文，使 contextvars（如会话标识）在工作线程中同样可见
+    return executor.submit(contextvars.copy_context().run, task)
+
+
+def run_concurrent(tasks, max_workers=4, max_retries=1):
+    """
+    并发执行 tasks（无参可调用对象列表），每完成一个任务产出一次 (index, result, error)：
+    成功时 error 为 None；某个任务失败会单独重新提交，最多重试 max_retries 次，
+    仍失败时产出最后一次的异常，不影响其他任务。
+    任务在提交时所在线程的上下文中执行（如 governor 的会话标识）。
+    调用方中途停止迭代时，尚未开始的任务会被取消
+    """
+    if not tasks:
+        return
+    attempts = [0] * len(tasks)
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(tasks))))
+    try:
+        pending = {_submit(executor, task): index for index, task in enumerate(tasks)}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                error = future.exception()
+                if error is None:
+                    yield index, future.result(), None
+                elif attempts[index] < max_retries:
+                    attempts[index] += 1
+                    pending[_submit(executor, tasks[index])] = index
+                else:
+                    yield index, None, error
+    finally:
+        # 调用方提前停止读取（或中断）时不等待排队中的任务，直接取消；正在执行的任务在后台结束
+        executor.shutdown(wait=False, cancel_futures=True)
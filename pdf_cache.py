@@ -0,0 +1,310 @@
+"""
+PDF解析缓存：以文件内容的SHA-256为键，缓存解析出的页面与切分后的文本块。
+内存中按LRU淘汰，同时以zlib压缩的JSON落盘，同一文档再次提问时完全跳过PDF解析；
+未命中时由 pdf_extract 逐页抽取，每页抽取完成即切分产出，全部完成后写入缓存
+"""
+import hashlib
+import json
+import os
+import threading
+import zlib
+from collections import OrderedDict
+
+from langchain_core.documents import Document
+from langchain.text_splitter import CharacterTextSplitter
+
+import instrumentation
+import pdf_extract
+from config import cache_dir
+
+# 文本切分参数（与 pdf_extract.EXTRACT_VERSION 一起参与缓存键，修改后旧缓存自动失效）
+CHUNK_SIZE = 1500
+CHUNK_OVERLAP = 200
+# 同一文档正由其他调用方解析时最多等待的秒数；超时（如对方停止读取却未关闭迭代器）后自行解析
+PDF_PARSE_WAIT = float(os.environ.get("PDF_PARSE_WAIT", "120"))
+
+
+class ParsedPDF:
+    """
+    一份PDF的解析结果：页面列表与文本块列表
+    """
+
+    def __init__(self, doc_hash, pages, chunks):
+        self.doc_hash = doc_hash
+        self.pages = pages
+        self.chunks = chunks
+
+
+def _dump(parsed):
+    payload = {
+        'pages': [[d.page_content, d.metadata] for d in parsed.pages],
+        'chunks': [[d.page_content, d.metadata] for d in parsed.chunks],
+    }
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':'), default=str).encode('utf-8')
+
+
+def _load(doc_hash, raw):
+    payload = json.loads(raw.decode('utf-8'))
+    pages = [Document(page_content=c, metadata=m) for c, m in payload['pages']]
+    chunks = [Document(page_content=c, metadata=m) for c, m in payload['chunks']]
+    return ParsedPDF(doc_hash, pages, chunks)
+
+
+def _splitter():
+    return CharacterTextSplitter(
+        separator="\n",
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        length_function=len
+    )
+
+
+def iter_parse(data):
+    """
+    逐页产出 (页面, 该页的文本块列表)；文本块不跨页，与整份加载后再切分的结果一致
+    """
+    text_splitter = _splitter()
+    for page in pdf_extract.iter_pages(data):
+        yield page, text_splitter.split_documents([page])
+
+
+def parse_pdf_bytes(data, doc_hash=None):
+    """
+    解析PDF字节内容：逐页抽取后按固定参数切分
+    """
+    pages = []
+    chunks = []
+    for page, page_chunks in iter_parse(data):
+        pages.append(page)
+        chunks.extend(page_chunks)
+    return ParsedPDF(doc_hash or hashlib.sha256(data).hexdigest(), pages, chunks)
+
+
+class PDFParseCache:
+    """
+    两级PDF解析缓存：内存LRU + 磁盘压缩文件，均有容量上限
+    """
+
+    def __init__(self, max_memory_bytes=200 * 1024 * 1024, max_disk_bytes=1024 * 1024 * 1024,
+                 directory=None):
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.directory = directory or cache_dir("pdf_parse")
+        self._entries = OrderedDict()  # key -> (ParsedPDF, 原始字节数)
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        # 正在解析的文档：key -> threading.Event，解析结束（成功、失败或放弃）时置位并移除
+        self._in_flight = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(doc_hash):
+        return f"{doc_hash}-x{pdf_extract.EXTRACT_VERSION}-{CHUNK_SIZE}-{CHUNK_OVERLAP}"
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json.z")
+
+    def _claim(self, key):
+        """
+        登记为该文档的解析方，返回 (事件, 是否为解析方)；已有其他调用方在解析时返回其事件
+        """
+        with self._lock:
+            event = self._in_flight.get(key)
+            if event is not None:
+                return event, False
+            event = self._in_flight[key] = threading.Event()
+            return event, True
+
+    def _release(self, key, event):
+        with self._lock:
+            if self._in_flight.get(key) is event:
+                del self._in_flight[key]
+        event.set()
+
+    def _lookup(self, key, doc_hash):
+        """
+        依次查内存与磁盘，命中磁盘时载入内存；都未命中时返回 None
+        """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                raw = zlib.decompress(f.read())
+            parsed = _load(doc_hash, raw)
+            os.utime(path)
+        except (OSError, ValueError, zlib.error):
+            return None
+        with self._lock:
+            self.disk_hits += 1
+        self._remember(key, parsed, len(raw))
+        return parsed
+
+    def _store(self, key, parsed):
+        raw = _dump(parsed)
+        self._spill(key, raw)
+        self._remember(key, parsed, len(raw))
+
+    def _lookup_or_claim(self, key, doc_hash):
+        """
+        查找缓存，未命中时登记为解析方，返回 (解析结果, 事件)：命中时事件为 None；
+        其他调用方正在解析时不持有任何锁地等待其结束后重新查找，等待超时则不登记、自行解析（事件为 None）
+        """
+        while True:
+            parsed = self._lookup(key, doc_hash)
+            if parsed is not None:
+                return parsed, None
+            event, owner = self._claim(key)
+            if owner:
+                # 登记前可能刚有其他调用方写入缓存
+                parsed = self._lookup(key, doc_hash)
+                if parsed is not None:
+                    self._release(key, event)
+                    return parsed, None
+                with self._lock:
+                    self.misses += 1
+                return None, event
+            if not event.wait(PDF_PARSE_WAIT):
+                with self._lock:
+                    self.misses += 1
+                return None, None
+
+    def get(self, data, parse=parse_pdf_bytes):
+        """
+        获取PDF解析结果，未命中时调用 parse(data, doc_hash) 并写入缓存
+        """
+        doc_hash = hashlib.sha256(data).hexdigest()
+        key = self.make_key(doc_hash)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+
+        # 同一文档并发请求时只解析一次
+        parsed, event = self._lookup_or_claim(key, doc_hash)
+        if parsed is not None:
+            return parsed
+        try:
+            parsed = parse(data, doc_hash)
+            self._store(key, parsed)
+            return parsed
+        finally:
+            if event is not None:
+                self._release(key, event)
+
+    def iter_chunks(self, data):
+        """
+        逐个产出文本块：命中缓存时直接产出；未命中时边抽取边产出，全部抽取完成后写入缓存。
+        调用方中途停止读取时不写入缓存；产出期间不持有锁，同一文档的其他调用方只等待解析结束的事件
+        """
+        doc_hash = hashlib.sha256(data).hexdigest()
+        key = self.make_key(doc_hash)
+        parsed, event = self._lookup_or_claim(key, doc_hash)
+        if parsed is not None:
+            yield from parsed.chunks
+            return
+        try:
+            pages = []
+            chunks = []
+            for page, page_chunks in iter_parse(data):
+                pages.append(page)
+                chunks.extend(page_chunks)
+                yield from page_chunks
+            self._store(key, ParsedPDF(doc_hash, pages, chunks))
+        finally:
+            # 正常结束、出错或调用方关闭迭代器时都通知等待方
+            if event is not None:
+                self._release(key, event)
+
+    def _remember(self, key, parsed, size):
+        with self._lock:
+            # 同一文档重复写入时先扣除旧条目的大小
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._memory_bytes -= previous[1]
+            self._entries[key] = (parsed, size)
+            self._memory_bytes += size
+            while self._memory_bytes > self.max_memory_bytes and len(self._entries) > 1:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._memory_bytes -= evicted_size
+
+    def _spill(self, key, raw):
+        path = self._path(key)
+        tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(zlib.compress(raw, 6))
+            os.replace(tmp_path, path)
+        except OSError:
+            return
+        self._trim_disk()
+
+    def _trim_disk(self):
+        # 超出磁盘上限时按最近访问时间淘汰最旧的文件
+        files = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.json.z'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except OSError:
+                pass
+
+    def stats(self):
+        """
+        缓存统计：内存命中、磁盘命中、未命中、命中率与占用
+        """
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'memory_bytes': self._memory_bytes,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._memory_bytes = 0
+
+
+# 进程级共享的默认缓存实例
+parse_cache = PDFParseCache()
+instrumentation.register_collector("pdf_cache", parse_cache.stats)
+
+
+def load_pdf(data):
+    """
+    读取PDF解析结果（带缓存）
+    """
+    return parse_cache.get(data)
+
+
+def iter_chunks(data):
+    """
+    逐个读取PDF文本块（带缓存），未命中时边抽取边产出
+    """
+    return parse_cache.iter_chunks(data)
@@ -0,0 +1,190 @@
+"""
+PDF页面抽取：先按文件大小与页数做早期校验（只读取页面目录，不解析页面内容），
+再把页范围分给进程池并行抽取文本，按页序逐页产出；调用方可以在后续页面仍在抽取时就开始切分和嵌入。
+同时进行的页范围数量有上限，工作进程有内存上限，整份文档的文本量也有上限
+"""
+import io
+import math
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from langchain_core.documents import Document
+from pypdf import PdfReader
+
+from config import PDF_MAX_MB, PDF_MAX_PAGES
+from resource_limits import limit_address_space
+
+# 抽取结果格式的版本，抽取逻辑（页面处理、文本清理等）变化时递增，解析缓存随之失效
+EXTRACT_VERSION = 2
+# 抽取出的文本总量上限（MB），超出时停止抽取
+PDF_MAX_TEXT_MB = float(os.environ.get("PDF_MAX_TEXT_MB", "64"))
+# 抽取进程数，1 表示在当前进程中逐页抽取
+PDF_EXTRACT_WORKERS = int(os.environ.get("PDF_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+# 每个抽取任务处理的页数
+PDF_PAGES_PER_TASK = int(os.environ.get("PDF_PAGES_PER_TASK", "16"))
+# 页数达到该值才使用进程池，小文档在当前进程抽取更快
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get("PDF_PARALLEL_MIN_PAGES", "32"))
+# 每个抽取进程在启动时用量之外最多可使用的内存（MB）
+PDF_WORKER_MEMORY_MB = int(os.environ.get("PDF_WORKER_MEMORY_MB", "1024"))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# 工作进程内缓存最近打开的文档，同一文档的后续页范围不再重复读取文件结构
+_worker_reader = None
+
+
+def check_size(size):
+    """
+    文件大小超过上限时抛出 ValueError
+    """
+    if size > PDF_MAX_MB * 1024 * 1024:
+        raise ValueError(f"PDF文件大小 {size / (1024 * 1024):.1f}MB 超过上限 {PDF_MAX_MB:g}MB")
+
+
+def _open_reader(source):
+    reader = PdfReader(source)
+    if reader.is_encrypted:
+        try:
+            reader.decrypt("")
+        except Exception:
+            raise ValueError("PDF文件已加密，无法读取")
+    return reader
+
+
+def inspect(data):
+    """
+    早期校验：检查文件大小与页数（只读取页面目录），返回页数
+    """
+    check_size(len(data))
+    try:
+        reader = _open_reader(io.BytesIO(data))
+        page_count = len(reader.pages)
+    except ValueError:
+        raise
+    except Exception as e:
+        raise ValueError(f"无法读取PDF文件：{str(e)}")
+    if page_count > PDF_MAX_PAGES:
+        raise ValueError(f"PDF共{page_count}页，超过上限 {PDF_MAX_PAGES} 页")
+    return page_count
+
+
+def _page_text(reader, index):
+    try:
+        return reader.pages[index].extract_text() or ""
+    except MemoryError:
+        raise
+    except Exception:
+        # 单页内容损坏时跳过该页，不影响其他页面
+        return ""
+
+
+def _init_worker(extra_bytes):
+    # 与图表沙箱相同的做法：在启动时用量之上限制虚拟内存
+    limit_address_space(extra_bytes)
+
+
+def _extract_range(path, start, end):
+    """
+    在工作进程中抽取 [start, end) 页的文本
+    """
+    global _worker_reader
+    if _worker_reader is None or _worker_reader[0] != path:
+        _worker_reader = (path, _open_reader(path))
+    reader = _worker_reader[1]
+    return [_page_text(reader, index) for index in range(start, end)]
+
+
+def get_pool():
+    """
+    返回进程级共享的抽取进程池
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            context = multiprocessing.get_context(method)
+            if method == "forkserver":
+                context.set_forkserver_preload(["pdf_extract", "pypdf"])
+            _pool = ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS, mp_context=context,
+                                        initializer=_init_worker,
+                                        initargs=(PDF_WORKER_MEMORY_MB * 1024 * 1024,))
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _iter_serial(data, page_count):
+    reader = _open_reader(io.BytesIO(data))
+    for index in range(page_count):
+        yield index, _page_text(reader, index)
+
+
+def _iter_parallel(data, page_count):
+    """
+    页范围分给进程池并行抽取，按页序产出；最多 2 倍进程数的页范围同时在途，限制缓冲的页面数量
+    """
+    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
+        tmp_file.write(data)
+        path = tmp_file.name
+    size = max(1, min(PDF_PAGES_PER_TASK, math.ceil(page_count / PDF_EXTRACT_WORKERS)))
+    ranges = [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+    window = PDF_EXTRACT_WORKERS * 2
+    futures = {}
+    try:
+        pool = get_pool()
+        submitted = 0
+        for position, (start, end) in enumerate(ranges):
+            while submitted < len(ranges) and submitted < position + window:
+                futures[submitted] = pool.submit(_extract_range, path, *ranges[submitted])
+                submitted += 1
+            try:
+                texts = futures.pop(position).result()
+            except MemoryError:
+                raise ValueError(f"PDF第{start + 1}-{end}页解析超出内存上限")
+            except BrokenProcessPool:
+                _reset_pool()
+                raise ValueError(f"PDF第{start + 1}-{end}页解析时抽取进程异常退出")
+            for offset, text in enumerate(texts):
+                yield start + offset, text
+    finally:
+        # 调用方提前停止读取时取消尚未开始的抽取任务
+        for future in futures.values():
+            future.cancel()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+
+def iter_pages(data, page_count=None):
+    """
+    按页序逐页产出 Document（metadata 中的 page 从0开始），大文档在进程池中并行抽取
+    """
+    if page_count is None:
+        page_count = inspect(data)
+    if PDF_EXTRACT_WORKERS > 1 and page_count >= PDF_PARALLEL_MIN_PAGES:
+        pages = _iter_parallel(data, page_count)
+    else:
+        pages = _iter_serial(data, page_count)
+
+    max_chars = PDF_MAX_TEXT_MB * 1024 * 1024
+    total = 0
+    try:
+        for index, text in pages:
+            total += len(text)
+            if total > max_chars:
+                raise ValueError(f"PDF文本内容超过上限 {PDF_MAX_TEXT_MB:g}MB（第{index + 1}页）")
+            yield Document(page_content=text, metadata={'page': index})
+    finally:
+        pages.close()
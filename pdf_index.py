@@ -0,0 +1,203 @@
+"""
+PDF向量检索索引：按PDF内容哈希把切分后的文本块嵌入一次并持久化为FAISS索引，
+同一文档的后续提问、页面重跑以及新会话都直接复用磁盘上的索引
+"""
+import hashlib
+import math
+import os
+import re
+import shutil
+import threading
+from collections import OrderedDict
+
+from langchain_core.embeddings import Embeddings
+from langchain.vectorstores import FAISS
+
+from config import cache_dir
+from lazy import lazy_import
+
+# 使用本地嵌入时不需要加载 openai 客户端
+llm_client = lazy_import("llm_client")
+
+# 内存中最多保留的已加载索引数量
+MAX_LOADED_INDEXES = 8
+
+# 构建索引时每批嵌入的文本块数，前面的批次在后续页面抽取期间就开始嵌入
+EMBED_BATCH_SIZE = 64
+
+# 环境变量 PDF_EMBEDDINGS=local 时使用本地离线嵌入
+EMBEDDINGS_ENV = "PDF_EMBEDDINGS"
+
+_loaded_indexes = OrderedDict()
+_loaded_lock = threading.Lock()
+# 正在构建的文档：key -> [构建锁, 引用数]，最后一个使用者结束后移除
+_build_locks = {}
+
+_TOKEN_PATTERN = re.compile(r"[一-鿿]|[a-zA-Z0-9_]+")
+
+
+def content_hash(data):
+    """
+    计算文件内容的SHA-256哈希
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+class LocalHashEmbeddings(Embeddings):
+    """
+    本地哈希嵌入：基于中文单字/双字与英文单词的特征哈希，不访问网络，
+    用作OpenAI嵌入的离线替身（测试、演示环境）
+    """
+
+    def __init__(self, dim=512):
+        self.dim = dim
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+    def _embed(self, text):
+        vector = [0.0] * self.dim
+        tokens = _TOKEN_PATTERN.findall(text.lower())
+        features = tokens + [a + b for a, b in zip(tokens, tokens[1:])]
+        for feature in features:
+            digest = int(hashlib.md5(feature.encode("utf-8")).hexdigest()[:8], 16)
+            sign = 1.0 if digest & 1 else -1.0
+            vector[(digest >> 1) % self.dim] += sign
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+
+def get_embeddings(api_key, base_url="https://api.openai-hk.com/v1"):
+    """
+    返回默认的嵌入实现：设置 PDF_EMBEDDINGS=local 时使用本地替身，否则使用OpenAI嵌入
+    """
+    if os.environ.get(EMBEDDINGS_ENV, "").lower() == "local":
+        return LocalHashEmbeddings()
+    return llm_client.get_embeddings(api_key, base_url)
+
+
+def embeddings_id(embeddings):
+    """
+    嵌入实现的标识，不同嵌入模型的索引互不混用
+    """
+    name = type(embeddings).__name__
+    detail = getattr(embeddings, "model", None) or getattr(embeddings, "dim", "")
+    return re.sub(r"[^a-zA-Z0-9_.-]", "_", f"{name}-{detail}")
+
+
+def _index_path(doc_hash, embeddings):
+    return os.path.join(cache_dir("pdf_index"), f"{doc_hash}_{embeddings_id(embeddings)}")
+
+
+def _batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _remember(key, store):
+    with _loaded_lock:
+        _loaded_indexes[key] = store
+        _loaded_indexes.move_to_end(key)
+        while len(_loaded_indexes) > MAX_LOADED_INDEXES:
+            _loaded_indexes.popitem(last=False)
+
+
+def load_index(doc_hash, embeddings):
+    """
+    只加载已有的向量索引（优先内存，其次磁盘），不存在时返回 None，不做任何嵌入
+    """
+    key = (doc_hash, embeddings_id(embeddings))
+    with _loaded_lock:
+        if key in _loaded_indexes:
+            _loaded_indexes.move_to_end(key)
+            return _loaded_indexes[key]
+    path = _index_path(doc_hash, embeddings)
+    if not os.path.exists(os.path.join(path, "index.faiss")):
+        return None
+    store = FAISS.load_local(path, embeddings, allow_dangerous_deserialization=True)
+    _remember(key, store)
+    return store
+
+
+def get_or_build_index(doc_hash, load_chunks, embeddings):
+    """
+    获取文档的向量索引：优先内存，其次磁盘，都没有时迭代 load_chunks() 产出的文本块，分批嵌入一次后落盘
+    """
+    key = (doc_hash, embeddings_id(embeddings))
+    with _loaded_lock:
+        if key in _loaded_indexes:
+            _loaded_indexes.move_to_end(key)
+            return _loaded_indexes[key]
+        entry = _build_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+
+    try:
+        # 同一文档只允许一个线程构建，其余线程等待后直接复用
+        with entry[0]:
+            return _load_or_build(key, doc_hash, load_chunks, embeddings)
+    finally:
+        with _loaded_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _build_locks[key]
+
+
+def _load_or_build(key, doc_hash, load_chunks, embeddings):
+    store = load_index(doc_hash, embeddings)
+    if store is not None:
+        return store
+
+    path = _index_path(doc_hash, embeddings)
+    store = None
+    for batch in _batched(load_chunks(), EMBED_BATCH_SIZE):
+        if store is None:
+            store = FAISS.from_documents(batch, embeddings)
+        else:
+            store.add_documents(batch)
+    if store is None:
+        raise ValueError("PDF中没有可检索的文本内容")
+    # 先写临时目录再原子替换，避免并发读取到半成品
+    tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    store.save_local(tmp_path)
+    if os.path.exists(path):
+        shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+
+    _remember(key, store)
+    return store
+
+
+def retrieve_context(store, question, top_k=4, max_context_chars=6000):
+    """
+    检索与问题最相关的 top_k 个文本块，并按字符预算拼接成上下文
+    """
+    return format_context(store.similarity_search(question, k=top_k), max_context_chars)
+
+
+def format_context(docs, max_context_chars=6000):
+    """
+    按相关度顺序拼接文本块（带页码标注），不超过字符预算
+    """
+    parts = []
+    used = 0
+    for doc in docs:
+        content = doc.page_content.strip()
+        page = doc.metadata.get("page")
+        label = f"[第{page + 1}页]\n" if isinstance(page, int) else ""
+        part = label + content
+        # 分隔用的空行也计入预算
+        cost = len(part) + (2 if parts else 0)
+        if used + cost > max_context_chars and parts:
+            break
+        parts.append(part[:max_context_chars])
+        used += cost
+    return "\n\n".join(parts)
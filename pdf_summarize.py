@@ -0,0 +1,152 @@
+"""
+全文问题的 map-reduce 汇总辅助：分块摘要缓存、全文问题识别与逐层合并的分组。
+分块摘要以 (文档键, 分块序号, 模型) 为键存入本地SQLite，同一文档之后的全文问题只需重新执行合并步骤
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+
+import instrumentation
+from config import cache_dir
+
+# 同时进行的分块摘要请求数
+PDF_SUMMARY_WORKERS = int(os.environ.get("PDF_SUMMARY_WORKERS", "6"))
+# 一次合并请求最多输入的摘要字符数，超过时先分组合并，逐层向上直到能放进一次请求
+PDF_REDUCE_MAX_CHARS = int(os.environ.get("PDF_REDUCE_MAX_CHARS", "6000"))
+# 分块摘要有效期（秒），默认30天
+PDF_SUMMARY_TTL = float(os.environ.get("PDF_SUMMARY_TTL", str(30 * 24 * 3600)))
+
+# 需要通读全文才能回答的问题：必须明确指向整份文档（全文、整篇、这篇文章……）并带有总结类意图，
+# 「要点」「摘要」等泛用词单独出现时不算，限定了页码、章节的问题仍走检索
+_WHOLE_DOCUMENT_SCOPE = re.compile(
+    r"全文|整篇|通篇|整份|整本|整个(?:文档|文件|报告|论文|PDF)|本文|这(?:篇|份|本)(?:文章|论文|文档|文件|报告|PDF|书)?"
+    r"|(?:whole|entire|full|this) (?:document|paper|report|pdf|text|file)",
+    re.IGNORECASE
+)
+_WHOLE_DOCUMENT_INTENT = re.compile(
+    r"总结|概括|概述|摘要|综述|主要内容|主要观点|核心观点|关键概念|结论|大意|要点|讲了什么|讲的是什么|讲什么"
+    r"|summar|overview|conclusion|tl;?dr|key points|main points",
+    re.IGNORECASE
+)
+_LOCAL_SCOPE = re.compile(
+    r"第\s*[0-9一二三四五六七八九十百零两]+\s*(?:页|章|节|部分|段|条)|(?:page|section|chapter|p\.)\s*\d+",
+    re.IGNORECASE
+)
+
+
+def is_whole_document_question(question):
+    """
+    判断问题是否明确要求通读全文（如「全文总结」「这篇论文的主要观点」），而不是检索几个相关片段
+    """
+    question = question or ""
+    return (bool(_WHOLE_DOCUMENT_SCOPE.search(question)) and bool(_WHOLE_DOCUMENT_INTENT.search(question))
+            and not _LOCAL_SCOPE.search(question))
+
+
+def group_for_reduce(texts, max_chars=PDF_REDUCE_MAX_CHARS):
+    """
+    按顺序把摘要分组，每组总字符数不超过 max_chars；每组至少两条（最后一组除外），保证每层合并后条数减少
+    """
+    groups = []
+    current = []
+    size = 0
+    for text in texts:
+        if current and size + len(text) > max_chars and len(current) >= 2:
+            groups.append(current)
+            current = []
+            size = 0
+        current.append(text)
+        size += len(text)
+    if current:
+        if len(current) == 1 and groups:
+            groups[-1].append(current[0])
+        else:
+            groups.append(current)
+    return groups
+
+
+class SummaryCache:
+    """
+    基于SQLite的分块摘要缓存
+    """
+
+    def __init__(self, path=None, ttl=PDF_SUMMARY_TTL):
+        self.path = path or os.path.join(cache_dir(), "pdf_summaries.sqlite3")
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS chunk_summaries (
+                doc_key TEXT NOT NULL,
+                chunk_index INTEGER NOT NULL,
+                model TEXT NOT NULL,
+                summary TEXT NOT NULL,
+                created REAL NOT NULL,
+                PRIMARY KEY (doc_key, chunk_index, model)
+            )
+        """)
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, doc_key, model, indexes):
+        """
+        批量查找分块摘要，返回 {分块序号: 摘要}；过期条目视为未命中
+        """
+        indexes = list(indexes)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT chunk_index, summary FROM chunk_summaries "
+                "WHERE doc_key = ? AND model = ? AND created >= ?",
+                (doc_key, model, time.time() - self.ttl)
+            ).fetchall()
+            found = {index: summary for index, summary in rows}
+            found = {index: found[index] for index in indexes if index in found}
+            self.hits += len(found)
+            self.misses += len(indexes) - len(found)
+            return found
+
+    def put(self, doc_key, chunk_index, model, summary):
+        if not summary:
+            return
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO chunk_summaries (doc_key, chunk_index, model, summary, created) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (doc_key, chunk_index, model, summary, time.time())
+            )
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM chunk_summaries").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': entries,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM chunk_summaries")
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    返回进程级共享的分块摘要缓存
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SummaryCache()
+        return _cache
+
+
+instrumentation.register_collector("pdf_summaries", lambda: _cache.stats() if _cache is not None else {})
@@ -0,0 +1,239 @@
+"""
+数据集画像：对每个数据集（按内容哈希）只计算一次，结果同时供界面概览和分析提示词使用。
+缺失值、最小/最大值、均值等精确统计用NumPy对整列向量化计算；
+分位数、基数、高频值和日期列识别在大表上基于等概率抽样的样本计算
+"""
+import threading
+import warnings
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from csv_ingest import ReservoirSampler
+
+# 超过该行数时，基于样本计算分位数、基数与高频值
+SAMPLE_ROWS = 100000
+# 抽样时每批交给蓄水池的行数，内存占用与总行数无关
+SAMPLE_BATCH_ROWS = 1 << 20
+# 高频值个数
+TOP_K = 5
+# 内存中保留的画像数量
+MAX_CACHED_PROFILES = 32
+# 样本中至少该比例的值能解析为日期时，判定为日期列
+DATETIME_PARSE_RATIO = 0.9
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+class DatasetProfile:
+    """
+    数据集画像
+    """
+
+    def __init__(self, n_rows, columns, sampled, sample_rows):
+        self.n_rows = n_rows
+        self.columns = columns
+        self.sampled = sampled
+        self.sample_rows = sample_rows
+
+    @property
+    def n_cols(self):
+        return len(self.columns)
+
+    @property
+    def total_nulls(self):
+        return int(sum(col['null_count'] for col in self.columns))
+
+    @property
+    def n_dtypes(self):
+        return len({col['dtype'] for col in self.columns})
+
+    def column_names(self, kind):
+        return [col['name'] for col in self.columns if col['kind'] == kind]
+
+    def to_frame(self):
+        """
+        每列一行的画像表，用于界面展示
+        """
+        rows = []
+        for col in self.columns:
+            rows.append({
+                '列名': col['name'],
+                '数据类型': col['dtype'],
+                '类别': col['kind'],
+                '非空值数量': col['non_null'],
+                '缺失值数量': col['null_count'],
+                '缺失率': round(col['null_rate'], 4),
+                '唯一值': col['cardinality'],
+                '最小值': col.get('min'),
+                '最大值': col.get('max'),
+                '高频值': ", ".join(str(v) for v, _ in col.get('top_values', [])),
+            })
+        return pd.DataFrame(rows)
+
+    def to_prompt_text(self, max_columns=60):
+        """
+        紧凑的画像文本，用于分析提示词
+        """
+        lines = [f"共{self.n_rows}行{self.n_cols}列"
+                 + (f"（统计基于{self.sample_rows}行抽样）" if self.sampled else "")]
+        for col in self.columns[:max_columns]:
+            parts = [f"{col['name']}({col['kind']}, {col['dtype']})", f"缺失率{col['null_rate']:.1%}",
+                     f"唯一值{col['cardinality']}"]
+            if col['kind'] in ('numeric', 'datetime') and col.get('min') is not None:
+                parts.append(f"范围[{col['min']}, {col['max']}]")
+            if col.get('quantiles'):
+                q = col['quantiles']
+                parts.append(f"分位数25/50/75%=[{q[0]}, {q[1]}, {q[2]}]")
+            if col.get('top_values'):
+                parts.append("高频值：" + "、".join(f"{v}({c})" for v, c in col['top_values']))
+            lines.append("- " + "；".join(parts))
+        if self.n_cols > max_columns:
+            lines.append(f"- ……其余{self.n_cols - max_columns}列省略")
+        return "\n".join(lines)
+
+
+def _round(value):
+    if value is None:
+        return None
+    if isinstance(value, (float, np.floating)):
+        if np.isnan(value):
+            return None
+        return float(np.format_float_positional(value, precision=6, unique=True, trim='-'))
+    if isinstance(value, np.integer):
+        return int(value)
+    return value
+
+
+def _sample(df, k, seed=0):
+    """
+    等概率无放回抽取 k 行，保持原有行序：按批把行号交给与CSV分块读取相同的蓄水池抽样器，单遍完成
+    """
+    if len(df) <= k:
+        return df, False
+    sampler = ReservoirSampler(k, seed=seed)
+    for start in range(0, len(df), SAMPLE_BATCH_ROWS):
+        stop = min(start + SAMPLE_BATCH_ROWS, len(df))
+        sampler.add(pa.table({'row': np.arange(start, stop, dtype=np.int64)}))
+    index = np.sort(sampler.table.column('row').to_numpy())
+    return df.iloc[index], True
+
+
+def _top_values(series, k):
+    counts = series.value_counts(dropna=True)
+    return [(_round(v) if not isinstance(v, str) else v, int(c)) for v, c in counts.head(k).items()]
+
+
+def _looks_like_datetime(series):
+    values = series.dropna()
+    if values.empty:
+        return False
+    values = values.astype(str).head(500)
+    # 纯数字不当作日期
+    if values.str.fullmatch(r"[-+]?\d+(\.\d+)?").mean() > 0.5:
+        return False
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        parsed = pd.to_datetime(values, errors="coerce", format="mixed")
+    return parsed.notna().mean() >= DATETIME_PARSE_RATIO
+
+
+def compute_profile(df, sample_rows=SAMPLE_ROWS, top_k=TOP_K):
+    """
+    计算数据集画像（不使用缓存）
+    """
+    n_rows = len(df)
+    sample, sampled = _sample(df, sample_rows)
+    null_counts = df.isna().sum().to_numpy()
+    columns = []
+    numeric_names = []
+
+    for position, name in enumerate(df.columns):
+        series = df[name]
+        null_count = int(null_counts[position])
+        col = {
+            'name': str(name),
+            'dtype': str(series.dtype),
+            'non_null': n_rows - null_count,
+            'null_count': null_count,
+            'null_rate': null_count / n_rows if n_rows else 0.0,
+        }
+        if pd.api.types.is_bool_dtype(series):
+            col['kind'] = 'boolean'
+            col['cardinality'] = int(series.nunique(dropna=True))
+            col['top_values'] = _top_values(series, top_k)
+        elif pd.api.types.is_numeric_dtype(series):
+            col['kind'] = 'numeric'
+            values = series.to_numpy(dtype=np.float64, na_value=np.nan)
+            if col['non_null']:
+                cast = int if pd.api.types.is_integer_dtype(series) else _round
+                col['min'] = cast(np.nanmin(values))
+                col['max'] = cast(np.nanmax(values))
+                col['mean'] = _round(np.nanmean(values))
+                col['std'] = _round(np.nanstd(values))
+            col['cardinality'] = int(sample[name].nunique(dropna=True))
+            numeric_names.append(name)
+        elif pd.api.types.is_datetime64_any_dtype(series):
+            col['kind'] = 'datetime'
+            col['min'] = str(series.min()) if col['non_null'] else None
+            col['max'] = str(series.max()) if col['non_null'] else None
+            col['cardinality'] = int(sample[name].nunique(dropna=True))
+        elif isinstance(series.dtype, pd.CategoricalDtype):
+            # 分类列用编码做 bincount，整列精确统计只需一次向量化扫描
+            codes = series.cat.codes.to_numpy()
+            counts = np.bincount(codes[codes >= 0], minlength=len(series.cat.categories))
+            order = np.argsort(counts)[::-1][:top_k]
+            col['kind'] = 'categorical'
+            col['cardinality'] = int((counts > 0).sum())
+            col['top_values'] = [(series.cat.categories[i], int(counts[i])) for i in order if counts[i] > 0]
+        else:
+            sample_series = sample[name]
+            col['kind'] = 'datetime' if _looks_like_datetime(sample_series) else 'categorical'
+            col['cardinality'] = int(sample_series.nunique(dropna=True))
+            if col['kind'] == 'datetime':
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore")
+                    parsed = pd.to_datetime(sample_series, errors="coerce", format="mixed")
+                col['min'] = str(parsed.min())
+                col['max'] = str(parsed.max())
+            else:
+                col['top_values'] = _top_values(sample_series, top_k)
+        columns.append(col)
+
+    # 所有数值列的分位数在样本矩阵上一次性计算
+    if numeric_names:
+        matrix = np.column_stack([
+            sample[name].to_numpy(dtype=np.float64, na_value=np.nan) for name in numeric_names
+        ])
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            quantiles = np.nanquantile(matrix, [0.25, 0.5, 0.75], axis=0)
+        by_name = {col['name']: col for col in columns}
+        for index, name in enumerate(numeric_names):
+            by_name[str(name)]['quantiles'] = [_round(q) for q in quantiles[:, index]]
+
+    return DatasetProfile(n_rows, columns, sampled, len(sample))
+
+
+def get_profile(df, dataset_hash=None):
+    """
+    获取数据集画像：按数据集哈希缓存，同一数据集只计算一次。
+    未传入哈希时使用 df.attrs['dataset_hash']（共享数据集存储返回的视图带有该属性），都没有时不缓存
+    """
+    dataset_hash = dataset_hash or df.attrs.get('dataset_hash')
+    if dataset_hash is None:
+        return compute_profile(df)
+    with _cache_lock:
+        profile = _cache.get(dataset_hash)
+        if profile is not None:
+            _cache.move_to_end(dataset_hash)
+            return profile
+    profile = compute_profile(df)
+    with _cache_lock:
+        _cache[dataset_hash] = profile
+        while len(_cache) > MAX_CACHED_PROFILES:
+            _cache.popitem(last=False)
+    return profile
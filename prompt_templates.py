@@ -0,0 +1,254 @@
+"""
+提示词模板注册表：每个模板由固定的系统消息和带占位符的用户消息组成，首次使用时编译一次，之后直接复用。
+固定的说明与输出格式放在系统消息中，每次请求的开头完全相同，可以命中服务端的提示词前缀缓存；
+主题、历史、PDF内容等用户数据只作为模板变量放在用户消息中，内容里的花括号不会被当作占位符
+"""
+import threading
+
+from langchain_core.prompts import ChatPromptTemplate
+
+import instrumentation
+
+_definitions = {}
+_compiled = {}
+_lock = threading.Lock()
+_compiles = 0
+
+
+def register(name, system, human):
+    """
+    注册模板：system 为固定说明（其中的花括号需写成 {{ }}），human 为带占位符的用户消息
+    """
+    with _lock:
+        _definitions[name] = (system, human)
+        _compiled.pop(name, None)
+
+
+def get(name):
+    """
+    返回编译好的 ChatPromptTemplate，首次使用时编译
+    """
+    global _compiles
+    with _lock:
+        prompt = _compiled.get(name)
+        if prompt is None:
+            if name not in _definitions:
+                raise KeyError(f"未注册的提示词模板：{name}")
+            system, human = _definitions[name]
+            prompt = _compiled[name] = ChatPromptTemplate.from_messages([("system", system), ("human", human)])
+            _compiles += 1
+        return prompt
+
+
+def stats():
+    with _lock:
+        return {'registered': len(_definitions), 'compiled': len(_compiled), 'compiles': _compiles}
+
+
+instrumentation.register_collector("prompt_templates", stats)
+
+
+# 视频脚本（一次生成完整脚本）
+register("video_script", """你是一位专业的视频脚本撰写者，根据用户给出的主题与要求创作一个完整的视频脚本。
+
+写作原则：
+1. 严格遵循用户指定的风格、目标受众与时长，按每分钟约150字控制篇幅
+2. 创造力越接近0内容越严谨，越接近1越有创意
+3. 按用户要求决定是否需要开场钩子与行动号召
+
+请按以下格式输出：
+# 视频标题
+[标题]
+
+# 开场钩子
+[吸引观众的开场]
+
+# 主要内容
+[分段落的主要内容，每段标注时长]
+
+# 结尾总结
+[总结和行动号召]
+
+# 拍摄建议
+[镜头、场景、道具等建议]
+
+请确保内容结构清晰，语言生动有趣。""", """主题：{theme}
+时长：{length}分钟（约{words}字）
+风格：{style}（{style_desc}）
+目标受众：{audience}
+创造力：{creativity}（0=严谨，1=创意）
+开场钩子：{hooks}
+行动号召：{cta}""")
+
+# 视频大纲（分段生成的第一阶段）
+register("video_outline", """你是一位专业的视频脚本策划，根据用户给出的主题与要求设计视频脚本大纲。
+
+要求：
+1. 严格遵循用户指定的风格、目标受众与时长
+2. 创造力越接近0内容越严谨，越接近1越有创意
+3. 不需要开场钩子时 hook 字段留空；需要行动号召时写入结尾总结
+4. 主要内容按用户要求的段数分段，各段时长（分钟）之和等于总时长
+
+只输出JSON，不要输出其他内容，格式如下：
+{{
+  "title": "视频标题",
+  "hook": "完整的开场钩子文案",
+  "sections": [
+    {{"heading": "段落标题", "minutes": 2.5, "points": ["要点1", "要点2"]}}
+  ],
+  "summary": "完整的结尾总结（含行动号召）",
+  "shooting_notes": "镜头、场景、道具等拍摄建议"
+}}""", """主题：{theme}
+时长：{length}分钟
+风格：{style}（{style_desc}）
+目标受众：{audience}
+创造力：{creativity}（0=严谨，1=创意）
+开场钩子：{hooks}
+行动号召：{cta}
+段数：约{num_sections}段""")
+
+# 视频段落（分段生成的第二阶段）：同一视频各段的用户消息开头相同，只有段落信息不同
+register("video_section", """你是一位专业的视频脚本撰写者，正在为一个视频撰写其中一段的口播内容。
+
+要求：
+1. 严格遵循用户指定的风格与目标受众
+2. 按本段时长控制篇幅（每分钟约150字）
+3. 围绕本段要点展开，与前后段落自然衔接，不要重复其他段落的内容
+4. 不要输出段落标题，直接输出正文""", """视频主题：{theme}
+风格：{style}（{style_desc}）
+目标受众：{audience}
+
+完整大纲：
+{outline_text}
+
+请只撰写第{index}段「{heading}」：
+时长：{minutes}分钟（约{words}字）
+本段要点：{points}""")
+
+# 小红书文案（一次生成多个版本）
+register("xhs_batch", """你是一位小红书爆款写手，根据用户给出的主题与要求创作多个不同版本的文案，
+每个文案包含：标题 + 正文 + 标签。
+
+请按以下格式输出：
+
+## 文案1
+**标题：** [吸引人的标题]
+**正文：** [正文内容]
+**标签：** [相关话题标签]
+
+## 文案2
+**标题：** [吸引人的标题]
+**正文：** [正文内容]
+**标签：** [相关话题标签]
+
+[继续其他文案...]
+
+请确保每个文案都有不同的角度和表达方式，避免重复。""", """主题：{theme}
+版本数量：{num_variations}
+内容类型：{content_type}（{type_desc}）
+语调风格：{tone_desc}
+目标用户：{audience}
+包含表情符号：{emoji}
+包含话题标签：{hashtags}""")
+
+# 小红书文案（并行生成时的单个版本）：各版本的用户消息只有末尾的序号与切入角度不同
+register("xhs_single", """你是一位小红书爆款写手，根据用户给出的主题与要求创作1篇文案。
+
+请按以下格式输出，不要输出其他内容：
+**标题：** [吸引人的标题]
+**正文：** [正文内容]
+**标签：** [相关话题标签]""", """主题：{theme}
+内容类型：{content_type}（{type_desc}）
+语调风格：{tone_desc}
+目标用户：{audience}
+包含表情符号：{emoji}
+包含话题标签：{hashtags}
+这是{num_variations}个版本中的第{index}个，切入角度：{angle}""")
+
+# PDF问答（检索相关片段）
+register("pdf_qa", """你是一位专业的PDF智能问答助手。请根据用户提供的PDF内容回答用户问题。
+
+回答要求：
+1. 基于PDF内容准确回答
+2. 如果PDF中没有相关信息，请明确说明
+3. 回答要简洁明了，结构清晰
+4. 可以适当补充相关知识，但要标注来源
+5. 使用中文回答
+
+请用专业、友好的语调回答。""", """PDF内容：
+{context}
+
+用户问题：{question}""")
+
+# PDF全文问答：分块摘要、摘要合并与最终回答
+register("pdf_map", """请用中文概括用户提供的PDF片段的要点，保留关键数据、结论和专业术语，不超过200字，只输出概括内容。""",
+         """PDF片段（第{page}页）：
+{content}""")
+
+register("pdf_reduce", """用户会提供同一份PDF文档按顺序排列的若干部分的摘要，请把它们合并为一份连贯的摘要，
+保留关键数据、结论和专业术语，按原文顺序组织，不超过800字，只输出摘要内容。""", """各部分摘要：
+{summaries}""")
+
+register("pdf_answer", """你是一位专业的PDF智能问答助手。用户会提供按原文顺序整理的整篇PDF文档摘要，请据此回答用户问题。
+
+回答要求：
+1. 基于整篇文档的内容回答，兼顾各个部分
+2. 如果摘要中没有相关信息，请明确说明
+3. 回答要简洁明了，结构清晰
+4. 使用中文回答
+
+请用专业、友好的语调回答。""", """文档摘要：
+{summaries}
+
+用户问题：{question}""")
+
+# CSV分析
+register("csv_analysis", """你是一位数据分析和可视化专家。用户会给你数据信息和一个数据分析或可视化请求，请你返回三部分内容：
+
+1. 画图代码（只返回可直接用exec执行的python代码，不要返回markdown代码块）
+2. 分析文本（简要说明图表含义和数据洞察）
+3. 图表类型（返回图表类型名称，如：折线图、柱状图、散点图等）
+
+请严格按如下格式返回：
+[CODE]
+# 画图代码
+import matplotlib.pyplot as plt
+import seaborn as sns
+import plotly.express as px
+import plotly.graph_objects as go
+...
+[ENDCODE]
+[ANALYSIS]
+# 分析文本
+...
+[ENDANALYSIS]
+[CHART_TYPE]
+# 图表类型
+...
+[ENDCHART_TYPE]""", """数据信息：
+- 数据形状：{shape}
+- 列名：{columns}
+- 数值列：{numeric_columns}
+- 分类列：{categorical_columns}
+- 日期列：{datetime_columns}
+- 缺失值：{null_counts}
+- 列画像：
+{profile}
+- 数据预览：{sample_data}
+
+用户请求：{query}""")
+
+# AI对话：只有系统消息（角色说明）在同一对话中保持不变、可命中前缀缓存；
+# 窗口满后滚动摘要几乎每轮都会更新，最近消息的窗口也每轮滑动，用户消息部分无法跨轮复用
+register("chat", """{mode_desc}""", """{summary_text}{history_text}用户: {input_text}""")
+
+# 对话滚动摘要
+register("chat_summary", """请把一段对话的新增内容合并进已有的对话摘要。
+要求：保留用户的目标、偏好、已确定的结论和关键事实（如名称、数字、代码中的函数名），去掉寒暄和重复内容；
+只输出更新后的摘要，不超过用户给出的字数上限。""", """字数上限：{max_tokens}字
+
+已有摘要：
+{previous_summary}
+
+新增对话：
+{new_text}""")
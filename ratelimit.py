@@ -0,0 +1,69 @@
+"""
+令牌桶限流：按固定速率补充令牌，允许不超过桶容量的突发请求，多线程共享同一个桶
+"""
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    令牌桶：rate 为每秒补充的令牌数，capacity 为桶容量（允许的突发请求数）
+    """
+
+    def __init__(self, rate, capacity=None):
+        if rate <= 0:
+            raise ValueError("rate 必须大于0")
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1):
+        """
+        不等待地取令牌，成功返回 True
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1, timeout=None):
+        """
+        取令牌，不足时等待；返回等待的秒数。timeout 秒内仍未取到时抛出 TimeoutError
+        """
+        if tokens > self.capacity:
+            raise ValueError("请求的令牌数超过桶容量")
+        start = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return now - start
+                wait = (tokens - self._tokens) / self.rate
+            if timeout is not None and now + wait - start > timeout:
+                raise TimeoutError("等待限流令牌超时")
+            time.sleep(wait)
+
+    def penalize(self, seconds):
+        """
+        服务端要求退避（如429的Retry-After）时清空令牌，seconds 秒内不再放行新请求；
+        多个请求同时被限流时退避时间不叠加
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, 1.0 - seconds * self.rate)
+
+    @property
+    def available(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
@@ -0,0 +1,31 @@
+"""
+进程资源限制：在当前虚拟内存用量之上设置软上限，供图表沙箱与PDF抽取等工作进程使用
+"""
+import os
+
+
+def vm_bytes():
+    """
+    当前进程的虚拟内存用量（字节）
+    """
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def limit_address_space(extra_bytes):
+    """
+    把虚拟内存软上限设为当前用量加 extra_bytes；extra_bytes 为 None 时放开到硬上限。
+    不支持的平台上不做任何限制
+    """
+    try:
+        import resource
+        _, hard = resource.getrlimit(resource.RLIMIT_AS)
+        if extra_bytes is None:
+            resource.setrlimit(resource.RLIMIT_AS, (hard, hard))
+            return
+        soft = vm_bytes() + extra_bytes
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+        resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
+    except (ImportError, OSError, ValueError):
+        pass
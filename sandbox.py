@@ -0,0 +1,387 @@
+"""
+图表代码沙箱：在预先启动的独立工作进程中执行模型生成的画图代码。
+每个任务有墙钟超时与内存上限（RLIMIT_AS + 父进程轮询RSS），超限时直接结束工作进程并补充新进程；
+工作进程执行满一定次数后回收重建。工作进程从共享数据集存储的内存映射文件读取数据，
+把图表序列化为 Plotly JSON 或 PNG 字节返回给界面
+"""
+import atexit
+import builtins
+import io
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import traceback
+from collections import deque
+
+import instrumentation
+from resource_limits import limit_address_space
+
+# 工作进程数量
+SANDBOX_WORKERS = int(os.environ.get("SANDBOX_WORKERS", "2"))
+# 单个任务的墙钟超时（秒）
+SANDBOX_TIMEOUT = float(os.environ.get("SANDBOX_TIMEOUT", "30"))
+# 单个任务可新增的内存上限（MB）
+SANDBOX_MAX_MEMORY_MB = int(os.environ.get("SANDBOX_MAX_MEMORY_MB", "2048"))
+# 工作进程执行该数量的任务后回收重建
+SANDBOX_MAX_JOBS = int(os.environ.get("SANDBOX_MAX_JOBS", "20"))
+# 表格输出最多返回的行数
+MAX_TABLE_ROWS = 1000
+
+# 生成代码允许导入的模块（含子模块）
+ALLOWED_MODULES = (
+    "matplotlib", "seaborn", "plotly", "pandas", "numpy",
+    "math", "statistics", "datetime", "collections", "itertools", "re", "json",
+)
+
+_SAFE_BUILTINS = (
+    "abs", "all", "any", "bool", "dict", "divmod", "enumerate", "filter", "float", "format",
+    "frozenset", "getattr", "hasattr", "int", "isinstance", "issubclass", "iter", "len", "list",
+    "map", "max", "min", "next", "print", "range", "repr", "reversed", "round", "set", "slice",
+    "sorted", "str", "sum", "tuple", "type", "zip",
+    "Exception", "ValueError", "KeyError", "TypeError", "IndexError", "ZeroDivisionError",
+)
+
+
+class SandboxResult:
+    """
+    一次沙箱执行的结果：outputs 为 (类型, 内容) 列表，类型为 plotly/png/text/table/notice
+    """
+
+    def __init__(self, ok, outputs=None, error=None, exec_seconds=0.0, queue_seconds=0.0):
+        self.ok = ok
+        self.outputs = outputs or []
+        self.error = error
+        self.exec_seconds = exec_seconds
+        self.queue_seconds = queue_seconds
+
+
+# ---------- 工作进程 ----------
+
+def _restricted_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if level != 0 or name.split(".")[0] not in ALLOWED_MODULES:
+        raise ImportError(f"不允许导入模块：{name}")
+    return __import__(name, globals, locals, fromlist, level)
+
+
+class _StreamlitCollector:
+    """
+    替代生成代码中的 st：收集图表、文本和表格，不依赖Streamlit运行时
+    """
+
+    def __init__(self):
+        self.outputs = []
+
+    def plotly_chart(self, fig, *args, **kwargs):
+        import chart_render
+        # 序列化之前按点数预算精简大数据量的轨迹
+        fig, notes = chart_render.reduce_figure(fig)
+        self.outputs.append(("plotly", fig.to_json()))
+        if notes:
+            self.outputs.append(("notice", "⚡ 数据点较多，图表已在服务端精简：" + "；".join(notes)))
+
+    def pyplot(self, fig=None, *args, **kwargs):
+        import matplotlib.pyplot as plt
+        fig = fig or plt.gcf()
+        self.outputs.append(("png", _figure_png(fig)))
+        plt.close(fig)
+
+    def _text(self, body, *args, **kwargs):
+        self.outputs.append(("text", str(body)))
+
+    write = markdown = text = caption = info = success = warning = error = subheader = header = title = _text
+
+    def dataframe(self, data, *args, **kwargs):
+        import pandas as pd
+        frame = data if isinstance(data, pd.DataFrame) else pd.DataFrame(data)
+        self.outputs.append(("table", frame.head(MAX_TABLE_ROWS).to_json(orient="split", date_format="iso")))
+
+    table = dataframe
+
+    def metric(self, label, value, *args, **kwargs):
+        self.outputs.append(("text", f"**{label}**：{value}"))
+
+    def __getattr__(self, name):
+        # 布局类调用（columns、expander等）直接忽略
+        return lambda *args, **kwargs: None
+
+
+def _figure_png(fig):
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png", dpi=100, bbox_inches="tight")
+    return buffer.getvalue()
+
+
+def _load_dataset(path, state):
+    import pyarrow as pa
+    import dataset_store
+    if state.get("path") != path:
+        state.clear()
+        table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+        state["path"] = path
+        state["frame"] = dataset_store.arrow_to_dataframe_view(table)
+    # 每个任务拿到基准视图的浅拷贝，不复制数据；工作进程开启了写时复制，
+    # 生成代码原地修改的列才会被复制，修改也不会影响下一个任务
+    return state["frame"].copy(deep=False)
+
+
+def _execute(job, state):
+    import matplotlib.pyplot as plt
+    import pandas as pd
+    import plotly.express as px
+    import plotly.graph_objects as go
+
+    df = _load_dataset(job["dataset_path"], state)
+    collector = _StreamlitCollector()
+    safe_builtins = {name: getattr(builtins, name) for name in _SAFE_BUILTINS}
+    safe_builtins["__import__"] = _restricted_import
+    namespace = {'df': df, 'px': px, 'go': go, 'st': collector, 'pd': pd, 'plt': plt}
+
+    limit_address_space(job["max_memory_bytes"])
+    try:
+        exec(job["code"], {"__builtins__": safe_builtins}, namespace)
+    finally:
+        limit_address_space(None)
+
+    # 代码生成了图表但没有调用 st 输出时，补充收集
+    if not any(kind in ("plotly", "png") for kind, _ in collector.outputs):
+        fig = namespace.get("fig")
+        if isinstance(fig, go.Figure):
+            collector.plotly_chart(fig)
+        for number in plt.get_fignums():
+            collector.pyplot(plt.figure(number))
+    plt.close("all")
+    return collector.outputs
+
+
+def _worker_main(conn):
+    """
+    工作进程主循环：逐个接收任务并返回结果，收到 None 时退出
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import pandas as pd
+    plt.rcParams['font.sans-serif'] = ['SimHei', 'DejaVu Sans']
+    plt.rcParams['axes.unicode_minus'] = False
+    # 只在工作进程内开启写时复制：数据集视图共享只读的映射缓冲区，被修改的列才复制
+    pd.set_option("mode.copy_on_write", True)
+
+    state = {}
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+        start = time.perf_counter()
+        try:
+            outputs = _execute(job, state)
+            conn.send({'ok': True, 'outputs': outputs, 'exec_seconds': time.perf_counter() - start})
+        except MemoryError:
+            conn.send({'ok': False, 'error': "内存超出限制", 'exec_seconds': time.perf_counter() - start})
+        except Exception as e:
+            conn.send({'ok': False, 'error': f"{type(e).__name__}: {e}",
+                       'traceback': traceback.format_exc(limit=3),
+                       'exec_seconds': time.perf_counter() - start})
+
+
+# ---------- 父进程 ----------
+
+def _process_private_rss(pid):
+    """
+    工作进程的私有常驻内存（不含内存映射的数据文件页），读取失败返回 0
+    """
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            fields = f.read().split()
+        return (int(fields[1]) - int(fields[2])) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class _Worker:
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+
+    def stop(self, force=False):
+        if not force and self.process.is_alive():
+            try:
+                self.conn.send(None)
+            except (OSError, BrokenPipeError):
+                pass
+            self.process.join(1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join(1)
+        self.conn.close()
+
+
+class SandboxPool:
+    """
+    图表代码执行进程池
+    """
+
+    def __init__(self, workers=SANDBOX_WORKERS, timeout=SANDBOX_TIMEOUT, max_memory_mb=SANDBOX_MAX_MEMORY_MB,
+                 max_jobs_per_worker=SANDBOX_MAX_JOBS):
+        self.timeout = timeout
+        self.max_memory_bytes = max_memory_mb * 1024 * 1024
+        self.max_jobs_per_worker = max_jobs_per_worker
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self._context = multiprocessing.get_context(method)
+        if method == "forkserver":
+            # 重依赖只在 forkserver 中导入一次，之后每个工作进程都从它派生，启动很快
+            self._context.set_forkserver_preload(["sandbox", "dataset_store", "chart_render", "pandas",
+                                                  "plotly.express", "matplotlib.pyplot"])
+        self._lock = threading.Lock()
+        self._idle = queue.Queue()
+        self._workers = []
+        self._closed = False
+        self.waiting = 0
+        self.busy = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.memory_kills = 0
+        self.recycled = 0
+        self._exec_times = deque(maxlen=200)
+        for _ in range(max(1, workers)):
+            self._add_worker()
+
+    def _add_worker(self):
+        worker = _Worker(self._context)
+        with self._lock:
+            self._workers.append(worker)
+        self._idle.put(worker)
+
+    def _retire(self, worker, force=False):
+        with self._lock:
+            if worker in self._workers:
+                self._workers.remove(worker)
+        worker.stop(force=force)
+        if not self._closed:
+            self._add_worker()
+
+    def run(self, code, dataset_path, timeout=None):
+        """
+        在工作进程中对 dataset_path 指向的数据集执行 code，返回 SandboxResult
+        """
+        if not dataset_path:
+            return SandboxResult(False, error="数据集没有可供沙箱读取的映射文件")
+        if not os.path.exists(dataset_path):
+            # 数据集存储超出磁盘容量时可能已清理该文件，调用方需重新加载数据集
+            return SandboxResult(False, error="数据集的映射文件已被清理，请重新加载数据")
+        timeout = timeout or self.timeout
+        queued_at = time.perf_counter()
+        with self._lock:
+            self.waiting += 1
+        try:
+            worker = self._idle.get()
+        finally:
+            with self._lock:
+                self.waiting -= 1
+                self.busy += 1
+        queue_seconds = time.perf_counter() - queued_at
+
+        start = time.perf_counter()
+        try:
+            worker.conn.send({'code': code, 'dataset_path': dataset_path,
+                              'max_memory_bytes': self.max_memory_bytes})
+            reply = self._wait(worker, start + timeout)
+        except (OSError, EOFError, BrokenPipeError) as e:
+            reply = {'ok': False, 'error': f"工作进程异常退出：{e}", 'kill': True}
+        elapsed = time.perf_counter() - start
+        instrumentation.observe("chart_exec", elapsed, "CSV分析")
+        instrumentation.observe("chart_queue", queue_seconds, "CSV分析")
+        instrumentation.inc("agent_chart_runs_total", result="ok" if reply['ok'] else "error")
+
+        with self._lock:
+            self.busy -= 1
+            self._exec_times.append(elapsed)
+            if reply['ok']:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+        if reply.get('kill'):
+            self._retire(worker, force=True)
+        else:
+            worker.jobs += 1
+            if worker.jobs >= self.max_jobs_per_worker:
+                with self._lock:
+                    self.recycled += 1
+                self._retire(worker)
+            else:
+                self._idle.put(worker)
+
+        return SandboxResult(reply['ok'], outputs=reply.get('outputs'), error=reply.get('error'),
+                             exec_seconds=elapsed, queue_seconds=queue_seconds)
+
+    def _wait(self, worker, deadline):
+        # 轮询等待结果，同时检查超时与内存
+        while True:
+            if worker.conn.poll(0.05):
+                return worker.conn.recv()
+            if not worker.process.is_alive():
+                return {'ok': False, 'error': "工作进程异常退出", 'kill': True}
+            if time.perf_counter() > deadline:
+                with self._lock:
+                    self.timeouts += 1
+                return {'ok': False, 'error': f"执行超时（超过{self.timeout:.0f}秒）", 'kill': True}
+            if _process_private_rss(worker.process.pid) > self.max_memory_bytes:
+                with self._lock:
+                    self.memory_kills += 1
+                return {'ok': False, 'error': "内存超出限制", 'kill': True}
+
+    def stats(self):
+        """
+        队列深度、忙碌进程数与执行耗时统计
+        """
+        with self._lock:
+            times = sorted(self._exec_times)
+            return {
+                'workers': len(self._workers),
+                'busy': self.busy,
+                'queue_depth': self.waiting,
+                'completed': self.completed,
+                'failed': self.failed,
+                'timeouts': self.timeouts,
+                'memory_kills': self.memory_kills,
+                'recycled': self.recycled,
+                'avg_exec_seconds': sum(times) / len(times) if times else 0.0,
+                'p95_exec_seconds': times[min(len(times) - 1, int(len(times) * 0.95))] if times else 0.0,
+            }
+
+    def close(self):
+        self._closed = True
+        with self._lock:
+            workers = list(self._workers)
+            self._workers.clear()
+        for worker in workers:
+            worker.stop()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    返回进程级共享的沙箱进程池（首次使用时启动工作进程）
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SandboxPool()
+            atexit.register(_pool.close)
+        return _pool
+
+
+# 只在进程池已启动时导出统计，避免抓取指标时启动工作进程
+instrumentation.register_collector("sandbox", lambda: _pool.stats() if _pool is not None else {})
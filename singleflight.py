@@ -0,0 +1,118 @@
+"""
+请求合并（single-flight）：多个会话同时发起完全相同的模型请求（渲染后的提示词、模型、温度、服务地址与API密钥都相同）时，
+只有第一个请求真正调用模型，其余请求等待同一次调用，并实时收到同样的流式输出。
+上游由后台线程读取，任何一个调用方中途离开都不影响其他调用方
+"""
+import contextvars
+import hashlib
+import json
+import threading
+
+import instrumentation
+
+
+def flight_key(api_key, base_url, model, temperature, prompt_text):
+    """
+    请求合并键：包含API密钥的哈希，不同密钥的请求各自计费、各自承担鉴权与限流结果，不会互相合并
+    """
+    key_hash = hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()
+    payload = json.dumps([key_hash, base_url, model, float(temperature), prompt_text], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class Flight:
+    """
+    一次进行中的上游调用：保存已收到的分片，供所有调用方从头读取
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._chunks = []
+        self._done = False
+        self._error = None
+
+    def publish(self, chunk):
+        with self._cond:
+            self._chunks.append(chunk)
+            self._cond.notify_all()
+
+    def finish(self, error=None):
+        with self._cond:
+            self._done = True
+            self._error = error
+            self._cond.notify_all()
+
+    def subscribe(self):
+        """
+        从第一个分片开始产出，之后随上游实时产出；上游出错时抛出同样的异常
+        """
+        index = 0
+        while True:
+            with self._cond:
+                while index >= len(self._chunks) and not self._done:
+                    self._cond.wait()
+                chunks = self._chunks[index:]
+                done, error = self._done, self._error
+            index += len(chunks)
+            yield from chunks
+            if done:
+                if error is not None:
+                    raise error
+                return
+
+
+class SingleFlightGroup:
+    """
+    按键合并进行中的请求
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+        self.leaders = 0
+        self.coalesced = 0
+
+    def join(self, key, source):
+        """
+        加入键为 key 的请求，返回 (分片迭代器, 是否为发起方)。
+        没有进行中的相同请求时由后台线程迭代 source() 发起调用
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                return flight.subscribe(), False
+            flight = self._flights[key] = Flight()
+            self.leaders += 1
+        # 后台线程沿用发起方的上下文（如 governor 的会话标识）
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(self._pump, key, flight, source), daemon=True,
+                         name="singleflight").start()
+        return flight.subscribe(), True
+
+    def _pump(self, key, flight, source):
+        error = None
+        try:
+            for chunk in source():
+                flight.publish(chunk)
+        except Exception as e:
+            error = e
+        finally:
+            # 先移除再结束：结束之后到达的相同请求会重新发起，而不是读到已结束的结果
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.finish(error)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._flights),
+                'leaders': self.leaders,
+                'coalesced': self.coalesced,
+            }
+
+
+# 进程级共享的请求合并组
+group = SingleFlightGroup()
+instrumentation.register_collector("singleflight", group.stats)
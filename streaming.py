@@ -0,0 +1,121 @@
+"""
+流式输出工具：包装逐token生成器，记录首字延迟（TTFT）与总耗时
+"""
+import time
+
+
+class TokenStream:
+    """
+    可迭代的token流。迭代时逐个产出文本片段，结束后可读取完整文本与耗时统计：
+
+    - ttft：从调用开始到收到第一个token的秒数
+    - elapsed：从调用开始到流结束的秒数
+    - cached：回复是否来自响应缓存
+    - queue_seconds：请求在调度器中排队等待的秒数
+    - coalesced：是否合并到了其他会话进行中的相同请求
+    - cached_prompt_tokens：服务端命中提示词前缀缓存的token数（流结束后可用）
+
+    on_finish(stream, error) 在流结束（正常结束、出错或提前关闭）时调用一次，用于记录指标
+    """
+
+    def __init__(self, tokens, error_prefix=None, cached=False, on_finish=None):
+        self._tokens = tokens
+        self.error_prefix = error_prefix
+        # 是否直接来自响应缓存
+        self.cached = cached
+        self.queue_seconds = 0.0
+        self.coalesced = False
+        self.cached_prompt_tokens = 0
+        self.started_at = time.perf_counter()
+        self.first_token_at = None
+        self.finished_at = None
+        self.token_count = 0
+        self.error = None
+        self._on_finish = on_finish
+        self._parts = []
+        self._gen = self._run()
+
+    def __iter__(self):
+        # 流只能被消费一次；部分消费后调用 collect() 会继续读完剩余部分
+        return self._gen
+
+    def _run(self):
+        try:
+            for token in self._tokens:
+                if not token:
+                    continue
+                if self.first_token_at is None:
+                    self.first_token_at = time.perf_counter()
+                self._parts.append(token)
+                self.token_count += 1
+                yield token
+        except Exception as e:
+            self.error = e
+            if self.error_prefix:
+                raise Exception(f"{self.error_prefix}：{str(e)}") from e
+            raise
+        finally:
+            self.finished_at = time.perf_counter()
+            if self._on_finish is not None:
+                try:
+                    self._on_finish(self, self.error)
+                except Exception:
+                    # 指标记录失败不影响调用方
+                    pass
+
+    @property
+    def text(self):
+        return "".join(self._parts)
+
+    @property
+    def ttft(self):
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.started_at
+
+    @property
+    def elapsed(self):
+        end = self.finished_at if self.finished_at is not None else time.perf_counter()
+        return end - self.started_at
+
+    def collect(self):
+        """
+        消费整个流并返回完整文本（阻塞调用）
+        """
+        for _ in self._gen:
+            pass
+        return self.text
+
+
+def stream_section(tokens, start_tag, end_tag):
+    """
+    从token流中只产出 start_tag 与 end_tag 之间的内容，用于在界面上流式展示某一段落
+    """
+    buffer = ""
+    emitted = 0
+    started = False
+    finished = False
+    for token in tokens:
+        if finished:
+            # 继续消费剩余token，保证上游流能完整结束
+            continue
+        buffer += token
+        if not started:
+            pos = buffer.find(start_tag)
+            if pos < 0:
+                continue
+            started = True
+            emitted = pos + len(start_tag)
+        end = buffer.find(end_tag, emitted)
+        if end >= 0:
+            if end > emitted:
+                yield buffer[emitted:end]
+            finished = True
+            continue
+        # 保留可能是结束标记前缀的尾部，避免把标记的一部分输出
+        safe = len(buffer) - (len(end_tag) - 1)
+        if safe > emitted:
+            yield buffer[emitted:safe]
+            emitted = safe
+    if started and not finished and len(buffer) > emitted:
+        yield buffer[emitted:]
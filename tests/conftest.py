@@ -0,0 +1,9 @@
+"""
+测试公共配置：把仓库根目录加入导入路径，本地缓存写到临时目录
+"""
+import os
+import sys
+import tempfile
+
+os.environ.setdefault("AGENT_CACHE_DIR", tempfile.mkdtemp(prefix="agent-test-cache-"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+import batch_cli
+import utils
+
+
+@pytest.fixture
+def fake_generators(monkeypatch):
+    calls = []
+
+    def video(theme, length, creativity, api_key, **kwargs):
+        calls.append(("video", kwargs['model'], theme))
+        return f"video:{theme}"
+
+    def xhs(theme, api_key, **kwargs):
+        calls.append(("xhs", kwargs['model'], theme))
+        return f"xhs:{theme}"
+
+    monkeypatch.setattr(utils, "generate_video_script_enhanced", video)
+    monkeypatch.setattr(utils, "generate_xiaohongshu_content_enhanced", xhs)
+    return calls
+
+
+def _run(tmp_path, *extra):
+    source = tmp_path / "themes.jsonl"
+    if not source.exists():
+        source.write_text("\n".join(json.dumps({'theme': t}) for t in ("咖啡", "露营")) + "\n", encoding="utf-8")
+    return batch_cli.main([str(source), "--api-key", "k", "--rate", "0", *extra])
+
+
+def test_resume_skips_completed_rows(tmp_path, fake_generators):
+    assert _run(tmp_path) == 0
+    assert len(fake_generators) == 2
+    assert _run(tmp_path) == 0
+    assert len(fake_generators) == 2
+
+
+def test_resume_is_scoped_to_task_and_model(tmp_path, fake_generators):
+    _run(tmp_path, "--task", "video")
+    _run(tmp_path, "--task", "xhs")
+    _run(tmp_path, "--task", "xhs", "--model", "other-model")
+    _run(tmp_path, "--task", "xhs", "--model", "other-model")
+    assert [(task, model) for task, model, _ in fake_generators] == (
+        [("video", "gpt-4o-mini")] * 2 + [("xhs", "gpt-4o-mini")] * 2 + [("xhs", "other-model")] * 2
+    )
+    records = [json.loads(line) for line in (tmp_path / "themes.results.jsonl").read_text(encoding="utf-8").splitlines()]
+    assert len(records) == 6
+    assert batch_cli.load_done(str(tmp_path / "themes.results.jsonl")) == {
+        (record['id'], record['task'], record['model']) for record in records
+    }
+
+
+def test_invalid_rows_are_recorded_as_errors(tmp_path, fake_generators):
+    source = tmp_path / "themes.jsonl"
+    source.write_text(json.dumps({'theme': ""}) + "\n" + json.dumps({'theme': "x", 'task': "poem"}) + "\n",
+                      encoding="utf-8")
+    assert _run(tmp_path) == 1
+    assert fake_generators == []
+    statuses = [json.loads(line)['status'] for line in (tmp_path / "themes.results.jsonl").read_text().splitlines()]
+    assert statuses == ["error", "error"]
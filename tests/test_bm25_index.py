@@ -0,0 +1,66 @@
+from langchain_core.documents import Document
+
+import bm25_index
+
+
+def _doc(text, page=0):
+    return Document(page_content=text, metadata={'page': page})
+
+
+def test_tokenize_splits_chinese_into_bigrams_and_english_into_words():
+    assert bm25_index.tokenize("机器学习 Model_v2 很好") == ["机器", "器学", "学习", "model_v2", "很好"]
+    assert bm25_index.tokenize("猫") == ["猫"]
+
+
+def test_search_ranks_matching_chunks_and_skips_zero_scores():
+    index = bm25_index.BM25Index.build([
+        _doc("营业收入同比增长 revenue growth", 0),
+        _doc("员工人数与办公地点", 1),
+        _doc("营业收入 营业收入 营业收入", 2),
+    ])
+    results = index.search("营业收入", top_k=5)
+    assert [doc.metadata['page'] for doc, _ in results] == [2, 0]
+    assert results[0][1] > results[1][1] > 0
+    assert index.search("不存在的词") == []
+
+
+def test_rare_terms_weigh_more_than_common_ones():
+    index = bm25_index.BM25Index.build([
+        _doc("alpha common"), _doc("beta common"), _doc("gamma common"),
+    ])
+    scores = index.scores("alpha common")
+    assert scores[0] > scores[1] == scores[2] > 0
+
+
+def test_save_and_load_round_trip(tmp_path):
+    index = bm25_index.BM25Index.build([_doc("现金流量表", 3), _doc("balance sheet", 4)])
+    path = str(tmp_path / "index")
+    index.save(path)
+    loaded = bm25_index.BM25Index.load(path)
+    assert [(d.page_content, s) for d, s in loaded.search("balance")] == \
+        [(d.page_content, s) for d, s in index.search("balance")]
+    assert loaded.docs[0].metadata == {'page': 3}
+
+
+def test_rrf_fuse_rewards_chunks_found_by_both_rankings():
+    a, b, c = _doc("a", 0), _doc("b", 1), _doc("c", 2)
+    fused = bm25_index.rrf_fuse([[a, b, c], [b, c]], top_k=3)
+    assert [d.page_content for d in fused] == ["b", "c", "a"]
+    # 页码与内容相同的文本块视为同一个
+    assert len(bm25_index.rrf_fuse([[a], [_doc("a", 0)]], top_k=5)) == 1
+
+
+def test_get_or_build_index_reuses_disk_index_and_releases_locks():
+    calls = []
+
+    def load_chunks():
+        calls.append(1)
+        return [_doc("利润表", 0)]
+
+    index = bm25_index.get_or_build_index("bm25-doc", load_chunks)
+    with bm25_index._loaded_lock:
+        bm25_index._loaded_indexes.clear()
+    reloaded = bm25_index.get_or_build_index("bm25-doc", load_chunks)
+    assert reloaded is not index and reloaded.search("利润")[0][0].page_content == "利润表"
+    assert calls == [1]
+    assert bm25_index._build_locks == {}
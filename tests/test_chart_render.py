@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+import chart_render
+
+
+def test_lttb_keeps_endpoints_and_peaks():
+    x = np.arange(1000, dtype=np.float64)
+    y = np.zeros(1000)
+    y[500] = 100.0
+    keep = chart_render.lttb_indices(x, y, 50)
+    assert len(keep) == 50
+    assert keep[0] == 0 and keep[-1] == 999
+    assert np.all(np.diff(keep) > 0)
+    assert 500 in keep
+
+
+def test_lttb_returns_everything_under_threshold():
+    x = np.arange(10, dtype=np.float64)
+    assert np.array_equal(chart_render.lttb_indices(x, x, 20), np.arange(10))
+
+
+def test_small_figures_are_untouched():
+    fig = go.Figure(go.Scatter(x=[1, 2, 3], y=[3, 2, 1]))
+    fig, notes = chart_render.reduce_figure(fig, budget=100)
+    assert notes == [] and list(fig.data[0].y) == [3, 2, 1]
+
+
+def test_line_is_downsampled_with_per_point_attributes():
+    n = 10000
+    dates = pd.date_range("2024-01-01", periods=n, freq="min")
+    fig = go.Figure(go.Scatter(x=dates, y=np.sin(np.arange(n) / 50), mode="lines", text=[str(i) for i in range(n)]))
+    fig, notes = chart_render.reduce_figure(fig, budget=200)
+    trace = fig.data[0]
+    assert len(notes) == 1 and "LTTB" in notes[0]
+    assert len(trace.y) == 200 and len(trace.text) == 200
+    assert pd.Timestamp(trace.x[0]) == dates[0] and pd.Timestamp(trace.x[-1]) == dates[-1]
+
+
+def test_scatter_is_binned_into_a_grid():
+    rng = np.random.default_rng(0)
+    fig = go.Figure(go.Scatter(x=rng.normal(size=5000), y=rng.normal(size=5000), mode="markers"))
+    fig, notes = chart_render.reduce_figure(fig, budget=100)
+    trace = fig.data[0]
+    assert len(notes) == 1 and "网格" in notes[0]
+    assert len(trace.x) <= 100
+    assert trace.customdata.sum() == 5000
+
+
+def test_bar_categories_keep_largest_and_merge_the_rest():
+    categories = [f"c{i}" for i in range(50)]
+    values = list(range(50))
+    fig = go.Figure(go.Bar(x=categories, y=values))
+    fig, notes = chart_render.reduce_figure(fig, budget=5)
+    trace = fig.data[0]
+    assert list(trace.x) == ["c49", "c48", "c47", "c46", "其他"]
+    assert trace.y[-1] == sum(range(46))
+    assert sum(trace.y) == sum(values)
+
+
+def test_histogram_is_prebinned_into_bars():
+    values = np.random.default_rng(1).normal(size=20000)
+    fig = go.Figure(go.Histogram(x=values, nbinsx=30))
+    fig, notes = chart_render.reduce_figure(fig, budget=1000)
+    trace = fig.data[0]
+    assert trace.type == "bar" and len(trace.x) == 30
+    assert sum(trace.y) == 20000
@@ -0,0 +1,75 @@
+import chat_memory
+from chat_memory import ChatMemory
+
+
+def _history(n):
+    # 每条消息估算为 1 + 4 个token
+    return [{'role': "user" if i % 2 == 0 else "assistant", 'content': f"m{i}"} for i in range(n)]
+
+
+def test_estimate_tokens():
+    assert chat_memory.estimate_tokens("") == 0
+    assert chat_memory.estimate_tokens("你好世界") == 4
+    assert chat_memory.estimate_tokens("hello, world") == 2 + 1 + 2
+
+
+def test_truncate_keeps_head_and_tail():
+    text = "开头" + "中" * 200 + "结尾"
+    short = chat_memory.truncate_to_tokens(text, 30)
+    assert short.startswith("开头") and short.endswith("结尾")
+    assert "省略" in short and len(short) < len(text)
+    assert chat_memory.truncate_to_tokens("短文本", 30) == "短文本"
+
+
+def test_window_keeps_latest_messages_within_budget():
+    memory = ChatMemory(budget=12)
+    history = _history(5)
+    assert memory.window_start(history) == 3
+    summary, recent = memory.context(history)
+    assert summary == "" and [m['content'] for m in recent] == ["m3", "m4"]
+
+
+def test_window_always_keeps_latest_message():
+    memory = ChatMemory(budget=1)
+    history = [{'role': "user", 'content': "很长的一条消息" * 10}]
+    summary, recent = memory.context(history)
+    assert len(recent) == 1 and "省略" in recent[0]['content']
+
+
+def test_update_summarizes_each_message_once():
+    memory = ChatMemory(budget=12)
+    calls = []
+
+    def summarize(previous, messages, limit):
+        calls.append([m['content'] for m in messages])
+        return previous + "".join(m['content'] for m in messages)
+
+    history = _history(5)
+    assert memory.update(history, summarize)
+    assert not memory.update(history, summarize)
+    history += _history(7)[5:]
+    assert memory.update(history, summarize)
+    assert calls == [["m0", "m1", "m2"], ["m3", "m4"]]
+    assert memory.summary == "m0m1m2m3m4" and memory.summarized_count == 5
+    assert [m['content'] for m in memory.context(history)[1]] == ["m5", "m6"]
+
+
+def test_offset_history_tail_matches_full_history():
+    memory = ChatMemory(budget=12, summary="s", summarized_count=3)
+    history = _history(6)
+    assert memory.context(history[2:], offset=2) == memory.context(history)
+    assert memory.pending(history[2:], offset=2) == memory.pending(history)
+
+
+def test_prompt_tokens_stay_bounded():
+    memory = ChatMemory(budget=20, summary_budget=10)
+    history = []
+    for i in range(50):
+        history.append({'role': "user", 'content': f"第{i}个问题"})
+        memory.update(history, lambda previous, messages, limit: "摘要" * 5)
+        assert memory.prompt_tokens(history) <= 20 + 10
+
+
+def test_round_trip_through_dict():
+    memory = ChatMemory(budget=10, summary_budget=5, summary="s", summarized_count=2)
+    assert ChatMemory.from_dict(memory.to_dict()).to_dict() == memory.to_dict()
@@ -0,0 +1,49 @@
+from chat_store import ChatStore
+
+
+def _store(tmp_path, n=0, conversation_id="c"):
+    store = ChatStore(str(tmp_path / "chat.sqlite3"))
+    for i in range(n):
+        store.append(conversation_id, "user" if i % 2 == 0 else "assistant", f"msg{i}")
+    return store
+
+
+def test_append_returns_sequence_numbers_per_conversation(tmp_path):
+    store = _store(tmp_path)
+    assert [store.append("a", "user", "x") for _ in range(3)] == [0, 1, 2]
+    assert store.append("b", "user", "y") == 0
+
+
+def test_page_walks_backwards_in_chronological_pages(tmp_path):
+    store = _store(tmp_path, 7)
+    latest = store.page("c", limit=3)
+    assert [m['seq'] for m in latest] == [4, 5, 6]
+    older = store.page("c", before_seq=latest[0]['seq'], limit=3)
+    assert [m['seq'] for m in older] == [1, 2, 3]
+    oldest = store.page("c", before_seq=older[0]['seq'], limit=3)
+    assert [m['content'] for m in oldest] == ["msg0"]
+    assert store.page("c", before_seq=0, limit=3) == []
+
+
+def test_messages_from_and_iter_messages(tmp_path):
+    store = _store(tmp_path, 5)
+    assert [m['seq'] for m in store.messages_from("c", 3)] == [3, 4]
+    assert [m['seq'] for m in store.iter_messages("c", batch_size=2)] == [0, 1, 2, 3, 4]
+    assert list(store.iter_messages("missing")) == []
+
+
+def test_stats_are_maintained_incrementally(tmp_path):
+    store = _store(tmp_path)
+    store.append("c", "user", "你好")
+    store.append("c", "assistant", "hello")
+    assert store.stats("c") == {'message_count': 2, 'total_chars': 7}
+    assert store.stats("missing") == {'message_count': 0, 'total_chars': 0}
+
+
+def test_memory_survives_reopen(tmp_path):
+    store = _store(tmp_path, 2)
+    store.save_memory("c", {'summary': "摘要", 'summarized_count': 1})
+    reopened = ChatStore(str(tmp_path / "chat.sqlite3"))
+    assert reopened.load_memory("c") == {'summary': "摘要", 'summarized_count': 1}
+    assert reopened.stats("c")['message_count'] == 2
+    assert reopened.load_memory("missing") is None
@@ -0,0 +1,78 @@
+import pandas as pd
+import pytest
+
+import code_cache
+import utils
+
+RESPONSE = "[ANALYSIS]趋势向上[ENDANALYSIS][CODE]st.write(df.sum())[ENDCODE][CHART_TYPE]line[ENDCHART_TYPE]"
+
+
+class _FakeStream:
+    def __init__(self, text):
+        self.text = text
+
+    def __iter__(self):
+        return iter([self.text])
+
+    def collect(self):
+        return self.text
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    cache = code_cache.CodeCache(path=str(tmp_path / "code.sqlite3"))
+    monkeypatch.setattr(code_cache, "get_cache", lambda: cache)
+    return cache
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+
+    def analyze_csv_stream(df, query, api_key, **kwargs):
+        calls.append(query)
+        return _FakeStream(RESPONSE)
+
+    monkeypatch.setattr(utils, "analyze_csv_stream", analyze_csv_stream)
+    return calls
+
+
+def _analyze(df, **kwargs):
+    return utils.analyze_csv_with_plot_enhanced(df, "趋势", "key", **kwargs)
+
+
+def test_validated_code_is_cached_and_reused_across_same_schema(cache, calls):
+    validated = []
+    streams = []
+    code, analysis, chart_type = _analyze(pd.DataFrame({'x': [1, 2]}), validate=lambda c: validated.append(c) or True,
+                                          on_stream=streams.append)
+    assert (code, analysis, chart_type) == ("st.write(df.sum())", "趋势向上", "line")
+    assert len(streams) == 1
+    # 结构相同的另一份数据：不再调用模型，缓存的代码同样经过验证
+    assert _analyze(pd.DataFrame({'x': [5, 6, 7]}), validate=lambda c: validated.append(c) or True)[0] == code
+    assert len(calls) == 1 and validated == [code, code]
+
+
+def test_failed_validation_is_not_cached(cache, calls):
+    _analyze(pd.DataFrame({'x': [1]}), validate=lambda c: False)
+    _analyze(pd.DataFrame({'x': [1]}), validate=lambda c: False)
+    assert len(calls) == 2
+    assert cache.get(code_cache.schema_fingerprint(pd.DataFrame({'x': [1]})), "趋势") is None
+
+
+def test_cached_code_failing_validation_is_regenerated(cache, calls):
+    df = pd.DataFrame({'x': [1]})
+    cache.put(code_cache.schema_fingerprint(df), "趋势", "raise ValueError()", "bar", "旧分析")
+    results = iter([False, True])
+    assert _analyze(df, validate=lambda c: next(results))[1] == "趋势向上"
+    assert len(calls) == 1
+    assert cache.get(code_cache.schema_fingerprint(df), "趋势").code == "st.write(df.sum())"
+
+
+def test_errors_are_prefixed_once(cache, monkeypatch):
+    def failing(*args, **kwargs):
+        raise Exception("CSV分析失败：上游错误")
+
+    monkeypatch.setattr(utils, "analyze_csv_stream", failing)
+    with pytest.raises(Exception, match="^CSV分析失败：上游错误$"):
+        _analyze(pd.DataFrame({'x': [1]}))
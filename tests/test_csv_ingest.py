@@ -0,0 +1,65 @@
+import io
+
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+import csv_ingest
+
+
+@pytest.fixture
+def small_blocks(monkeypatch):
+    # 缩小分块大小，让后续块中的类型变化出现在第一块之后
+    monkeypatch.setattr(csv_ingest, "CHUNK_BLOCK_BYTES", 1 << 12)
+
+
+def _csv(rows, tail):
+    lines = ["id,value,label"] + [f"{i},{i * 2},a" for i in range(rows)] + tail
+    return ("\n".join(lines) + "\n").encode()
+
+
+def test_chunked_widens_integer_column_to_float(small_blocks):
+    data = _csv(2000, ["2000,1.5,b"])
+    # 只按第一块推断类型时会在最后一块报错
+    with pytest.raises(pa.ArrowInvalid):
+        list(csv_ingest.iter_csv_batches(io.BytesIO(data), csv_ingest.CHUNK_BLOCK_BYTES))
+    result = csv_ingest.read_csv_optimized(data, chunked=True)
+    assert result.total_rows == 2001
+    assert pd.api.types.is_float_dtype(result.df["value"])
+    assert result.df["value"].iloc[-1] == 1.5
+
+
+def test_chunked_widens_integer_column_to_string(small_blocks):
+    data = _csv(2000, ["2000,oops,b", "2001,3.5,c"])
+    result = csv_ingest.read_csv_optimized(data, chunked=True)
+    assert result.total_rows == 2002
+    assert list(result.df["value"].astype(str).tail(2)) == ["oops", "3.5"]
+    assert pd.api.types.is_integer_dtype(result.df["id"])
+
+
+def test_chunked_matches_full_read_without_type_changes(small_blocks):
+    data = _csv(3000, [])
+    chunked = csv_ingest.read_csv_optimized(data, chunked=True)
+    full = csv_ingest.read_csv_optimized(data, chunked=False)
+    assert chunked.mode == "chunked" and full.mode == "pyarrow"
+    pd.testing.assert_frame_equal(chunked.df, full.df, check_dtype=False, check_categorical=False)
+
+
+def test_reservoir_sampler_keeps_k_rows():
+    sampler = csv_ingest.ReservoirSampler(100, seed=1)
+    for start in range(0, 10000, 1000):
+        sampler.add(pa.table({"x": list(range(start, start + 1000))}))
+    assert sampler.seen == 10000
+    assert sampler.sampled
+    values = sampler.table.column("x").to_pylist()
+    assert len(values) == 100 and len(set(values)) == 100
+    # 样本应覆盖整个数据流，而不只是前面的批次
+    assert max(values) > 5000
+
+
+def test_optimize_dtypes_downcasts_and_categorizes():
+    df = pd.DataFrame({"small": [1, 2, 3, 4], "ratio": [0.5, 0.25, 1.0, 2.0], "kind": ["a", "a", "b", "a"]})
+    csv_ingest.optimize_dtypes(df)
+    assert df["small"].dtype == "uint8"
+    assert df["ratio"].dtype == "float32"
+    assert df["kind"].dtype == "category"
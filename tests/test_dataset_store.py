@@ -0,0 +1,38 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import dataset_store
+from csv_ingest import IngestResult
+
+
+def _ingest(frame, calls):
+    def ingest():
+        calls.append(1)
+        return IngestResult(frame, "pyarrow", 0.0, 0, 0, len(frame), False)
+    return ingest
+
+
+def test_views_are_zero_copy_and_read_only(tmp_path):
+    store = dataset_store.DatasetStore(directory=str(tmp_path))
+    result = store.load("a", _ingest(pd.DataFrame({'x': np.arange(5.0), 's': list("abcde")}), []))
+    assert not result.df['x'].to_numpy().flags.writeable
+    assert result.df.attrs['dataset_hash'] == "a"
+    assert list(result.df['s']) == list("abcde")
+
+
+def test_trimmed_file_is_rewritten_on_next_load(tmp_path):
+    frame = pd.DataFrame({'x': np.arange(1000.0)})
+    calls = []
+    # 内存预算只够映射一个数据集，磁盘预算只够保存一个文件
+    store = dataset_store.DatasetStore(directory=str(tmp_path), memory_budget_bytes=1, disk_budget_bytes=1)
+    first = store.load("a", _ingest(frame, calls))
+    second = store.load("b", _ingest(frame, calls))
+    # 刚写入的数据集不会被自己的磁盘清理删除
+    assert os.path.exists(second.mapped_path)
+    store.load("c", _ingest(frame, calls))
+    # a 已被移出内存映射，其文件随后被磁盘清理删除；会话里保存的路径失效
+    assert not os.path.exists(first.mapped_path)
+    again = store.load("a", _ingest(frame, calls))
+    assert os.path.exists(again.mapped_path) and len(calls) == 4
@@ -0,0 +1,111 @@
+import json
+import time
+
+import httpx
+import openai
+import pytest
+
+import governor
+from benchmarks.fake_openai import (FakeOpenAIConfig, FakeOpenAIServer, PROMPT_CACHE_BLOCK,
+                                    PROMPT_CACHE_MIN_TOKENS, canned_response)
+
+
+@pytest.fixture
+def server():
+    server = FakeOpenAIServer(config=FakeOpenAIConfig(latency=0.0, tokens_per_second=0, max_chars=40)).start()
+    yield server
+    server.stop()
+
+
+def _client(server):
+    return openai.OpenAI(api_key="test", base_url=server.base_url, max_retries=0)
+
+
+def _chat(client, content, **kwargs):
+    return client.chat.completions.create(model="gpt-4o-mini", messages=[{"role": "user", "content": content}],
+                                          **kwargs)
+
+
+def test_streaming_returns_canned_text_in_chunks_with_usage(server):
+    chunks = list(_chat(_client(server), "你好", stream=True, stream_options={"include_usage": True}))
+    text = "".join(chunk.choices[0].delta.content or "" for chunk in chunks if chunk.choices)
+    assert text == canned_response("你好", 40)
+    # 首个分片只有角色，随后每个分片2个字符，最后一个分片带结束原因与用量
+    assert len(chunks) == 1 + len(text) // 2 + 1
+    assert chunks[-1].choices[0].finish_reason == "stop"
+    assert chunks[-1].usage.completion_tokens == len(text) // 2 and chunks[-1].usage.prompt_tokens == 2
+
+
+def test_stream_without_include_usage_has_no_usage(server):
+    chunks = list(_chat(_client(server), "你好", stream=True))
+    assert all(chunk.usage is None for chunk in chunks)
+
+
+def test_responses_are_deterministic_per_prompt(server):
+    client = _client(server)
+    first = _chat(client, "同一个问题").choices[0].message.content
+    assert _chat(client, "同一个问题").choices[0].message.content == first
+    assert _chat(client, "另一个问题").choices[0].message.content != first
+
+
+def test_streaming_paces_tokens_by_tokens_per_second(server):
+    server.config.tokens_per_second = 100
+    server.config.latency = 0.1
+    start = time.perf_counter()
+    stream = _chat(_client(server), "计时", stream=True)
+    first_content = next(chunk for chunk in stream if chunk.choices and chunk.choices[0].delta.content)
+    ttft = time.perf_counter() - start
+    list(stream)
+    elapsed = time.perf_counter() - start
+    assert first_content and 0.1 <= ttft < elapsed
+    # 40个字符即20个token，每秒100个约需0.2秒
+    assert elapsed >= 0.1 + 0.18
+
+
+def test_injected_errors_are_429_with_retry_after(server):
+    server.config.error_rate = 1.0
+    server.config.retry_after = 1.5
+    response = httpx.post(server.base_url + "/chat/completions", json={"messages": []})
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "1.5"
+    assert response.json()["error"]["type"] == "rate_limit"
+    with pytest.raises(openai.RateLimitError) as excinfo:
+        _chat(_client(server), "你好", stream=True)
+    assert governor._retry_after(excinfo.value) == 1.5
+    assert server.config.requests == 2 and server.config.errors == 2
+
+
+def test_error_rate_is_reproducible_with_seed():
+    def pattern():
+        config = FakeOpenAIConfig(error_rate=0.5, seed=7)
+        return [config.should_fail() for _ in range(50)]
+
+    failures = pattern()
+    assert failures == pattern()
+    assert 0 < sum(failures) < 50
+
+
+def test_prompt_prefix_cache_counts_whole_blocks(server):
+    client = _client(server)
+    prefix = "前" * (PROMPT_CACHE_MIN_TOKENS + 200)
+
+    def usage(content):
+        return _chat(client, content).usage.prompt_tokens_details.cached_tokens
+
+    assert usage(prefix + "一") == 0
+    assert usage(prefix + "二") == len(prefix) // PROMPT_CACHE_BLOCK * PROMPT_CACHE_BLOCK
+    # 公共前缀不足最短长度时不命中
+    assert usage("前" * 100 + "三") == 0
+
+
+def test_embeddings_and_models(server):
+    client = _client(server)
+    result = client.embeddings.create(model="text-embedding-ada-002", input=["甲", "乙", "甲"])
+    vectors = [item.embedding for item in result.data]
+    assert vectors[0] == vectors[2] != vectors[1]
+    assert sum(v * v for v in vectors[0]) == pytest.approx(1.0)
+    assert [model.id for model in client.models.list()] == ["gpt-4o-mini"]
+
+
+def test_outline_prompts_get_json():
+    assert json.loads(canned_response('返回 "sections" 字段'))["sections"]
@@ -0,0 +1,149 @@
+import threading
+import time
+
+import httpx
+import openai
+import pytest
+
+import governor
+
+
+def _rate_limit_error(retry_after="0"):
+    request = httpx.Request("POST", "http://test/v1/chat/completions")
+    response = httpx.Response(429, headers={"retry-after": retry_after}, request=request)
+    return openai.RateLimitError("rate limited", response=response, body=None)
+
+
+def _wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("等待超时")
+        time.sleep(0.005)
+
+
+def test_slot_limits_in_flight():
+    gov = governor.Governor(rate=1000, burst=1000, max_in_flight=2)
+    peak = []
+    lock = threading.Lock()
+    active = [0]
+
+    def worker():
+        with gov.slot("s"):
+            with lock:
+                active[0] += 1
+                peak.append(active[0])
+            time.sleep(0.02)
+            with lock:
+                active[0] -= 1
+
+    threads = [threading.Thread(target=worker) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(peak) == 2
+    stats = gov.stats()
+    assert stats['served'] == 6 and stats['in_flight'] == 0 and stats['queued'] == 0
+
+
+def test_waiting_sessions_are_served_round_robin():
+    gov = governor.Governor(rate=1000, burst=1000, max_in_flight=1)
+    order = []
+    holder = gov.slot("holder")
+    holder.__enter__()
+
+    def worker(session, name):
+        with gov.slot(session):
+            order.append(name)
+
+    threads = []
+    # 会话 a 先排入三个请求，会话 b 随后排入一个
+    for session, name in (("a", "a1"), ("a", "a2"), ("a", "a3"), ("b", "b1")):
+        thread = threading.Thread(target=worker, args=(session, name))
+        thread.start()
+        threads.append(thread)
+        _wait_until(lambda n=len(threads): gov.stats()['queued'] == n)
+    holder.__exit__(None, None, None)
+    for thread in threads:
+        thread.join()
+    assert order == ["a1", "b1", "a2", "a3"]
+
+
+def test_open_stream_retries_rate_limit_and_honours_retry_after(monkeypatch):
+    monkeypatch.setattr(governor.random, "uniform", lambda a, b: 0.0)
+    gov = governor.Governor(rate=1000, burst=1000, max_retries=3)
+    calls = []
+
+    def start_stream():
+        calls.append(1)
+        if len(calls) < 3:
+            raise _rate_limit_error("0")
+        return iter(["a", "b"])
+
+    first, rest = gov.open_stream(start_stream)
+    assert first == "a" and list(rest) == ["b"]
+    assert len(calls) == 3
+    assert gov.stats()['retries'] == 2 and gov.stats()['throttled'] == 2
+
+
+def test_open_stream_gives_up_after_max_retries(monkeypatch):
+    monkeypatch.setattr(governor.random, "uniform", lambda a, b: 0.0)
+    gov = governor.Governor(rate=1000, burst=1000, max_retries=1)
+    calls = []
+
+    def start_stream():
+        calls.append(1)
+        raise _rate_limit_error("0")
+
+    with pytest.raises(openai.RateLimitError):
+        gov.open_stream(start_stream)
+    assert len(calls) == 2
+
+
+def test_open_stream_does_not_retry_other_errors():
+    gov = governor.Governor(rate=1000, burst=1000)
+    calls = []
+
+    def start_stream():
+        calls.append(1)
+        raise ValueError("bad request")
+
+    with pytest.raises(ValueError):
+        gov.open_stream(start_stream)
+    assert len(calls) == 1
+
+
+def test_retry_after_header_parsing():
+    assert governor._retry_after(_rate_limit_error("2.5")) == 2.5
+    request = httpx.Request("POST", "http://test")
+    response = httpx.Response(429, headers={"retry-after-ms": "300"}, request=request)
+    error = openai.RateLimitError("rate limited", response=response, body=None)
+    assert governor._retry_after(error) == pytest.approx(0.3)
+    assert governor._retry_after(ValueError()) is None
+
+
+def test_governor_is_shared_per_key_and_url():
+    first = governor.get_governor("key-a", "http://x/v1")
+    assert governor.get_governor("key-a", "http://x/v1") is first
+    assert governor.get_governor("key-b", "http://x/v1") is not first
+    assert governor.get_governor("key-a", "http://y/v1") is not first
+
+
+def test_each_retry_takes_a_token_from_the_bucket(monkeypatch):
+    monkeypatch.setattr(governor.random, "uniform", lambda a, b: 0.0)
+    gov = governor.Governor(rate=10, burst=1, max_retries=2)
+    calls = []
+
+    def start_stream():
+        calls.append(time.monotonic())
+        if len(calls) < 3:
+            raise _rate_limit_error("0")
+        return iter(["ok"])
+
+    with gov.slot("s"):
+        first, _ = gov.open_stream(start_stream)
+    assert first == "ok"
+    # 桶容量为1、每秒补充10个：两次重试各需等待约0.1秒的令牌
+    assert calls[1] - calls[0] >= 0.08
+    assert calls[2] - calls[1] >= 0.08
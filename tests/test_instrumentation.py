@@ -0,0 +1,68 @@
+import math
+import re
+
+import pytest
+
+import instrumentation
+
+# Prometheus 文本格式的一行样本：名称、可选标签、数值
+_SAMPLE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*"'
+                     r'(?:,[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*")*\})? (?:[-+]?[0-9.e+-]+|\+Inf|NaN)$')
+
+
+def _histogram(values):
+    hist = instrumentation._Histogram()
+    for value in values:
+        hist.observe(value)
+    return hist
+
+
+def test_quantile_interpolates_within_buckets():
+    hist = _histogram([0.3] * 50 + [0.99] * 50)
+    # 中位数落在 (0.25, 0.5] 桶的上界，p95 在 (0.5, 1.0] 桶内按位置插值
+    assert hist.quantile(0.5) == pytest.approx(0.5)
+    assert hist.quantile(0.95) == pytest.approx(0.5 + 0.5 * 45 / 50)
+
+
+def test_quantile_is_clamped_to_observed_range():
+    assert instrumentation._Histogram().quantile(0.5) == 0.0
+    hist = _histogram([0.012] * 10)
+    assert hist.quantile(0.01) == pytest.approx(0.012)
+    assert hist.quantile(0.99) == pytest.approx(0.012)
+    # 落入 +Inf 桶的值在最后一个有限上界与观测到的最大值之间插值
+    overflow = _histogram([500.0, 700.0])
+    assert overflow.quantile(0.5) == pytest.approx(500.0)
+    assert overflow.quantile(0.99) == pytest.approx(120.0 + 580.0 * 0.99)
+
+
+def test_render_prometheus_format():
+    registry = instrumentation.MetricsRegistry()
+    registry.inc("agent_llm_calls_total", feature='视频"脚本', source="api")
+    registry.inc("agent_llm_calls_total", 2, feature="对话", source="cache")
+    registry.observe("ttft", 0.3, "对话")
+    registry.observe("ttft", 7.0, "对话")
+    registry.register_collector("llm_cache", lambda: {'hits': 3, 'hit_rate': 0.5, 'enabled': True, 'name': "x"})
+    registry.register_collector("broken", lambda: 1 / 0)
+    text = registry.render_prometheus()
+    lines = text.splitlines()
+    assert text.endswith("\n")
+    for line in lines:
+        assert line.startswith("# ") or _SAMPLE.match(line), line
+
+    assert lines.count("# TYPE agent_llm_calls_total counter") == 1
+    assert 'agent_llm_calls_total{feature="视频\\"脚本",source="api"} 1' in lines
+    buckets = [line for line in lines if line.startswith("agent_span_seconds_bucket")]
+    assert len(buckets) == len(instrumentation.BUCKETS)
+    counts = [int(line.rsplit(" ", 1)[1]) for line in buckets]
+    assert counts == sorted(counts) and counts[-1] == 2
+    assert buckets[-1].startswith('agent_span_seconds_bucket{feature="对话",span="ttft",le="+Inf"}')
+    assert 'agent_span_seconds_count{feature="对话",span="ttft"} 2' in lines
+    assert "agent_llm_cache_hits 3" in lines and "agent_llm_cache_hit_rate 0.5" in lines
+    # 布尔与非数值统计、读取失败的组件不导出
+    assert not any("enabled" in line or "agent_llm_cache_name" in line or "broken" in line for line in lines)
+
+
+def test_format_value():
+    assert instrumentation._format_value(3) == "3"
+    assert instrumentation._format_value(math.inf) == "+Inf"
+    assert instrumentation._format_value(float("nan")) == "NaN"
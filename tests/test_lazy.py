@@ -0,0 +1,86 @@
+import os
+import sys
+import threading
+import types
+
+import pytest
+
+import lazy
+from benchmarks import startup
+
+
+@pytest.fixture(scope="module")
+def child_env(tmp_path_factory):
+    env = dict(os.environ)
+    env["AGENT_CACHE_DIR"] = str(tmp_path_factory.mktemp("startup-cache"))
+    env["PYTHONPATH"] = startup.ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    env["PYTHONWARNINGS"] = "ignore"
+    return env
+
+
+@pytest.mark.parametrize("module", ["utils", "chat_store", "chat_memory", "governor", "sandbox"])
+def test_module_import_loads_no_heavy_dependency(module, child_env):
+    # 在全新的子进程中导入，避免受测试进程里已加载模块的影响
+    run = startup._run_child(startup._IMPORT_SCRIPT.format(module=module, heavy=startup.HEAVY_MODULES), child_env)
+    assert run['loaded'] == []
+
+
+def test_first_paint_does_not_import_langchain_or_faiss(child_env):
+    run = startup._run_child(startup._APP_SCRIPT.format(heavy=startup.HEAVY_MODULES), child_env)
+    assert run['errors'] == 0
+    assert "langchain" not in run['loaded'] and "faiss" not in run['loaded']
+
+
+def test_pdf_index_defers_the_openai_client(child_env):
+    run = startup._run_child(startup._IMPORT_SCRIPT.format(module="pdf_index", heavy=startup.HEAVY_MODULES),
+                             child_env)
+    assert "openai" not in run['loaded'] and "httpx" not in run['loaded']
+
+
+@pytest.fixture
+def fake_module(monkeypatch):
+    name = "_lazy_test_module"
+    imports = []
+
+    def import_module(requested):
+        assert requested == name
+        imports.append(requested)
+        module = types.ModuleType(name)
+        module.value = 42
+        return module
+
+    monkeypatch.setattr(lazy.importlib, "import_module", import_module)
+    monkeypatch.delitem(sys.modules, name, raising=False)
+    return name, imports
+
+
+def test_lazy_module_imports_on_first_attribute_access(fake_module):
+    name, imports = fake_module
+    module = lazy.lazy_import(name)
+    assert imports == [] and "not loaded" in repr(module)
+    assert module.value == 42
+    module.value = 7
+    assert module.value == 7 and imports == [name]
+    assert "(loaded)" in repr(module)
+
+
+def test_lazy_module_imports_once_under_concurrent_access(fake_module):
+    name, imports = fake_module
+    module = lazy.lazy_import(name)
+    barrier = threading.Barrier(8)
+    values = []
+
+    def worker():
+        barrier.wait()
+        values.append(module.value)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert values == [42] * 8 and imports == [name]
+
+
+def test_lazy_import_returns_already_loaded_module():
+    assert lazy.lazy_import("os") is os
@@ -0,0 +1,61 @@
+import pytest
+
+import llm_cache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm_cache.time, "time", lambda: now[0])
+    return now
+
+
+def _cache(tmp_path, **kwargs):
+    return llm_cache.LLMResponseCache(path=str(tmp_path / "cache.sqlite3"), **kwargs)
+
+
+def test_normalize_prompt():
+    assert llm_cache.normalize_prompt("  Hello\n\tＷｏｒｌｄ  ") == "hello world"
+
+
+def test_should_cache_only_deterministic_calls_by_default(tmp_path):
+    cache = _cache(tmp_path, max_temperature=0)
+    assert cache.should_cache(0)
+    assert not cache.should_cache(0.7)
+    assert cache.should_cache(0.7, use_cache=True)
+    assert not cache.should_cache(0, use_cache=False)
+
+
+def test_exact_and_normalized_hits(tmp_path, clock):
+    cache = _cache(tmp_path)
+    cache.put("m", 0, "Summarize  THIS", "answer")
+    assert cache.get("m", 0, "Summarize  THIS") == "answer"
+    assert cache.get("m", 0, "summarize this") == "answer"
+    assert cache.get("m", 0.5, "Summarize  THIS") is None
+    assert cache.get("other", 0, "Summarize  THIS") is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['normalized_hits'], stats['misses']) == (1, 1, 2)
+
+
+def test_expired_entries_are_dropped(tmp_path, clock):
+    cache = _cache(tmp_path, ttl=60)
+    cache.put("m", 0, "p", "r")
+    clock[0] += 61
+    assert cache.get("m", 0, "p") is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_eviction_removes_least_recently_accessed(tmp_path, clock):
+    # 每条约 1(提示词) + 10(回复) 字节，容量只够两条
+    cache = _cache(tmp_path, max_bytes=25)
+    cache.put("m", 0, "a", "x" * 10)
+    clock[0] += 1
+    cache.put("m", 0, "b", "x" * 10)
+    clock[0] += 1
+    assert cache.get("m", 0, "a") is not None
+    clock[0] += 1
+    cache.put("m", 0, "c", "x" * 10)
+    assert cache.get("m", 0, "b") is None
+    assert cache.get("m", 0, "a") is not None
+    assert cache.get("m", 0, "c") is not None
+    assert cache.stats()['bytes'] <= 25
@@ -0,0 +1,30 @@
+import pytest
+
+import llm_client
+
+
+def test_configure_only_accepts_pool_parameters():
+    registry = llm_client.LLMClientRegistry()
+    registry.configure(max_connections=5, idle_ttl=10)
+    assert registry.max_connections == 5 and registry.idle_ttl == 10
+    for name in ("_lock", "_clients", "created", "evicted"):
+        with pytest.raises(ValueError):
+            registry.configure(**{name: None})
+    assert registry.created == 0
+
+
+def test_clients_share_one_sync_and_one_async_pool():
+    registry = llm_client.LLMClientRegistry()
+    first = registry.get_chat_model("key", "http://localhost:1/v1", "m", 0)
+    second = registry.get_chat_model("key", "http://localhost:1/v1", "m", 0.7)
+    embeddings = registry.get_embeddings("key", "http://localhost:1/v1")
+    assert registry.get_chat_model("key", "http://localhost:1/v1", "m", 0) is first
+    http_client, async_http_client = registry._http_client, registry._async_http_client
+    for async_completions in (first.async_client, second.async_client, embeddings.async_client):
+        assert async_completions._client._client is async_http_client
+    assert first.client._completions._client._client is http_client
+
+    registry.configure(max_connections=10)
+    assert http_client.is_closed and async_http_client.is_closed
+    assert registry.stats()['clients'] == 0
+    registry.close()
@@ -0,0 +1,58 @@
+import contextvars
+import threading
+import time
+
+from parallel import run_concurrent
+
+
+def test_yields_every_result_once():
+    tasks = [lambda i=i: i * i for i in range(10)]
+    results = sorted((index, result) for index, result, error in run_concurrent(tasks, max_workers=3))
+    assert results == [(i, i * i) for i in range(10)]
+
+
+def test_failed_task_is_retried_then_reported():
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 2:
+            raise ValueError("first attempt")
+        return "ok"
+
+    def broken():
+        raise RuntimeError("always")
+
+    results = {index: (result, error) for index, result, error in
+               run_concurrent([flaky, broken], max_workers=2, max_retries=1)}
+    assert results[0] == ("ok", None)
+    assert isinstance(results[1][1], RuntimeError)
+    assert len(attempts) == 2
+
+
+def test_tasks_see_submitter_context():
+    var = contextvars.ContextVar("var", default=None)
+    var.set("session-1")
+    results = [result for _, result, _ in run_concurrent([var.get, var.get], max_workers=2)]
+    assert results == ["session-1", "session-1"]
+
+
+def test_early_stop_cancels_queued_tasks():
+    started = []
+    release = threading.Event()
+
+    def slow(i):
+        started.append(i)
+        release.wait(5)
+        return i
+
+    tasks = [lambda i=i: slow(i) if i else i for i in range(20)]
+    results = run_concurrent(tasks, max_workers=2)
+    begin = time.perf_counter()
+    next(results)
+    results.close()
+    elapsed = time.perf_counter() - begin
+    release.set()
+    # 关闭迭代器时不等待排队中的慢任务
+    assert elapsed < 1
+    assert len(started) < 19
@@ -0,0 +1,121 @@
+import threading
+import time
+
+import pytest
+from langchain_core.documents import Document
+
+import pdf_cache
+import pdf_extract
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return pdf_cache.PDFParseCache(directory=str(tmp_path))
+
+
+@pytest.fixture
+def fake_parse(monkeypatch):
+    # 用固定的页面代替真实的PDF抽取，只测试缓存与并发逻辑
+    calls = []
+
+    def iter_parse(data):
+        calls.append(data)
+        for page in range(3):
+            doc = Document(page_content=f"{data.decode()} page {page}", metadata={'page': page})
+            yield doc, [doc]
+
+    monkeypatch.setattr(pdf_cache, "iter_parse", iter_parse)
+    return calls
+
+
+def _run_with_timeout(target, timeout=5):
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault('value', target()), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "调用被阻塞"
+    return result['value']
+
+
+def test_iter_chunks_populates_cache(cache, fake_parse):
+    chunks = list(cache.iter_chunks(b"doc"))
+    assert [c.metadata['page'] for c in chunks] == [0, 1, 2]
+    assert [c.page_content for c in cache.iter_chunks(b"doc")] == [c.page_content for c in chunks]
+    assert len(fake_parse) == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_abandoned_iterator_does_not_cache_partial_result(cache, fake_parse):
+    chunks = cache.iter_chunks(b"doc")
+    next(chunks)
+    chunks.close()
+    assert len(_run_with_timeout(lambda: list(cache.iter_chunks(b"doc")))) == 3
+    assert len(fake_parse) == 2
+
+
+def test_unclosed_iterator_only_delays_other_callers(cache, fake_parse, monkeypatch):
+    monkeypatch.setattr(pdf_cache, "PDF_PARSE_WAIT", 0.2)
+    chunks = cache.iter_chunks(b"doc")
+    next(chunks)
+    # 迭代器既没有读完也没有关闭：同一线程中的其他调用最多等待 PDF_PARSE_WAIT 后自行解析
+    start = time.perf_counter()
+    parsed = _run_with_timeout(lambda: cache.get(b"doc", parse=pdf_cache.parse_pdf_bytes))
+    assert len(parsed.chunks) == 3
+    assert time.perf_counter() - start < 2
+    assert len(list(chunks)) == 2
+
+
+def test_waiter_reuses_result_of_in_flight_parse(cache, fake_parse):
+    chunks = cache.iter_chunks(b"doc")
+    first = next(chunks)
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(cache.get(b"doc")))
+    waiter.start()
+    time.sleep(0.1)
+    assert waiter.is_alive()
+    rest = list(chunks)
+    waiter.join(5)
+    assert [c.page_content for c in results[0].chunks] == [c.page_content for c in [first] + rest]
+    assert len(fake_parse) == 1
+
+
+def test_concurrent_get_parses_once(cache):
+    calls = []
+
+    def slow_parse(data, doc_hash):
+        calls.append(data)
+        time.sleep(0.1)
+        return pdf_cache.ParsedPDF(doc_hash, [], [Document(page_content="x", metadata={'page': 0})])
+
+    threads = [threading.Thread(target=cache.get, args=(b"doc", slow_parse)) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert len(calls) == 1
+    assert cache._in_flight == {}
+
+
+def test_failed_parse_releases_waiters(cache):
+    def broken(data, doc_hash):
+        raise ValueError("bad pdf")
+
+    with pytest.raises(ValueError):
+        cache.get(b"doc", broken)
+    parsed = _run_with_timeout(lambda: cache.get(
+        b"doc", lambda data, doc_hash: pdf_cache.ParsedPDF(doc_hash, [], [])))
+    assert parsed.chunks == []
+
+
+def test_restoring_same_key_does_not_overcount_memory(cache):
+    parsed = pdf_cache.ParsedPDF("h", [], [])
+    for _ in range(5):
+        cache._remember("a", parsed, 40)
+    assert cache.stats()['memory_bytes'] == 40
+    assert cache.stats()['entries'] == 1
+
+
+def test_key_changes_with_extractor_version(monkeypatch):
+    key = pdf_cache.PDFParseCache.make_key("abc")
+    monkeypatch.setattr(pdf_extract, "EXTRACT_VERSION", pdf_extract.EXTRACT_VERSION + 1)
+    assert pdf_cache.PDFParseCache.make_key("abc") != key
@@ -0,0 +1,57 @@
+import threading
+
+from langchain_core.documents import Document
+
+import pdf_index
+
+
+def _chunks(calls):
+    def load_chunks():
+        calls.append(1)
+        for page in range(3):
+            yield Document(page_content=f"第{page + 1}页讲的是 topic{page}", metadata={'page': page})
+    return load_chunks
+
+
+def test_index_is_persisted_and_reused():
+    embeddings = pdf_index.LocalHashEmbeddings(dim=64)
+    calls = []
+    store = pdf_index.get_or_build_index("doc-persist", _chunks(calls), embeddings)
+    assert store.similarity_search("topic2", k=1)[0].metadata['page'] == 2
+    assert pdf_index.get_or_build_index("doc-persist", _chunks(calls), embeddings) is store
+
+    # 清空内存后从磁盘加载，不重新嵌入
+    with pdf_index._loaded_lock:
+        pdf_index._loaded_indexes.clear()
+    loaded = pdf_index.load_index("doc-persist", embeddings)
+    assert loaded is not None and loaded is not store
+    assert pdf_index.get_or_build_index("doc-persist", _chunks(calls), embeddings) is loaded
+    assert calls == [1]
+    assert pdf_index.load_index("doc-missing", embeddings) is None
+
+
+def test_build_locks_are_released_after_concurrent_builds():
+    embeddings = pdf_index.LocalHashEmbeddings(dim=64)
+    calls = []
+    stores = []
+    threads = [threading.Thread(target=lambda: stores.append(
+        pdf_index.get_or_build_index("doc-concurrent", _chunks(calls), embeddings))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert calls == [1] and len({id(store) for store in stores}) == 1
+    assert pdf_index._build_locks == {}
+
+
+def test_format_context_stays_within_budget():
+    docs = [Document(page_content="字" * 400, metadata={'page': i}) for i in range(5)]
+    context = pdf_index.format_context(docs, max_context_chars=1000)
+    assert len(context) <= 1000
+    assert context.startswith("[第1页]")
+    # 两个文本块正好占满预算时，分隔的空行也要计入
+    exact = [Document(page_content="字" * 494, metadata={'page': i}) for i in range(2)]
+    assert len(pdf_index.format_context(exact, max_context_chars=1000)) <= 1000
+    # 单个文本块超出预算时截断而不是丢弃
+    single = pdf_index.format_context([Document(page_content="字" * 5000, metadata={})], max_context_chars=300)
+    assert 0 < len(single) <= 300
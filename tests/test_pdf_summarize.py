@@ -0,0 +1,72 @@
+import io
+
+import pytest
+from langchain_core.documents import Document
+
+import pdf_cache
+import pdf_extract
+import pdf_summarize
+import utils
+
+
+@pytest.mark.parametrize("question", [
+    "总结全文", "请给出整个文档的摘要", "这篇论文的主要观点是什么", "这份报告讲了什么", "Summarize the whole document",
+])
+def test_explicit_whole_document_questions(question):
+    assert pdf_summarize.is_whole_document_question(question)
+
+
+@pytest.mark.parametrize("question", [
+    "第3页的要点是什么", "关键概念有哪些", "摘要里提到的样本量是多少", "本文第二章的结论", "全文中提到的收入是多少",
+    "What are the key points on page 3?", "",
+])
+def test_generic_or_local_questions_use_retrieval(question):
+    assert not pdf_summarize.is_whole_document_question(question)
+
+
+@pytest.fixture
+def routes(monkeypatch):
+    routes = []
+    monkeypatch.setattr(pdf_extract, "check_size", lambda size: None)
+    monkeypatch.setattr(pdf_cache, "iter_chunks", lambda data: iter([
+        Document(page_content="营业收入同比增长百分之二十，主要来自海外市场的扩张与新产品线。" * 2, metadata={'page': 2}),
+    ]))
+    monkeypatch.setattr(utils, "summarize_pdf_stream", lambda data, question, *args, **kwargs: routes.append("summary"))
+
+    def stream_llm(template, variables, *args, **kwargs):
+        routes.append(("retrieval", variables['context']))
+
+    monkeypatch.setattr(utils, "_stream_llm", stream_llm)
+    return routes
+
+
+def test_routing_between_summary_and_retrieval(routes):
+    pdf = io.BytesIO(b"%PDF-routing-test")
+    utils.chat_with_pdf_stream(pdf, "总结全文", "key", retrieval="bm25")
+    utils.chat_with_pdf_stream(pdf, "第3页的要点是什么？营业收入", "key", retrieval="bm25")
+    utils.chat_with_pdf_stream(pdf, "营业收入", "key", retrieval="bm25", whole_document=True)
+    assert routes[0] == "summary"
+    assert routes[1][0] == "retrieval" and "[第3页]" in routes[1][1]
+    assert routes[2] == "summary"
+
+
+def test_summary_cache_is_keyed_by_document_chunk_and_model(tmp_path):
+    cache = pdf_summarize.SummaryCache(path=str(tmp_path / "summaries.sqlite3"))
+    cache.put("doc", 0, "model-a", "摘要0")
+    cache.put("doc", 1, "model-a", "摘要1")
+    cache.put("doc", 0, "model-b", "另一个模型的摘要")
+    cache.put("other", 0, "model-a", "其他文档")
+    cache.put("doc", 2, "model-a", "")
+    assert cache.get_many("doc", "model-a", [0, 1, 2]) == {0: "摘要0", 1: "摘要1"}
+    assert cache.get_many("doc", "model-b", [0, 1]) == {0: "另一个模型的摘要"}
+    assert cache.get_many("other", "model-a", [0]) == {0: "其他文档"}
+    cache.put("doc", 0, "model-a", "新摘要")
+    assert cache.get_many("doc", "model-a", [0]) == {0: "新摘要"}
+    stats = cache.stats()
+    assert stats['entries'] == 4 and stats['misses'] == 2
+
+
+def test_summary_cache_expires_entries(tmp_path):
+    cache = pdf_summarize.SummaryCache(path=str(tmp_path / "summaries.sqlite3"), ttl=-1)
+    cache.put("doc", 0, "m", "摘要")
+    assert cache.get_many("doc", "m", [0]) == {}
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+
+import profiler
+
+
+def test_small_frames_are_not_sampled():
+    df = pd.DataFrame({'x': range(10)})
+    sample, sampled = profiler._sample(df, 100)
+    assert sample is df and not sampled
+
+
+def test_sample_has_exactly_k_unique_rows_in_order():
+    df = pd.DataFrame({'x': np.arange(50000)})
+    sample, sampled = profiler._sample(df, 1000)
+    assert sampled and len(sample) == 1000
+    assert sample.index.is_unique and sample.index.is_monotonic_increasing
+    assert sample.index.min() >= 0 and sample.index.max() < len(df)
+
+
+def test_sample_spans_batches_uniformly(monkeypatch):
+    monkeypatch.setattr(profiler, "SAMPLE_BATCH_ROWS", 1000)
+    df = pd.DataFrame({'x': np.arange(20000)})
+    sample, _ = profiler._sample(df, 2000)
+    # 每一批（每1000行）都应抽到大致 100 行
+    counts = np.bincount(sample['x'].to_numpy() // 1000, minlength=20)
+    assert counts.min() > 50 and counts.max() < 150
+    # 同一种子的抽样结果可复现
+    assert profiler._sample(df, 2000)[0].index.equals(sample.index)
+
+
+def test_exact_statistics_use_all_rows_when_sampled():
+    values = np.arange(5000, dtype=np.float64)
+    values[[3, 7]] = np.nan
+    df = pd.DataFrame({'x': values, 'c': ["a"] * 4000 + ["b"] * 1000})
+    profile = profiler.compute_profile(df, sample_rows=100)
+    x, c = profile.columns
+    assert profile.sampled and profile.sample_rows == 100
+    assert (x['null_count'], x['min'], x['max']) == (2, 0.0, 4999.0)
+    assert x['kind'] == 'numeric' and len(x['quantiles']) == 3
+    assert c['kind'] == 'categorical' and c['top_values'][0][0] == "a"
+
+
+def test_profile_is_cached_by_dataset_hash(monkeypatch):
+    calls = []
+    compute = profiler.compute_profile
+    monkeypatch.setattr(profiler, "compute_profile", lambda df: calls.append(1) or compute(df))
+    df = pd.DataFrame({'x': [1, 2, 3]})
+    first = profiler.get_profile(df, dataset_hash="profile-hash")
+    assert profiler.get_profile(df.copy(), dataset_hash="profile-hash") is first
+    df.attrs['dataset_hash'] = "profile-hash"
+    assert profiler.get_profile(df) is first
+    # 没有哈希时不缓存
+    profiler.get_profile(pd.DataFrame({'x': [1]}))
+    profiler.get_profile(pd.DataFrame({'x': [1]}))
+    assert len(calls) == 3
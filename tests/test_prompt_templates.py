@@ -0,0 +1,44 @@
+import pytest
+
+import prompt_templates
+import utils  # noqa: F401  导入时注册全部模板
+
+
+def _variables(prompt, value):
+    return {name: f"{value}-{{{name}}}" for name in prompt.input_variables}
+
+
+def _fixed_system_names():
+    # 对话模板的系统消息是角色说明，单独测试
+    return sorted(name for name in prompt_templates._definitions if name != "chat")
+
+
+def test_templates_are_compiled_once():
+    first = prompt_templates.get("video_script")
+    compiles = prompt_templates.stats()['compiles']
+    assert prompt_templates.get("video_script") is first
+    assert prompt_templates.stats()['compiles'] == compiles
+
+
+@pytest.mark.parametrize("name", _fixed_system_names())
+def test_system_prefix_is_byte_identical_across_calls(name):
+    prompt = prompt_templates.get(name)
+    first = prompt.format_messages(**_variables(prompt, "a"))
+    second = prompt.format_messages(**_variables(prompt, "b"))
+    assert first[0].type == "system"
+    assert first[0].content.encode("utf-8") == second[0].content.encode("utf-8")
+    # 用户数据只出现在用户消息中，其中的花括号按原样保留
+    assert "a-{" in first[1].content and "a-{" not in first[0].content
+
+
+def test_chat_prefix_is_stable_within_a_mode():
+    prompt = prompt_templates.get("chat")
+    base = {'mode_desc': "你是一位编程专家", 'input_text': "问题"}
+    turn1 = prompt.format_messages(summary_text="", history_text="用户: 你好\n\n", **base)
+    turn2 = prompt.format_messages(summary_text="此前对话摘要：\n...\n\n", history_text="AI助手: 你好\n\n", **base)
+    assert turn1[0].content == turn2[0].content == "你是一位编程专家"
+
+
+def test_unknown_template_raises():
+    with pytest.raises(KeyError):
+        prompt_templates.get("missing-template")
@@ -0,0 +1,62 @@
+import threading
+import time
+
+import pytest
+
+from ratelimit import TokenBucket
+
+
+def test_rejects_non_positive_rate():
+    with pytest.raises(ValueError):
+        TokenBucket(0)
+
+
+def test_burst_up_to_capacity_then_empty():
+    bucket = TokenBucket(rate=1, capacity=3)
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+
+
+def test_refill_never_exceeds_capacity():
+    bucket = TokenBucket(rate=1000, capacity=2)
+    time.sleep(0.05)
+    assert bucket.available == pytest.approx(2)
+
+
+def test_acquire_waits_for_refill():
+    bucket = TokenBucket(rate=20, capacity=1)
+    assert bucket.acquire() == pytest.approx(0, abs=0.01)
+    waited = bucket.acquire()
+    assert 0.03 <= waited < 0.5
+
+
+def test_acquire_timeout_and_oversized_request():
+    bucket = TokenBucket(rate=1, capacity=1)
+    bucket.acquire()
+    with pytest.raises(TimeoutError):
+        bucket.acquire(timeout=0.05)
+    with pytest.raises(ValueError):
+        bucket.acquire(tokens=2)
+
+
+def test_penalize_blocks_new_requests_without_stacking():
+    bucket = TokenBucket(rate=10, capacity=5)
+    bucket.penalize(1)
+    bucket.penalize(1)
+    # 清空令牌并欠下约 1 秒的额度；重复退避不叠加
+    assert bucket.available == pytest.approx(1 - 10, abs=0.5)
+    assert not bucket.try_acquire()
+
+
+def test_threads_share_tokens():
+    bucket = TokenBucket(rate=0.001, capacity=5)
+    granted = []
+
+    def worker():
+        granted.append(bucket.try_acquire())
+
+    threads = [threading.Thread(target=worker) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert granted.count(True) == 5
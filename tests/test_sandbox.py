@@ -0,0 +1,157 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import dataset_store
+import sandbox
+from csv_ingest import IngestResult
+
+
+def _store_dataset(tmp_path, frame, dataset_hash="data"):
+    store = dataset_store.DatasetStore(directory=str(tmp_path))
+    result = store.load(dataset_hash, lambda: IngestResult(frame, "pyarrow", 0.0, 0, 0, len(frame), False))
+    return result.mapped_path
+
+
+@pytest.fixture(scope="module")
+def pool():
+    pool = sandbox.SandboxPool(workers=1, timeout=20, max_memory_mb=512, max_jobs_per_worker=100)
+    yield pool
+    pool.close()
+
+
+def _texts(result):
+    assert result.ok, result.error
+    return [body for kind, body in result.outputs if kind == "text"]
+
+
+def test_job_views_do_not_copy_the_dataset(tmp_path):
+    n = 2_000_000
+    path = _store_dataset(tmp_path, pd.DataFrame({c: np.random.rand(n) for c in "abcd"}))
+    size = os.path.getsize(path)
+    state = {}
+    sandbox._load_dataset(path, state).sum()
+    before = sandbox._process_private_rss(os.getpid())
+    frames = [sandbox._load_dataset(path, state) for _ in range(3)]
+    for frame in frames:
+        frame.sum()
+    # 每个任务的视图都引用映射文件的页，不计入私有内存
+    assert sandbox._process_private_rss(os.getpid()) - before < size / 4
+
+
+def test_worker_rss_does_not_grow_by_dataset_size(tmp_path, pool):
+    n = 2_000_000
+    path = _store_dataset(tmp_path, pd.DataFrame({c: np.random.rand(n) for c in "abcd"}))
+    size = os.path.getsize(path)
+    _texts(pool.run("st.write(len(df))", path))
+    worker = pool._workers[0]
+    before = sandbox._process_private_rss(worker.process.pid)
+
+    # 任务执行期间持续采样工作进程的私有内存峰值
+    peak = [0]
+    done = threading.Event()
+
+    def sample():
+        while not done.is_set():
+            peak[0] = max(peak[0], sandbox._process_private_rss(worker.process.pid))
+            time.sleep(0.002)
+
+    sampler = threading.Thread(target=sample)
+    sampler.start()
+    try:
+        assert _texts(pool.run("for _ in range(300):\n    total = float(df['a'].sum())\nst.write(total > 0)", path))
+    finally:
+        done.set()
+        sampler.join()
+    assert pool._workers[0] is worker
+    assert peak[0] - before < size / 4
+
+
+def test_job_writes_do_not_leak_into_the_next_job(tmp_path, pool):
+    path = _store_dataset(tmp_path, pd.DataFrame({'a': np.arange(10, dtype=np.float64), 'b': list("abcdefghij")}),
+                          dataset_hash="small")
+    assert _texts(pool.run("df.loc[0, 'a'] = 99.0\ndf['b'] = 'x'\nst.write(df.loc[0, 'a'])", path)) == ["99.0"]
+    assert _texts(pool.run("st.write(df.loc[0, 'a'])\nst.write(df.loc[0, 'b'])", path)) == ["0.0", "a"]
+
+
+def test_missing_mapped_file_is_reported(pool, tmp_path):
+    result = pool.run("st.write(1)", str(tmp_path / "gone.arrow"))
+    assert not result.ok and "已被清理" in result.error
+
+
+@pytest.fixture
+def small_path(tmp_path):
+    return _store_dataset(tmp_path, pd.DataFrame({'a': [1.0, 2.0]}), dataset_hash="tiny")
+
+
+def _fresh_pool(**kwargs):
+    options = dict(workers=1, timeout=20, max_memory_mb=200, max_jobs_per_worker=100)
+    options.update(kwargs)
+    return sandbox.SandboxPool(**options)
+
+
+def test_timeout_kills_and_replaces_the_worker(small_path):
+    pool = _fresh_pool(timeout=1)
+    try:
+        pid = pool._workers[0].process.pid
+        result = pool.run("while True:\n    pass", small_path)
+        assert not result.ok and "执行超时" in result.error
+        assert 1 <= result.exec_seconds < 5
+        # 超时的进程被强制结束，新的工作进程可以继续执行任务
+        assert pool._workers[0].process.pid != pid
+        assert _texts(pool.run("st.write(df['a'].sum())", small_path)) == ["3.0"]
+        stats = pool.stats()
+        assert stats['timeouts'] == 1 and stats['workers'] == 1 and stats['failed'] == 1
+    finally:
+        pool.close()
+
+
+def test_memory_over_limit_kills_the_worker(small_path):
+    pool = _fresh_pool()
+    try:
+        pid = pool._workers[0].process.pid
+        # 地址空间上限内可以分配，但私有内存超出限制，由父进程检测后结束
+        code = "import numpy as np\na = np.ones(160 * 1024 * 1024 // 8)\nfor _ in range(10 ** 9):\n    pass"
+        result = pool.run(code, small_path)
+        assert not result.ok and result.error == "内存超出限制"
+        assert pool.stats()['memory_kills'] == 1
+        assert pool._workers[0].process.pid != pid
+    finally:
+        pool.close()
+
+
+def test_oversized_allocation_fails_without_killing_the_worker(small_path):
+    pool = _fresh_pool()
+    try:
+        pid = pool._workers[0].process.pid
+        result = pool.run("import numpy as np\na = np.ones(10 ** 10)", small_path)
+        assert not result.ok and result.error == "内存超出限制"
+        # 超出地址空间上限的分配直接抛出 MemoryError，进程照常复用
+        assert pool._workers[0].process.pid == pid
+        assert pool.stats()['memory_kills'] == 0
+        assert _texts(pool.run("st.write(len(df))", small_path)) == ["2"]
+    finally:
+        pool.close()
+
+
+def test_worker_is_recycled_after_max_jobs(small_path):
+    pool = _fresh_pool(max_jobs_per_worker=2)
+    try:
+        pids = []
+        for _ in range(5):
+            pids.append(pool._workers[0].process.pid)
+            assert _texts(pool.run("st.write(1)", small_path)) == ["1"]
+        assert pids[0] == pids[1] != pids[2] == pids[3] != pids[4]
+        stats = pool.stats()
+        assert stats['recycled'] == 2 and stats['completed'] == 5 and stats['workers'] == 1
+    finally:
+        pool.close()
+
+
+def test_disallowed_imports_are_rejected(small_path, pool):
+    result = pool.run("import os\nst.write(os.getcwd())", small_path)
+    assert not result.ok and "ImportError" in result.error
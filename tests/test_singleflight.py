@@ -0,0 +1,84 @@
+import threading
+
+import pytest
+
+import singleflight
+
+
+def test_key_separates_api_keys_and_parameters():
+    base = singleflight.flight_key("key-a", "http://x/v1", "m", 0, "prompt")
+    assert base == singleflight.flight_key("key-a", "http://x/v1", "m", 0.0, "prompt")
+    assert base != singleflight.flight_key("key-b", "http://x/v1", "m", 0, "prompt")
+    assert base != singleflight.flight_key("key-a", "http://y/v1", "m", 0, "prompt")
+    assert base != singleflight.flight_key("key-a", "http://x/v1", "m", 0.2, "prompt")
+    assert base != singleflight.flight_key("key-a", "http://x/v1", "m", 0, "prompt!")
+
+
+def test_concurrent_joins_share_one_upstream_call():
+    group = singleflight.SingleFlightGroup()
+    release = threading.Event()
+    calls = []
+
+    def source():
+        calls.append(1)
+        yield "a"
+        release.wait(5)
+        yield "b"
+
+    leader, is_leader = group.join("k", source)
+    follower, is_follower_leader = group.join("k", source)
+    assert is_leader and not is_follower_leader
+    release.set()
+    assert "".join(leader) == "ab"
+    assert "".join(follower) == "ab"
+    assert len(calls) == 1
+    assert group.stats() == {'in_flight': 0, 'leaders': 1, 'coalesced': 1}
+
+
+def test_error_reaches_every_subscriber():
+    group = singleflight.SingleFlightGroup()
+    release = threading.Event()
+
+    def source():
+        yield "partial"
+        release.wait(5)
+        raise RuntimeError("upstream failed")
+
+    first, _ = group.join("k", source)
+    second, _ = group.join("k", source)
+    release.set()
+    for stream in (first, second):
+        with pytest.raises(RuntimeError, match="upstream failed"):
+            list(stream)
+
+
+def test_finished_flight_is_not_reused():
+    group = singleflight.SingleFlightGroup()
+    calls = []
+
+    def source():
+        calls.append(1)
+        yield str(len(calls))
+
+    first, _ = group.join("k", source)
+    assert list(first) == ["1"]
+    second, leader = group.join("k", source)
+    assert leader
+    assert list(second) == ["2"]
+
+
+def test_abandoned_subscriber_does_not_stop_others():
+    group = singleflight.SingleFlightGroup()
+    release = threading.Event()
+
+    def source():
+        yield "a"
+        release.wait(5)
+        yield "b"
+
+    leader, _ = group.join("k", source)
+    follower, _ = group.join("k", source)
+    assert next(leader) == "a"
+    leader.close()
+    release.set()
+    assert "".join(follower) == "ab"
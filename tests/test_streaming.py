@@ -0,0 +1,85 @@
+import time
+
+import pytest
+from langchain.prompts import PromptTemplate
+
+import llm_cache
+import utils
+from streaming import TokenStream, stream_section
+
+
+def _slow_tokens(delay, tokens):
+    time.sleep(delay)
+    yield from tokens
+
+
+def test_ttft_is_measured_at_first_non_empty_token():
+    stream = TokenStream(_slow_tokens(0.05, ["", "a", "b"]))
+    assert stream.ttft is None
+    assert stream.collect() == "ab"
+    assert 0.04 <= stream.ttft <= stream.elapsed
+    assert stream.token_count == 2 and stream.finished_at is not None
+
+
+def test_ttft_stays_none_without_tokens():
+    stream = TokenStream(iter([]))
+    assert stream.collect() == ""
+    assert stream.ttft is None
+
+
+def test_cached_flag_defaults_to_false():
+    assert not TokenStream(iter(["x"])).cached
+    assert TokenStream(iter(["x"]), cached=True).cached
+
+
+def test_partial_iteration_then_collect_reads_the_rest():
+    stream = TokenStream(iter(["a", "b", "c"]))
+    assert next(iter(stream)) == "a"
+    assert stream.collect() == "abc"
+
+
+def test_on_finish_called_once_with_error_and_prefix():
+    finished = []
+
+    def tokens():
+        yield "a"
+        raise RuntimeError("断开")
+
+    stream = TokenStream(tokens(), error_prefix="生成失败", on_finish=lambda s, e: finished.append(e))
+    with pytest.raises(Exception, match="生成失败：断开"):
+        stream.collect()
+    assert stream.text == "a"
+    assert len(finished) == 1 and isinstance(finished[0], RuntimeError)
+
+
+def test_on_finish_errors_do_not_reach_the_caller():
+    def on_finish(stream, error):
+        raise ValueError("指标写入失败")
+
+    assert TokenStream(iter(["a"]), on_finish=on_finish).collect() == "a"
+
+
+def test_stream_llm_cache_hit_returns_cached_stream(tmp_path, monkeypatch):
+    cache = llm_cache.LLMResponseCache(path=str(tmp_path / "cache.sqlite3"), max_temperature=0)
+    monkeypatch.setattr(llm_cache, "get_cache", lambda: cache)
+    prompt = PromptTemplate.from_template("总结：{text}")
+    cache.put("model", 0, prompt.invoke({'text': "内容"}).to_string(), "已缓存的回复")
+
+    def no_model(*args):
+        raise AssertionError("缓存命中时不应请求模型")
+
+    monkeypatch.setattr(utils.llm_client, "get_chat_model", no_model)
+    stream = utils._stream_llm(prompt, {'text': "内容"}, "key", "http://x/v1", "model", 0, "总结失败")
+    assert stream.cached
+    assert stream.collect() == "已缓存的回复"
+    assert stream.ttft is not None
+
+
+def test_stream_section_handles_tags_split_across_tokens():
+    tokens = ["前言[SEC", "TION]第一", "段内容[END", "SECTION]尾部"]
+    assert "".join(stream_section(iter(tokens), "[SECTION]", "[ENDSECTION]")) == "第一段内容"
+
+
+def test_stream_section_without_end_tag_emits_remainder():
+    assert "".join(stream_section(iter(["[A]", "abc"]), "[A]", "[ENDA]")) == "abc"
+    assert list(stream_section(iter(["no tags"]), "[A]", "[ENDA]")) == []
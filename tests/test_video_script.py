@@ -0,0 +1,98 @@
+import json
+import threading
+import time
+
+import pytest
+
+import utils
+from streaming import TokenStream
+
+OUTLINE = {
+    'title': "咖啡入门",
+    'hook': "你真的会喝咖啡吗？",
+    'sections': [
+        {'heading': "产地", 'minutes': 2, 'points': ["埃塞俄比亚", 3]},
+        {'heading': "烘焙", 'minutes': 1},
+        {'heading': "", 'minutes': 5},
+        "不是段落",
+        {'heading': "冲煮", 'minutes': 1},
+    ],
+    'summary': "多尝试",
+    'shooting_notes': "近景拍摄",
+}
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    """
+    替换 _stream_llm：大纲请求返回包裹在说明文字中的JSON，段落请求越靠前完成得越晚
+    """
+    state = {'outline': "好的，大纲如下：\n```json\n" + json.dumps(OUTLINE, ensure_ascii=False) + "\n```",
+             'sections': [], 'fail': {}}
+    lock = threading.Lock()
+
+    def stream_llm(prompt, variables, api_key, base_url, model, temperature, error_prefix, use_cache=None):
+        if 'index' not in variables:
+            return TokenStream(iter([state['outline']]))
+        index = variables['index']
+        with lock:
+            state['sections'].append(variables)
+            remaining = state['fail'].get(index, 0)
+            if remaining:
+                state['fail'][index] = remaining - 1
+        if remaining:
+            raise RuntimeError(f"第{index}段请求失败")
+        time.sleep(0.03 * (4 - index))
+        return TokenStream(iter([f" {variables['heading']}正文 "]))
+
+    monkeypatch.setattr(utils, "_stream_llm", stream_llm)
+    return state
+
+
+def test_parse_json_object_ignores_surrounding_text():
+    assert utils._parse_json_object('说明```json\n{"a": {"b": 1}}\n```结束') == {'a': {'b': 1}}
+    with pytest.raises(ValueError):
+        utils._parse_json_object("没有JSON")
+
+
+def test_outline_drops_invalid_sections_and_rescales_minutes(fake_llm):
+    outline = utils.generate_video_outline("咖啡", 8, 5, "key")
+    sections = outline['sections']
+    assert [sec['heading'] for sec in sections] == ["产地", "烘焙", "冲煮"]
+    # 2:1:1 按比例缩放到总长8分钟
+    assert [sec['minutes'] for sec in sections] == [4.0, 2.0, 2.0]
+    assert sections[0]['points'] == ["埃塞俄比亚", "3"] and sections[1]['points'] == []
+
+
+def test_outline_without_sections_is_rejected(fake_llm):
+    fake_llm['outline'] = '{"title": "空", "sections": []}'
+    with pytest.raises(ValueError, match="大纲中没有段落"):
+        utils.generate_video_outline("咖啡", 8, 5, "key")
+
+
+def test_sections_are_emitted_in_outline_order(fake_llm):
+    pieces = list(utils.generate_video_script_sectioned_stream("咖啡", 8, 5, "key", max_workers=3))
+    script = "".join(pieces)
+    # 后面的段落先完成，输出仍按大纲顺序
+    assert script.index("## 1. 产地（约4.0分钟）\n产地正文") < script.index("## 2. 烘焙") < script.index("## 3. 冲煮")
+    assert script.startswith("# 视频标题\n咖啡入门\n\n# 开场钩子\n你真的会喝咖啡吗？\n\n# 主要内容\n")
+    assert script.endswith("# 结尾总结\n多尝试\n\n# 拍摄建议\n近景拍摄\n")
+    variables = {v['index']: v for v in fake_llm['sections']}
+    assert variables[1]['words'] == 600 and variables[1]['points'] == "埃塞俄比亚；3"
+    assert variables[2]['points'] == "自行安排"
+    assert "3. 冲煮（2.0分钟）" in variables[1]['outline_text']
+
+
+def test_failed_section_is_regenerated(fake_llm):
+    fake_llm['fail'] = {2: 1}
+    script = utils.generate_video_script_enhanced("咖啡", 8, 5, "key", sectioned=True)
+    assert "## 2. 烘焙（约2.0分钟）\n烘焙正文" in script
+    assert [v['index'] for v in fake_llm['sections']].count(2) == 2
+
+
+def test_section_failing_after_retries_raises(fake_llm):
+    fake_llm['fail'] = {3: 2}
+    stream = utils.generate_video_script_sectioned_stream("咖啡", 8, 5, "key", hooks=False)
+    with pytest.raises(Exception, match="第3段生成失败"):
+        stream.collect()
+    assert "开场钩子" not in stream.text
@@ -0,0 +1,63 @@
+import threading
+
+import pytest
+
+import utils
+from streaming import TokenStream
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    """
+    替换 _stream_llm：按版本序号返回文案，fail 中记录每个序号剩余的失败次数
+    """
+    state = {'fail': {}, 'calls': [], 'variables': []}
+    lock = threading.Lock()
+
+    def stream_llm(prompt, variables, api_key, base_url, model, temperature, error_prefix, use_cache=None):
+        index = variables['index']
+        with lock:
+            state['calls'].append(index)
+            state['variables'].append(variables)
+            remaining = state['fail'].get(index, 0)
+            if remaining:
+                state['fail'][index] = remaining - 1
+        if remaining:
+            raise RuntimeError(f"版本{index}请求失败")
+        return TokenStream(iter([f"文案{index}", "正文"]))
+
+    monkeypatch.setattr(utils, "_stream_llm", stream_llm)
+    return state
+
+
+def test_each_variation_is_a_separate_request_with_its_own_angle(fake_llm):
+    results = list(utils.generate_xiaohongshu_variations("防晒霜", "key", num_variations=4, max_workers=4))
+    assert sorted(index for index, _, _ in results) == [0, 1, 2, 3]
+    assert all(error is None for _, _, error in results)
+    assert {index: text for index, text, _ in results} == {i: f"文案{i + 1}正文" for i in range(4)}
+    angles = [variables['angle'] for variables in fake_llm['variables']]
+    assert len(set(angles)) == 4
+
+
+def test_partial_failure_is_retried_and_reported_per_variation(fake_llm):
+    # 版本2失败一次后重试成功，版本3两次都失败
+    fake_llm['fail'] = {2: 1, 3: 2}
+    results = {index: (text, error)
+               for index, text, error in utils.generate_xiaohongshu_variations(
+                   "防晒霜", "key", num_variations=3, max_retries=1)}
+    assert results[0] == ("文案1正文", None)
+    assert results[1] == ("文案2正文", None)
+    text, error = results[2]
+    assert text is None and isinstance(error, RuntimeError)
+    assert fake_llm['calls'].count(2) == 2 and fake_llm['calls'].count(3) == 2
+
+
+def test_enhanced_parallel_joins_variations_in_order(fake_llm):
+    text = utils.generate_xiaohongshu_content_enhanced("防晒霜", "key", num_variations=3, parallel=True)
+    assert text == "## 文案1\n文案1正文\n\n## 文案2\n文案2正文\n\n## 文案3\n文案3正文"
+
+
+def test_enhanced_parallel_raises_when_a_variation_fails(fake_llm):
+    fake_llm['fail'] = {2: 5}
+    with pytest.raises(RuntimeError, match="版本2请求失败"):
+        utils.generate_xiaohongshu_content_enhanced("防晒霜", "key", num_variations=3, parallel=True)
@@ -1,334 +1,676 @@
-import pandas as pd
-import numpy as np
-from langchain.memory import ConversationBufferMemory
-from langchain.chat_models import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
-from langchain.chains import LLMChain
-from langchain.document_loaders import PyPDFLoader
-from langchain.text_splitter import CharacterTextSplitter
-from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.vectorstores import FAISS
-from langchain.chains.question_answering import load_qa_chain
-import tempfile
-import os
-import re
+import itertools
 import json
-from datetime import datetime
-import matplotlib.pyplot as plt
-import seaborn as sns
-import plotly.express as px
-import plotly.graph_objects as go
+import time
+
+import chat_memory
+import governor
+import instrumentation
+import llm_cache
+import prompt_templates
+import singleflight
+from lazy import lazy_import
+from parallel import run_concurrent
+from streaming import TokenStream
+
+# 重型依赖在首次使用对应功能时才导入：只用聊天的会话不会加载pandas、PDF解析与向量库。
+# 图表在沙箱工作进程中绘制，中文字体也在那里设置
+pd = lazy_import("pandas")
+code_cache = lazy_import("code_cache")
+llm_client = lazy_import("llm_client")
+bm25_index = lazy_import("bm25_index")
+pdf_cache = lazy_import("pdf_cache")
+pdf_extract = lazy_import("pdf_extract")
+pdf_index = lazy_import("pdf_index")
+pdf_summarize = lazy_import("pdf_summarize")
+profiler = lazy_import("profiler")
+
+
+def _stream_llm(prompt, variables, api_key, base_url, model, temperature, error_prefix, use_cache=None):
+    """
+    以流式方式调用模型，返回逐token产出的 TokenStream。
+    确定性调用（或 use_cache=True）先查响应缓存，命中时不再请求模型。
+    同样走缓存的调用在其他会话正在进行完全相同的请求（含同一API密钥）时直接共享其流式输出，
+    非确定性调用（如较高温度）每个调用方各自请求，得到各自的采样结果；
+    请求经 governor 排队、限流与重试；排队、网络等待、首字延迟与token用量记入 instrumentation
+    """
+    # 功能名用于指标标签，如「视频脚本生成失败」→「视频脚本生成」
+    feature = error_prefix[:-2] if error_prefix.endswith("失败") else error_prefix
+    with instrumentation.span("prompt_build", feature):
+        prompt_value = prompt.invoke(variables)
+        prompt_text = prompt_value.to_string()
+    cache = llm_cache.get_cache()
+    caching = cache.should_cache(temperature, use_cache)
+    if caching:
+        cached = cache.get(model, temperature, prompt_text)
+        if cached is not None:
+            instrumentation.record_llm_call(feature, model, cached=True)
+            return TokenStream(iter([cached]), error_prefix=error_prefix, cached=True)
+
+    # 复用进程级共享的客户端与连接池
+    llm = llm_client.get_chat_model(api_key, base_url, model, temperature)
+    gov = governor.get_governor(api_key, base_url)
+    timing = {'queue_wait': 0.0, 'network_wait': None, 'usage': None}
+
+    def tokens():
+        parts = []
+        # 在流的整个生命周期内占用一个请求名额，流结束或被关闭时释放
+        with gov.slot() as waited:
+            timing['queue_wait'] = waited
+            instrumentation.observe("queue_wait", waited, feature)
+            start = time.perf_counter()
+            # 服务端在流末尾返回的用量（含命中提示词前缀缓存的token数）写入 timing['usage']
+            with llm_client.record_usage() as usage:
+                first, rest = gov.open_stream(lambda: llm.stream(prompt_value))
+            timing['usage'] = usage
+            timing['network_wait'] = time.perf_counter() - start
+            chunks = rest if first is None else itertools.chain([first], rest)
+            for chunk in chunks:
+                parts.append(chunk.content)
+                yield chunk.content
+        if caching:
+            cache.put(model, temperature, prompt_text, "".join(parts))
+
+    def on_finish(stream, error):
+        stream.queue_seconds = timing['queue_wait']
+        # 服务端未返回用量时按本地估算器计算token数
+        usage = timing['usage'] or {}
+        stream.cached_prompt_tokens = usage.get('cached_prompt_tokens', 0)
+        instrumentation.record_llm_call(
+            feature, model, cached=False, error=error is not None,
+            prompt_tokens=usage.get('prompt_tokens') or chat_memory.estimate_tokens(prompt_text),
+            completion_tokens=usage.get('completion_tokens') or chat_memory.estimate_tokens(stream.text),
+            cached_prompt_tokens=stream.cached_prompt_tokens,
+            ttft=stream.ttft, network_wait=timing['network_wait'], elapsed=stream.elapsed
+        )
 
-# 设置中文字体
-plt.rcParams['font.sans-serif'] = ['SimHei', 'DejaVu Sans']
-plt.rcParams['axes.unicode_minus'] = False
+    if not caching:
+        return TokenStream(tokens(), error_prefix=error_prefix, on_finish=on_finish)
 
+    key = singleflight.flight_key(api_key, base_url, model, temperature, prompt_text)
+    source, leader = singleflight.group.join(key, tokens)
+    if leader:
+        return TokenStream(source, error_prefix=error_prefix, on_finish=on_finish)
 
-def generate_video_script_enhanced(theme, length, creativity, api_key, base_url="https://api.openai-hk.com/v1",
-                                   style="科普教育", audience="", hooks=True, cta=True, model="gpt-4o-mini",
-                                   temperature=0.7):
-    """
-    增强版视频脚本生成器
-    """
-    try:
-        llm = ChatOpenAI(temperature=temperature, openai_api_key=api_key, model_name=model, base_url=base_url)
-
-        # 构建详细的提示词
-        style_prompts = {
-            "科普教育": "采用清晰易懂的语言，循序渐进地解释概念，适合教育类视频",
-            "娱乐搞笑": "使用幽默风趣的语言，增加互动元素和笑点",
-            "商业营销": "突出产品价值，包含明确的行动号召和转化点",
-            "纪录片": "采用客观叙述风格，注重事实和细节描述",
-            "新闻播报": "使用正式新闻语言，结构清晰，重点突出",
-            "个人分享": "采用亲切自然的语调，增加个人经历和感受"
-        }
+    def on_coalesced_finish(follower, error):
+        instrumentation.record_llm_call(feature, model, cached=False, coalesced=True, error=error is not None,
+                                        ttft=follower.ttft, elapsed=follower.elapsed)
+
+    follower = TokenStream(source, error_prefix=error_prefix, on_finish=on_coalesced_finish)
+    follower.coalesced = True
+    return follower
 
-        style_desc = style_prompts.get(style, style_prompts["科普教育"])
 
-        template = f"""你是一位专业的视频脚本撰写者，擅长{style}风格。
+# 视频风格提示
+VIDEO_STYLE_PROMPTS = {
+    "科普教育": "采用清晰易懂的语言，循序渐进地解释概念，适合教育类视频",
+    "娱乐搞笑": "使用幽默风趣的语言，增加互动元素和笑点",
+    "商业营销": "突出产品价值，包含明确的行动号召和转化点",
+    "纪录片": "采用客观叙述风格，注重事实和细节描述",
+    "新闻播报": "使用正式新闻语言，结构清晰，重点突出",
+    "个人分享": "采用亲切自然的语调，增加个人经历和感受"
+}
 
-请为主题：{theme}，时长：{length}分钟的视频创作一个完整的脚本。
+# 分段生成时的并发段落数
+VIDEO_SECTION_WORKERS = 4
 
-要求：
-1. 风格：{style_desc}
-2. 目标受众：{audience if audience else "一般观众"}
-3. 时长控制：{length}分钟（约{int(length * 150)}字）
-4. 创造力：{creativity}（0=严谨，1=创意）
-5. 开场钩子：{'需要' if hooks else '不需要'}
-6. 行动号召：{'需要' if cta else '不需要'}
 
-请按以下格式输出：
-# 视频标题
-[标题]
+def generate_video_script_stream(theme, length, creativity, api_key, base_url="https://api.openai-hk.com/v1",
+                                 style="科普教育", audience="", hooks=True, cta=True, model="gpt-4o-mini",
+                                 temperature=0.7, use_cache=None):
+    """
+    增强版视频脚本生成器（流式），返回逐token产出的 TokenStream
+    """
+    try:
+        # 用户输入只作为模板变量传入，固定说明在系统消息中
+        style_desc = VIDEO_STYLE_PROMPTS.get(style, VIDEO_STYLE_PROMPTS["科普教育"])
+        return _stream_llm(prompt_templates.get("video_script"), {
+            'theme': theme,
+            'length': length,
+            'words': int(length * 150),
+            'style': style,
+            'style_desc': style_desc,
+            'audience': audience if audience else "一般观众",
+            'creativity': creativity,
+            'hooks': '需要' if hooks else '不需要',
+            'cta': '需要' if cta else '不需要'
+        }, api_key, base_url, model, temperature, "视频脚本生成失败", use_cache=use_cache)
 
-# 开场钩子
-[吸引观众的开场]
+    except Exception as e:
+        raise Exception(f"视频脚本生成失败：{str(e)}")
 
-# 主要内容
-[分段落的主要内容，每段标注时长]
 
-# 结尾总结
-[总结和行动号召]
+def generate_video_script_enhanced(theme, length, creativity, api_key, base_url="https://api.openai-hk.com/v1",
+                                   style="科普教育", audience="", hooks=True, cta=True, model="gpt-4o-mini",
+                                   temperature=0.7, use_cache=None, sectioned=False):
+    """
+    增强版视频脚本生成器，sectioned=True 时先生成大纲再并发生成各段落
+    """
+    stream_fn = generate_video_script_sectioned_stream if sectioned else generate_video_script_stream
+    return stream_fn(
+        theme, length, creativity, api_key, base_url=base_url, style=style, audience=audience,
+        hooks=hooks, cta=cta, model=model, temperature=temperature, use_cache=use_cache
+    ).collect()
 
-# 拍摄建议
-[镜头、场景、道具等建议]
 
-请确保内容结构清晰，语言生动有趣。"""
+def _parse_json_object(text):
+    """
+    从模型回复中提取第一个JSON对象（兼容包裹在代码块或说明文字中的情况）
+    """
+    with instrumentation.span("parse", "视频大纲生成"):
+        start = text.find("{")
+        end = text.rfind("}")
+        if start < 0 or end <= start:
+            raise ValueError("模型未返回有效的JSON")
+        return json.loads(text[start:end + 1])
 
-        prompt = ChatPromptTemplate.from_template(template)
-        chain = LLMChain(llm=llm, prompt=prompt)
-        result = chain.run(theme=theme, length=length)
 
-        return result
+def generate_video_outline(theme, length, creativity, api_key, base_url="https://api.openai-hk.com/v1",
+                           style="科普教育", audience="", hooks=True, cta=True, model="gpt-4o-mini",
+                           temperature=0.7, use_cache=None):
+    """
+    生成结构化视频大纲：标题、开场钩子、带时长的段落列表、结尾总结与拍摄建议
+    """
+    style_desc = VIDEO_STYLE_PROMPTS.get(style, VIDEO_STYLE_PROMPTS["科普教育"])
+    num_sections = max(2, min(12, int(round(length / 4)) + 1))
+
+    text = _stream_llm(prompt_templates.get("video_outline"), {
+        'theme': theme,
+        'length': length,
+        'style': style,
+        'style_desc': style_desc,
+        'audience': audience if audience else "一般观众",
+        'creativity': creativity,
+        'hooks': '需要' if hooks else '不需要（hook 字段留空）',
+        'cta': '需要写入结尾总结' if cta else '不需要',
+        'num_sections': num_sections
+    }, api_key, base_url, model, temperature, "视频大纲生成失败", use_cache=use_cache).collect()
+    outline = _parse_json_object(text)
+
+    sections = [sec for sec in outline.get("sections") or [] if isinstance(sec, dict) and sec.get("heading")]
+    if not sections:
+        raise ValueError("大纲中没有段落")
+    # 按比例修正各段时长，保证总时长与要求一致
+    total = sum(float(sec.get("minutes") or 0) for sec in sections) or len(sections)
+    for sec in sections:
+        minutes = float(sec.get("minutes") or total / len(sections))
+        sec["minutes"] = round(minutes * length / total, 1)
+        sec["points"] = [str(p) for p in sec.get("points") or []]
+    outline["sections"] = sections
+    return outline
+
+
+def generate_video_script_sectioned_stream(theme, length, creativity, api_key,
+                                           base_url="https://api.openai-hk.com/v1", style="科普教育",
+                                           audience="", hooks=True, cta=True, model="gpt-4o-mini",
+                                           temperature=0.7, use_cache=None, max_workers=VIDEO_SECTION_WORKERS,
+                                           max_retries=1):
+    """
+    两阶段视频脚本生成（流式）：先生成大纲，再用有界线程池并发生成各段落，
+    按段落顺序逐段产出，输出格式与 generate_video_script_stream 一致；
+    失败的段落会单独重新生成
+    """
+    style_desc = VIDEO_STYLE_PROMPTS.get(style, VIDEO_STYLE_PROMPTS["科普教育"])
+
+    def pieces():
+        outline = generate_video_outline(
+            theme, length, creativity, api_key, base_url=base_url, style=style, audience=audience,
+            hooks=hooks, cta=cta, model=model, temperature=temperature, use_cache=use_cache
+        )
+        sections = outline["sections"]
+        yield f"# 视频标题\n{outline.get('title') or theme}\n\n"
+        if hooks and outline.get("hook"):
+            yield f"# 开场钩子\n{outline['hook']}\n\n"
+        yield "# 主要内容\n"
+
+        outline_text = "\n".join(
+            f"{i}. {sec['heading']}（{sec['minutes']}分钟）" for i, sec in enumerate(sections, 1)
+        )
+
+        def make_task(index):
+            sec = sections[index]
+            variables = {
+                'theme': theme,
+                'style': style,
+                'style_desc': style_desc,
+                'audience': audience if audience else "一般观众",
+                'outline_text': outline_text,
+                'index': index + 1,
+                'heading': sec['heading'],
+                'minutes': sec['minutes'],
+                'words': int(sec['minutes'] * 150),
+                'points': "；".join(sec["points"]) or "自行安排"
+            }
+
+            def task():
+                return _stream_llm(prompt_templates.get("video_section"), variables, api_key, base_url, model,
+                                   temperature, "段落生成失败", use_cache=use_cache).collect()
+
+            return task
+
+        # 段落并发生成，但按顺序输出：先完成的后续段落暂存，等前面的段落就绪后一起输出
+        ready = {}
+        next_index = 0
+        tasks = [make_task(index) for index in range(len(sections))]
+        for index, text, error in run_concurrent(tasks, max_workers=max_workers, max_retries=max_retries):
+            if error is not None:
+                raise Exception(f"第{index + 1}段生成失败：{str(error)}")
+            ready[index] = text
+            while next_index in ready:
+                sec = sections[next_index]
+                yield (f"## {next_index + 1}. {sec['heading']}（约{sec['minutes']}分钟）\n"
+                       f"{ready.pop(next_index).strip()}\n\n")
+                next_index += 1
+
+        yield f"# 结尾总结\n{outline.get('summary') or ''}\n\n"
+        yield f"# 拍摄建议\n{outline.get('shooting_notes') or ''}\n"
+
+    return TokenStream(pieces(), error_prefix="视频脚本生成失败")
+
+
+# 小红书内容类型提示
+XHS_TYPE_PROMPTS = {
+    "种草推荐": "突出产品优势，包含使用体验和推荐理由",
+    "经验分享": "分享个人经历和心得，增加实用价值",
+    "生活记录": "记录日常生活片段，增加情感共鸣",
+    "知识科普": "传播专业知识，语言通俗易懂",
+    "情感故事": "讲述情感经历，增加情感共鸣",
+    "美食探店": "描述美食体验，包含环境、味道、价格等"
+}
+
+# 小红书语调提示
+XHS_TONE_PROMPTS = {
+    "亲切自然": "像朋友聊天一样自然亲切",
+    "专业权威": "专业可信，有权威性",
+    "活泼可爱": "年轻活力，充满正能量",
+    "文艺清新": "文艺范儿，清新脱俗",
+    "幽默风趣": "幽默有趣，增加笑点"
+}
+
+# 并行生成时每个版本的切入角度，保证各自独立请求的文案互不重复
+XHS_ANGLES = [
+    "真实使用体验", "干货清单", "对比测评", "情绪共鸣", "避坑指南",
+    "场景故事", "数据说话", "新手入门", "省钱攻略", "趋势解读"
+]
+
+# 并行生成的最大并发请求数
+XHS_MAX_WORKERS = 10
+
+
+def generate_xiaohongshu_content_stream(theme, api_key, base_url="https://api.openai-hk.com/v1",
+                                        content_type="种草推荐", tone="亲切自然", num_variations=5,
+                                        audience="", hashtags=True, emoji=True, model="gpt-4o-mini",
+                                        temperature=0.7, use_cache=None):
+    """
+    增强版小红书文案生成器（流式）
+    """
+    try:
+        type_desc = XHS_TYPE_PROMPTS.get(content_type, XHS_TYPE_PROMPTS["种草推荐"])
+        tone_desc = XHS_TONE_PROMPTS.get(tone, XHS_TONE_PROMPTS["亲切自然"])
+
+        return _stream_llm(prompt_templates.get("xhs_batch"), {
+            'theme': theme,
+            'num_variations': num_variations,
+            'content_type': content_type,
+            'type_desc': type_desc,
+            'tone_desc': tone_desc,
+            'audience': audience if audience else "小红书用户",
+            'emoji': '是' if emoji else '否',
+            'hashtags': '是' if hashtags else '否'
+        }, api_key, base_url, model, temperature, "小红书文案生成失败", use_cache=use_cache)
 
     except Exception as e:
-        raise Exception(f"视频脚本生成失败：{str(e)}")
+        raise Exception(f"小红书文案生成失败：{str(e)}")
 
 
 def generate_xiaohongshu_content_enhanced(theme, api_key, base_url="https://api.openai-hk.com/v1",
                                           content_type="种草推荐", tone="亲切自然", num_variations=5,
                                           audience="", hashtags=True, emoji=True, model="gpt-4o-mini",
-                                          temperature=0.7):
+                                          temperature=0.7, use_cache=None, parallel=False):
     """
-    增强版小红书文案生成器
+    增强版小红书文案生成器，parallel=True 时每个版本并发单独生成
     """
-    try:
-        llm = ChatOpenAI(temperature=temperature, openai_api_key=api_key, model_name=model, base_url=base_url)
-
-        # 内容类型提示
-        type_prompts = {
-            "种草推荐": "突出产品优势，包含使用体验和推荐理由",
-            "经验分享": "分享个人经历和心得，增加实用价值",
-            "生活记录": "记录日常生活片段，增加情感共鸣",
-            "知识科普": "传播专业知识，语言通俗易懂",
-            "情感故事": "讲述情感经历，增加情感共鸣",
-            "美食探店": "描述美食体验，包含环境、味道、价格等"
-        }
-
-        # 语调提示
-        tone_prompts = {
-            "亲切自然": "像朋友聊天一样自然亲切",
-            "专业权威": "专业可信，有权威性",
-            "活泼可爱": "年轻活力，充满正能量",
-            "文艺清新": "文艺范儿，清新脱俗",
-            "幽默风趣": "幽默有趣，增加笑点"
+    if parallel:
+        results = [None] * num_variations
+        for index, text, error in generate_xiaohongshu_variations(
+                theme, api_key, base_url=base_url, content_type=content_type, tone=tone,
+                num_variations=num_variations, audience=audience, hashtags=hashtags, emoji=emoji,
+                model=model, temperature=temperature, use_cache=use_cache):
+            if error is not None:
+                raise error
+            results[index] = text
+        return "\n\n".join(f"## 文案{i}\n{text}" for i, text in enumerate(results, 1))
+
+    return generate_xiaohongshu_content_stream(
+        theme, api_key, base_url=base_url, content_type=content_type, tone=tone,
+        num_variations=num_variations, audience=audience, hashtags=hashtags, emoji=emoji,
+        model=model, temperature=temperature, use_cache=use_cache
+    ).collect()
+
+
+def generate_xiaohongshu_variations(theme, api_key, base_url="https://api.openai-hk.com/v1",
+                                    content_type="种草推荐", tone="亲切自然", num_variations=5,
+                                    audience="", hashtags=True, emoji=True, model="gpt-4o-mini",
+                                    temperature=0.7, use_cache=None, max_workers=XHS_MAX_WORKERS,
+                                    max_retries=1):
+    """
+    并行生成小红书文案：每个版本单独请求、并发执行，按完成顺序产出 (序号, 文案, 异常)，
+    序号从0开始；失败的版本单独重试，最终仍失败时异常随结果返回
+    """
+    type_desc = XHS_TYPE_PROMPTS.get(content_type, XHS_TYPE_PROMPTS["种草推荐"])
+    tone_desc = XHS_TONE_PROMPTS.get(tone, XHS_TONE_PROMPTS["亲切自然"])
+
+    def make_task(index):
+        variables = {
+            'theme': theme,
+            'content_type': content_type,
+            'type_desc': type_desc,
+            'tone_desc': tone_desc,
+            'audience': audience if audience else "小红书用户",
+            'emoji': '是' if emoji else '否',
+            'hashtags': '是' if hashtags else '否',
+            'num_variations': num_variations,
+            'index': index + 1,
+            'angle': XHS_ANGLES[index % len(XHS_ANGLES)]
         }
 
-        type_desc = type_prompts.get(content_type, type_prompts["种草推荐"])
-        tone_desc = tone_prompts.get(tone, tone_prompts["亲切自然"])
+        def task():
+            return _stream_llm(prompt_templates.get("xhs_single"), variables, api_key, base_url, model,
+                               temperature, "小红书文案生成失败", use_cache=use_cache).collect()
 
-        template = f"""你是一位小红书爆款写手，擅长{content_type}类型的内容创作。
+        return task
 
-请为主题：{theme} 创作{num_variations}个不同版本的文案。
+    tasks = [make_task(index) for index in range(num_variations)]
+    yield from run_concurrent(tasks, max_workers=max_workers, max_retries=max_retries)
 
-要求：
-1. 内容类型：{type_desc}
-2. 语调风格：{tone_desc}
-3. 目标用户：{audience if audience else "小红书用户"}
-4. 包含表情符号：{'是' if emoji else '否'}
-5. 包含话题标签：{'是' if hashtags else '否'}
-6. 每个文案包含：标题 + 正文 + 标签
 
-请按以下格式输出：
+# PDF问答的检索方式：向量检索、本地关键词检索（BM25，不调用嵌入接口）、两者融合
+# （混合检索只使用已有的向量索引，没有时只按关键词排序，不会为此嵌入整份文档）
+RETRIEVAL_MODES = ("vector", "bm25", "hybrid")
 
-## 文案1
-**标题：** [吸引人的标题]
-**正文：** [正文内容]
-**标签：** [相关话题标签]
 
-## 文案2
-**标题：** [吸引人的标题]
-**正文：** [正文内容]
-**标签：** [相关话题标签]
-
-[继续其他文案...]
-
-请确保每个文案都有不同的角度和表达方式，避免重复。"""
-
-        prompt = ChatPromptTemplate.from_template(template)
-        chain = LLMChain(llm=llm, prompt=prompt)
-        result = chain.run(theme=theme)
-
-        return result
+def summarize_pdf_stream(data, question, api_key, base_url="https://api.openai-hk.com/v1", model="gpt-4o-mini",
+                         temperature=0.0, use_cache=None, max_workers=None, max_retries=1, progress=None):
+    """
+    全文问题的 map-reduce 问答（流式）：用有界线程池并发摘要每个分块（摘要按 (文档, 分块序号, 模型) 缓存），
+    摘要总长超出一次请求的预算时分组逐层合并，最后基于全文摘要流式回答问题。
+    progress(已完成数, 总数) 在分块摘要阶段每完成一块调用一次；返回的 TokenStream 的 summary 属性记录分块与缓存命中数
+    """
+    doc_hash = pdf_index.content_hash(data)
+    doc_key = pdf_cache.PDFParseCache.make_key(doc_hash)
+    summary_cache = pdf_summarize.get_cache()
+    stats = {'chunks': 0, 'cached': 0, 'levels': 0}
+
+    def summarize(name, variables, error_prefix):
+        # 摘要与合并使用确定性温度，结果稳定、可复用
+        return _stream_llm(prompt_templates.get(name), variables, api_key, base_url, model, 0.0, error_prefix,
+                           use_cache=use_cache).collect().strip()
+
+    def pieces():
+        with instrumentation.span("pdf_load", "PDF问答"):
+            parsed = pdf_cache.load_pdf(data)
+        # 分块序号取解析结果中的位置，切分参数不变时保持稳定
+        chunks = [(index, chunk) for index, chunk in enumerate(parsed.chunks)
+                  if len(chunk.page_content.strip()) > 50]
+        if not chunks:
+            raise ValueError("PDF中没有可总结的文本内容")
+        summaries = summary_cache.get_many(doc_key, model, [index for index, _ in chunks])
+        stats['chunks'] = len(chunks)
+        stats['cached'] = len(summaries)
+        if progress is not None:
+            progress(len(summaries), len(chunks))
+
+        # map：缺失的分块摘要并发生成，每完成一块立即写入缓存，中途失败时已完成的部分不会丢失
+        missing = [(index, chunk) for index, chunk in chunks if index not in summaries]
+
+        def make_task(index, chunk):
+            page = chunk.metadata.get("page")
+            variables = {'page': page + 1 if isinstance(page, int) else "?", 'content': chunk.page_content}
+
+            def task():
+                return summarize("pdf_map", variables, "分块摘要失败")
+
+            return task
+
+        tasks = [make_task(index, chunk) for index, chunk in missing]
+        workers = max_workers or pdf_summarize.PDF_SUMMARY_WORKERS
+        for position, text, error in run_concurrent(tasks, max_workers=workers, max_retries=max_retries):
+            index = missing[position][0]
+            if error is not None:
+                raise Exception(f"第{index + 1}个分块：{str(error)}")
+            summary_cache.put(doc_key, index, model, text)
+            summaries[index] = text
+            if progress is not None:
+                progress(len(summaries), len(chunks))
+
+        def make_reduce_task(group):
+            def task():
+                return summarize("pdf_reduce", {'summaries': "\n\n".join(group)}, "摘要合并失败")
+
+            return task
+
+        # reduce：摘要总长超出预算时分组并发合并，逐层向上
+        level = []
+        for index, chunk in chunks:
+            page = chunk.metadata.get("page")
+            label = f"[第{page + 1}页] " if isinstance(page, int) else ""
+            level.append(label + summaries[index])
+        while len(level) > 1 and sum(len(text) for text in level) > pdf_summarize.PDF_REDUCE_MAX_CHARS:
+            groups = pdf_summarize.group_for_reduce(level)
+            stats['levels'] += 1
+            merged = [None] * len(groups)
+            tasks = [make_reduce_task(group) for group in groups]
+            for position, text, error in run_concurrent(tasks, max_workers=workers, max_retries=max_retries):
+                if error is not None:
+                    raise error
+                merged[position] = text
+            level = merged
+
+        answer = _stream_llm(prompt_templates.get("pdf_answer"),
+                             {'summaries': "\n\n".join(level), 'question': question},
+                             api_key, base_url, model, temperature, "全文回答失败", use_cache=use_cache)
+        yield from answer
+
+    stream = TokenStream(pieces(), error_prefix="PDF问答失败")
+    stream.summary = stats
+    return stream
+
+
+def chat_with_pdf_stream(file, question, api_key, base_url="https://api.openai-hk.com/v1",
+                         model="gpt-4o-mini", temperature=0.0, top_k=4, embeddings=None, use_cache=None,
+                         retrieval="vector", whole_document=None, progress=None):
+    """
+    增强版PDF问答系统（流式）。
+    whole_document=None 时自动识别总结、结论等需要通读全文的问题并改用 map-reduce 汇总，
+    True 总是汇总全文，False 总是只检索相关片段
+    """
+    try:
+        if retrieval not in RETRIEVAL_MODES:
+            raise ValueError(f"未知的检索方式：{retrieval}")
+        data = file.getvalue()
+        # 超过大小上限的文件直接拒绝，不做任何解析
+        pdf_extract.check_size(len(data))
+
+        if whole_document is None:
+            whole_document = pdf_summarize.is_whole_document_question(question)
+        if whole_document:
+            return summarize_pdf_stream(data, question, api_key, base_url=base_url, model=model,
+                                        temperature=temperature, use_cache=use_cache, progress=progress)
+
+        doc_hash = pdf_index.content_hash(data)
+        if embeddings is None and retrieval != "bm25":
+            embeddings = pdf_index.get_embeddings(api_key, base_url)
+
+        def load_chunks():
+            # 解析结果按内容哈希缓存，同一文档不会重复解析；未命中时边抽取边产出，嵌入与抽取同时进行
+            chunks = pdf_cache.iter_chunks(data)
+            waited = 0.0
+            while True:
+                start = time.perf_counter()
+                chunk = next(chunks, None)
+                waited += time.perf_counter() - start
+                if chunk is None:
+                    break
+                # 过滤太短的内容
+                if len(chunk.page_content.strip()) > 50:
+                    yield chunk
+            instrumentation.observe("pdf_load", waited, "PDF问答")
+
+        # 索引按文档哈希持久化，只在首次遇到该文档时解析（向量索引还需嵌入一次）；
+        # 混合检索只加载已有的向量索引
+        store = None
+        if retrieval == "vector":
+            store = pdf_index.get_or_build_index(doc_hash, load_chunks, embeddings)
+        elif retrieval == "hybrid":
+            store = pdf_index.load_index(doc_hash, embeddings)
+        if retrieval != "vector":
+            lexical = bm25_index.get_or_build_index(doc_hash, load_chunks)
+        # 融合时每路多取一些候选，让两路都靠前的文本块排到最前
+        candidates = top_k * 2 if store is not None and retrieval == "hybrid" else top_k
+        rankings = []
+        with instrumentation.span("pdf_retrieve", "PDF问答"):
+            if store is not None:
+                try:
+                    rankings.append(store.similarity_search(question, k=candidates))
+                except Exception:
+                    # 混合检索时嵌入接口不可用只放弃向量结果，仍按关键词检索回答
+                    if retrieval != "hybrid":
+                        raise
+            if retrieval != "vector":
+                rankings.append([doc for doc, _ in lexical.search(question, top_k=candidates)])
+            docs = rankings[0] if len(rankings) == 1 else bm25_index.rrf_fuse(rankings, top_k=top_k)
+            context = pdf_index.format_context(docs)
+
+        return _stream_llm(prompt_templates.get("pdf_qa"), {'context': context, 'question': question},
+                           api_key, base_url, model, temperature, "PDF问答失败", use_cache=use_cache)
 
     except Exception as e:
-        raise Exception(f"小红书文案生成失败：{str(e)}")
+        raise Exception(f"PDF问答失败：{str(e)}")
 
 
 def chat_with_pdf_enhanced(file, question, api_key, base_url="https://api.openai-hk.com/v1",
-                           model="gpt-4o-mini", temperature=0.0):
+                           model="gpt-4o-mini", temperature=0.0, top_k=4, embeddings=None, use_cache=None,
+                           retrieval="vector", whole_document=None):
     """
     增强版PDF问答系统
     """
-    try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
-            tmp_file.write(file.getvalue())
-            tmp_path = tmp_file.name
-
-        # 加载PDF
-        loader = PyPDFLoader(tmp_path)
-        pages = loader.load_and_split()
-
-        # 文本分割
-        text_splitter = CharacterTextSplitter(
-            separator="\n",
-            chunk_size=1500,
-            chunk_overlap=200,
-            length_function=len
-        )
-        texts = text_splitter.split_documents(pages)
-
-        # 提取文本内容
-        context_parts = []
-        for text in texts:
-            content = text.page_content.strip()
-            if content and len(content) > 50:  # 过滤太短的内容
-                context_parts.append(content)
+    return chat_with_pdf_stream(
+        file, question, api_key, base_url=base_url, model=model, temperature=temperature,
+        top_k=top_k, embeddings=embeddings, use_cache=use_cache, retrieval=retrieval,
+        whole_document=whole_document
+    ).collect()
 
-        context = "\n\n".join(context_parts)
 
-        # 限制 context 长度
-        max_context_chars = 4000
-        if len(context) > max_context_chars:
-            context = context[:max_context_chars] + "\n\n【内容过长，仅截取部分参与问答】"
-
-        # 创建LLM
-        llm = ChatOpenAI(temperature=temperature, openai_api_key=api_key, model_name=model, base_url=base_url)
+def analyze_csv_stream(df, query, api_key, base_url="https://api.openai-hk.com/v1",
+                       model="gpt-4o-mini", temperature=0.0, use_cache=None, dataset_hash=None):
+    """
+    增强版CSV分析工具（流式），产出模型的原始回复，可用 parse_analysis_response 解析
+    """
+    try:
+        if not isinstance(df, pd.DataFrame) or df.empty:
+            raise ValueError("CSV文件为空或格式错误，请检查后重新上传。")
 
-        # 构建智能提示词
-        template = """你是一位专业的PDF智能问答助手。请根据以下PDF内容回答用户问题。
+        # 数据预处理信息：列统计来自按数据集缓存的画像，同一数据集的多次提问不再重复扫描整表
+        profile = profiler.get_profile(df, dataset_hash=dataset_hash)
+        df_info = {
+            'shape': df.shape,
+            'columns': df.columns.tolist(),
+            'null_counts': {col['name']: col['null_count'] for col in profile.columns if col['null_count']},
+            'numeric_columns': profile.column_names('numeric'),
+            'categorical_columns': profile.column_names('categorical'),
+            'datetime_columns': profile.column_names('datetime'),
+            'profile': profile.to_prompt_text(),
+            'sample_data': df.head(5).to_dict('records')
+        }
 
-PDF内容：
-{context}
+        return _stream_llm(prompt_templates.get("csv_analysis"), {
+            'shape': df_info['shape'],
+            'columns': df_info['columns'],
+            'numeric_columns': df_info['numeric_columns'],
+            'categorical_columns': df_info['categorical_columns'],
+            'datetime_columns': df_info['datetime_columns'],
+            'null_counts': df_info['null_counts'],
+            'profile': df_info['profile'],
+            'sample_data': df_info['sample_data'],
+            'query': query
+        }, api_key, base_url, model, temperature, "CSV分析失败", use_cache=use_cache)
 
-用户问题：{question}
+    except Exception as e:
+        raise Exception(f"CSV分析失败：{str(e)}")
 
-回答要求：
-1. 基于PDF内容准确回答
-2. 如果PDF中没有相关信息，请明确说明
-3. 回答要简洁明了，结构清晰
-4. 可以适当补充相关知识，但要标注来源
-5. 使用中文回答
 
-请用专业、友好的语调回答："""
+def parse_analysis_response(response):
+    """
+    解析CSV分析回复中的代码、分析文本与图表类型
+    """
+    start = time.perf_counter()
+    # 解析返回内容
+    code = ""
+    analysis = ""
+    chart_type = ""
 
-        prompt = ChatPromptTemplate.from_template(template)
-        chain = LLMChain(llm=llm, prompt=prompt)
-        answer = chain.run(context=context, question=question)
+    if "[CODE]" in response and "[ENDCODE]" in response:
+        code = response.split("[CODE]")[1].split("[ENDCODE]")[0].strip()
 
-        # 清理临时文件
-        os.unlink(tmp_path)
+    if "[ANALYSIS]" in response and "[ENDANALYSIS]" in response:
+        analysis = response.split("[ANALYSIS]")[1].split("[ENDANALYSIS]")[0].strip()
 
-        return answer
+    if "[CHART_TYPE]" in response and "[ENDCHART_TYPE]" in response:
+        chart_type = response.split("[CHART_TYPE]")[1].split("[ENDCHART_TYPE]")[0].strip()
 
-    except Exception as e:
-        # 确保清理临时文件
-        if 'tmp_path' in locals():
-            try:
-                os.unlink(tmp_path)
-            except:
-                pass
-        raise Exception(f"PDF问答失败：{str(e)}")
+    instrumentation.observe("parse", time.perf_counter() - start, "CSV分析")
+    return code, analysis, chart_type
 
 
 def analyze_csv_with_plot_enhanced(df, query, api_key, base_url="https://api.openai-hk.com/v1",
-                                   model="gpt-4o-mini", temperature=0.0):
+                                   model="gpt-4o-mini", temperature=0.0, use_cache=None, dataset_hash=None,
+                                   validate=None, on_stream=None):
     """
-    增强版CSV分析工具
+    增强版CSV分析工具。
+    结构相同的数据做过同样的分析时直接复用缓存的代码，不调用模型。
+    传入 validate 时每段代码（含缓存的代码）都先经 validate(code) 验证（例如在沙箱中执行）：
+    缓存的代码验证失败时使其失效并重新生成，新生成的代码验证通过才写入缓存；未传入 validate 时不写入缓存。
+    on_stream(stream) 在开始调用模型时被调用，界面可以边读边显示，读到一半也不影响结果
     """
     try:
         if not isinstance(df, pd.DataFrame) or df.empty:
             return "", "CSV文件为空或格式错误，请检查后重新上传。", None
 
-        llm = ChatOpenAI(temperature=temperature, openai_api_key=api_key, model_name=model, base_url=base_url)
-
-        # 数据预处理信息
-        df_info = {
-            'shape': df.shape,
-            'columns': df.columns.tolist(),
-            'dtypes': df.dtypes.to_dict(),
-            'null_counts': df.isnull().sum().to_dict(),
-            'numeric_columns': df.select_dtypes(include=[np.number]).columns.tolist(),
-            'categorical_columns': df.select_dtypes(include=['object']).columns.tolist(),
-            'sample_data': df.head(5).to_dict('records')
-        }
-
-        template = """
-你是一位数据分析和可视化专家。用户会给你一个数据分析或可视化请求，请你返回三部分内容：
-
-1. 画图代码（只返回可直接用exec执行的python代码，不要返回markdown代码块）
-2. 分析文本（简要说明图表含义和数据洞察）
-3. 图表类型（返回图表类型名称，如：折线图、柱状图、散点图等）
-
-数据信息：
-- 数据形状：{shape}
-- 列名：{columns}
-- 数值列：{numeric_columns}
-- 分类列：{categorical_columns}
-- 缺失值：{null_counts}
-- 数据预览：{sample_data}
-
-用户请求：{query}
-
-请严格按如下格式返回：
-[CODE]
-# 画图代码
-import matplotlib.pyplot as plt
-import seaborn as sns
-import plotly.express as px
-import plotly.graph_objects as go
-...
-[ENDCODE]
-[ANALYSIS]
-# 分析文本
-...
-[ENDANALYSIS]
-[CHART_TYPE]
-# 图表类型
-...
-[ENDCHART_TYPE]
-"""
-
-        prompt = ChatPromptTemplate.from_template(template)
-        chain = LLMChain(llm=llm, prompt=prompt)
-        response = chain.run(
-            shape=df_info['shape'],
-            columns=df_info['columns'],
-            numeric_columns=df_info['numeric_columns'],
-            categorical_columns=df_info['categorical_columns'],
-            null_counts=df_info['null_counts'],
-            sample_data=df_info['sample_data'],
-            query=query
+        fingerprint = code_cache.schema_fingerprint(df)
+        if use_cache is not False:
+            entry = code_cache.get_cache().get(fingerprint, query)
+            if entry is not None:
+                if validate is None or validate(entry.code):
+                    return entry.code, entry.analysis, entry.chart_type
+                # 缓存的代码在当前数据上执行失败，失效后重新生成
+                code_cache.get_cache().invalidate(fingerprint, query)
+
+        stream = analyze_csv_stream(
+            df, query, api_key, base_url=base_url, model=model, temperature=temperature, use_cache=use_cache,
+            dataset_hash=dataset_hash
         )
-
-        # 解析返回内容
-        code = ""
-        analysis = ""
-        chart_type = ""
-
-        if "[CODE]" in response and "[ENDCODE]" in response:
-            code = response.split("[CODE]")[1].split("[ENDCODE]")[0].strip()
-
-        if "[ANALYSIS]" in response and "[ENDANALYSIS]" in response:
-            analysis = response.split("[ANALYSIS]")[1].split("[ENDANALYSIS]")[0].strip()
-
-        if "[CHART_TYPE]" in response and "[ENDCHART_TYPE]" in response:
-            chart_type = response.split("[CHART_TYPE]")[1].split("[ENDCHART_TYPE]")[0].strip()
-
+        if on_stream is not None:
+            on_stream(stream)
+        code, analysis, chart_type = parse_analysis_response(stream.collect())
+        if code and validate is not None and validate(code) and use_cache is not False:
+            code_cache.get_cache().put(fingerprint, query, code, chart_type, analysis)
         return code, analysis, chart_type
 
     except Exception as e:
+        # 流式调用抛出的错误已带有前缀
+        if str(e).startswith("CSV分析失败："):
+            raise
         raise Exception(f"CSV分析失败：{str(e)}")
 
 
-def chat_with_ai_enhanced(input_text, api_key, base_url="https://api.openai-hk.com/v1",
-                          chat_history=None, mode="通用助手", model="gpt-4o-mini", temperature=0.7):
+def chat_with_ai_stream(input_text, api_key, base_url="https://api.openai-hk.com/v1",
+                        chat_history=None, mode="通用助手", model="gpt-4o-mini", temperature=0.7,
+                        use_cache=None, memory=None, history_offset=0):
     """
-    增强版AI对话系统
+    增强版AI对话系统（流式）。
+    memory 为 ChatMemory 时使用其滚动摘要和token预算内的最近消息；未传入时只按默认预算截取最近消息。
+    chat_history 只包含完整历史从第 history_offset 条开始的部分时需传入 history_offset
     """
     try:
-        llm = ChatOpenAI(temperature=temperature, openai_api_key=api_key, model_name=model, base_url=base_url)
-
         # 模式提示词
         mode_prompts = {
             "通用助手": "你是一位全能AI助手，能够回答各种问题，提供帮助和建议。",
@@ -340,28 +682,70 @@ def chat_with_ai_enhanced(input_text, api_key, base_url="https://api.openai-hk.c
 
         mode_desc = mode_prompts.get(mode, mode_prompts["通用助手"])
 
-        # 构建对话历史
+        # 构建对话历史：按token预算保留最近消息，更早的内容由滚动摘要代替
+        summary, recent = (memory or chat_memory.ChatMemory()).context(chat_history or [], history_offset)
+        summary_text = f"此前对话摘要：\n{summary}\n\n" if summary else ""
         history_text = ""
-        if chat_history and len(chat_history) > 0:
+        if recent:
             history_parts = []
-            for msg in chat_history[-10:]:  # 只保留最近10轮对话
+            for msg in recent:
                 role = "用户" if msg['role'] == '用户' else "AI助手"
                 history_parts.append(f"{role}: {msg['content']}")
             history_text = "\n".join(history_parts) + "\n\n"
 
-        template = f"""{mode_desc}
+        # 历史与输入作为模板变量传入，内容中的花括号不会被当作占位符
+        return _stream_llm(prompt_templates.get("chat"), {
+            'mode_desc': mode_desc,
+            'summary_text': summary_text,
+            'history_text': history_text,
+            'input_text': input_text
+        }, api_key, base_url, model, temperature, "AI对话失败", use_cache=use_cache)
 
-{history_text}用户: {input_text}
-AI助手: """
+    except Exception as e:
+        raise Exception(f"AI对话失败：{str(e)}")
 
-        prompt = ChatPromptTemplate.from_template(template)
-        chain = LLMChain(llm=llm, prompt=prompt)
-        response = chain.run(input_text=input_text)
 
-        return response
+def chat_with_ai_enhanced(input_text, api_key, base_url="https://api.openai-hk.com/v1",
+                          chat_history=None, mode="通用助手", model="gpt-4o-mini", temperature=0.7,
+                          use_cache=None, memory=None, history_offset=0):
+    """
+    增强版AI对话系统
+    """
+    return chat_with_ai_stream(
+        input_text, api_key, base_url=base_url, chat_history=chat_history, mode=mode,
+        model=model, temperature=temperature, use_cache=use_cache, memory=memory,
+        history_offset=history_offset
+    ).collect()
+
+
+def summarize_chat_history(previous_summary, messages, max_tokens, api_key,
+                           base_url="https://api.openai-hk.com/v1", model="gpt-4o-mini"):
+    """
+    把新移出窗口的消息并入已有摘要，返回更新后的摘要
+    """
+    try:
+        new_text = "\n".join(
+            f"{'用户' if m['role'] == '用户' else 'AI助手'}: {m['content']}" for m in messages
+        )
+        summary = _stream_llm(prompt_templates.get("chat_summary"), {
+            'max_tokens': max_tokens,
+            'previous_summary': previous_summary or "（无）",
+            'new_text': new_text
+        }, api_key, base_url, model, 0.0, "对话摘要失败").collect()
+        return chat_memory.truncate_to_tokens(summary.strip(), max_tokens)
 
     except Exception as e:
-        raise Exception(f"AI对话失败：{str(e)}")
+        raise Exception(f"对话摘要失败：{str(e)}")
+
+
+def update_chat_memory(memory, chat_history, api_key, base_url="https://api.openai-hk.com/v1",
+                       model="gpt-4o-mini", history_offset=0):
+    """
+    每轮对话后调用一次：把移出token预算窗口的消息增量并入 memory 的滚动摘要
+    """
+    return memory.update(chat_history, lambda previous, messages, max_tokens: summarize_chat_history(
+        previous, messages, max_tokens, api_key, base_url=base_url, model=model
+    ), offset=history_offset)
 
 
 # 保留原有函数以保持兼容性